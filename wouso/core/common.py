@@ -76,10 +76,31 @@ class App:
         - inactivate expired spells
         - expire challenges not played
         This method is called from wousocron management task, and the datetime might be faked.
+        Return the number of rows changed, or None.
         """
         pass
 
     management_task = None  # Disable it by default
+    # names of the apps or games whose management task has to run first
+    management_task_depends = ()
+
+
+def bulk_insert(model, objects, batch_size=100):
+    """ Insert objects using bulk_create, in batches small enough for the
+    backend's query parameters limit (sqlite allows 999).
+    """
+    objects = list(objects)
+    for batch in chunks(objects, batch_size):
+        model.objects.bulk_create(batch)
+    return len(objects)
+
+
+def chunks(items, size=500):
+    """ Split items in lists of at most size, as for id__in lookups under the
+    backend's query parameters limit.
+    """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
 
 
 class Item(object):
@@ -1,8 +1,11 @@
+import threading
 from datetime import datetime
 from string import capwords
+from uuid import uuid4
 
 from django.db import models
 from django.core.cache import cache
+from django.core.signals import request_started, request_finished
 
 
 class Setting(models.Model):
@@ -10,10 +13,6 @@ class Setting(models.Model):
     name = models.CharField(max_length=100, primary_key=True)
     value = models.TextField(default='', null=True, blank=True)
 
-    @classmethod
-    def _cache_key(cls, name):
-        return '%s-' % cls.__name__ + name
-
     def set_value(self, v):
         """ value setter, overridden by subclasses """
         self.value = v
@@ -39,21 +38,22 @@ class Setting(models.Model):
 
     @classmethod
     def get(cls, name):
-        """ Get or create a Setting with the name name """
-        cache_key = cls._cache_key(name)
-        if cache_key in cache:
-            return cache.get(cache_key)
-        obj, new = cls.objects.get_or_create(name=name)
-        cache.set(cache_key, obj)
-        return obj
+        """ Get a Setting with the name name, from the settings snapshot.
+        A missing setting has an empty value, and is created when saved.
+        """
+        values = SettingsSnapshot.values()
+        if name in values:
+            return cls(name=name, value=values[name])
+        return cls(name=name)
 
     def save(self, **kwargs):
-        cache_key = self.__class__._cache_key(self.name)
-        cache.delete(cache_key)
-        # Also flush generic
-        cache_key = Setting._cache_key(self.name)
-        cache.delete(cache_key)
-        return super(Setting, self).save(**kwargs)
+        ret = super(Setting, self).save(**kwargs)
+        SettingsSnapshot.bump()
+        return ret
+
+    def delete(self, *args, **kwargs):
+        super(Setting, self).delete(*args, **kwargs)
+        SettingsSnapshot.bump()
 
     @property
     def title(self):
@@ -75,6 +75,59 @@ class Setting(models.Model):
         return self.name
 
 
+class SettingsSnapshot(object):
+    """ The values of all settings, loaded in a process local dictionary.
+
+    A version token in cache is replaced whenever a setting changes, and the
+    dictionary is reloaded when the token differs from the one it was loaded
+    with. The token is checked once per request, or on every lookup outside
+    requests.
+    """
+    VERSION_KEY = 'config-settings-version'
+
+    _values = None
+    _version = None
+    _request = threading.local()
+
+    @classmethod
+    def version(cls):
+        version = cache.get(cls.VERSION_KEY)
+        if version is None:
+            cache.add(cls.VERSION_KEY, uuid4().hex)
+            version = cache.get(cls.VERSION_KEY)
+        return version
+
+    @classmethod
+    def values(cls):
+        """ Return a dictionary of setting name: value """
+        if cls._values is None or not getattr(cls._request, 'checked', False):
+            version = cls.version()
+            if cls._values is None or version != cls._version:
+                cls._values = dict(Setting.objects.values_list('name', 'value'))
+                cls._version = version
+            cls._request.checked = getattr(cls._request, 'active', False)
+        return cls._values
+
+    @classmethod
+    def bump(cls):
+        cache.set(cls.VERSION_KEY, uuid4().hex)
+        cls._values = None
+
+    @classmethod
+    def request_started(cls, **kwargs):
+        cls._request.active = True
+        cls._request.checked = False
+
+    @classmethod
+    def request_finished(cls, **kwargs):
+        cls._request.active = False
+        cls._request.checked = False
+
+
+request_started.connect(SettingsSnapshot.request_started, weak=False)
+request_finished.connect(SettingsSnapshot.request_finished, weak=False)
+
+
 class HTMLSetting(Setting):
     """ Setting storing a generic text or HTML """
     class Meta:
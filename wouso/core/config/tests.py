@@ -1,6 +1,6 @@
 from django.test import TestCase
 from django.core.cache import cache
-from models import Setting, BoolSetting, HTMLSetting, ChoicesSetting
+from models import Setting, BoolSetting, HTMLSetting, ChoicesSetting, SettingsSnapshot
 
 
 class TestSettings(TestCase):
@@ -10,7 +10,7 @@ class TestSettings(TestCase):
         cache.clear()
 
     def test_setting_type(self):
-        a = BoolSetting.get('test-name')  # automatically created
+        a = BoolSetting.get('test-name')  # created when saved
 
         self.assertTrue(a)
         self.assertIsInstance(a, Setting)
@@ -52,3 +52,41 @@ class TestSettings(TestCase):
 
         a.set_value('e')
         self.assertEqual(a.get_value(), 'e')
+
+
+class TestSettingsSnapshot(TestCase):
+    def setUp(self):
+        cache.clear()
+        Setting.objects.create(name='snapshot-test', value='first')
+
+    def test_no_queries_when_loaded(self):
+        self.assertEqual(Setting.get('snapshot-test').get_value(), 'first')
+        with self.assertNumQueries(0):
+            self.assertEqual(Setting.get('snapshot-test').get_value(), 'first')
+            self.assertFalse(BoolSetting.get('snapshot-missing').get_value())
+        self.assertFalse(Setting.objects.filter(name='snapshot-missing').exists())
+
+    def test_refresh_on_save(self):
+        Setting.get('snapshot-test').set_value('second')
+        self.assertEqual(Setting.get('snapshot-test').get_value(), 'second')
+
+        BoolSetting.get('snapshot-new').set_value(True)
+        self.assertTrue(BoolSetting.get('snapshot-new').get_value())
+
+    def test_refresh_on_version_change(self):
+        self.assertEqual(Setting.get('snapshot-test').get_value(), 'first')
+        # another process changed a setting
+        Setting.objects.filter(name='snapshot-test').update(value='changed')
+        cache.set(SettingsSnapshot.VERSION_KEY, 'other')
+        self.assertEqual(Setting.get('snapshot-test').get_value(), 'changed')
+
+    def test_checked_once_per_request(self):
+        SettingsSnapshot.request_started()
+        try:
+            self.assertEqual(Setting.get('snapshot-test').get_value(), 'first')
+            Setting.objects.filter(name='snapshot-test').update(value='changed')
+            cache.set(SettingsSnapshot.VERSION_KEY, 'other')
+            self.assertEqual(Setting.get('snapshot-test').get_value(), 'first')
+        finally:
+            SettingsSnapshot.request_finished()
+        self.assertEqual(Setting.get('snapshot-test').get_value(), 'changed')
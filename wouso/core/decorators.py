@@ -3,6 +3,7 @@ from django.contrib.auth.decorators import user_passes_test
 from django.http import Http404
 import inspect
 import logging
+import threading
 
 
 def staff_required(function=None, login_url=None):
@@ -55,13 +56,28 @@ def _get_cache_key(function, *args, **kwargs):
     return cache_key
 
 
+class CacheStats(threading.local):
+    """ cached_method hits and misses of the current thread, since the last reset """
+    hits = 0
+    misses = 0
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+
+cache_stats = CacheStats()
+
+
 def cached_method(function=None):
     def _dec(function):
         def _cached(*args, **kwargs):
             cache_key = _get_cache_key(function, *args, **kwargs)
             if cache_key in cache:
                 logging.debug('Returning  : %s' % cache_key)
+                cache_stats.hits += 1
                 return cache.get(cache_key)
+            cache_stats.misses += 1
             result = function(*args, **kwargs)
             cache.set(cache_key, result)
             logging.debug('Setting    : %s' % cache_key)
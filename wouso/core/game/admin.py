@@ -2,3 +2,11 @@ from django.contrib import admin
 from wouso.core.game.models import *
 
 admin.site.register(Game)
+
+
+class CronTaskRunAdmin(admin.ModelAdmin):
+    list_display = ('name', 'run', 'started', 'duration', 'rows', 'succeeded')
+    list_filter = ('name', 'succeeded')
+
+admin.site.register(CronRun)
+admin.site.register(CronTaskRun, CronTaskRunAdmin)
@@ -0,0 +1,135 @@
+"""
+Scheduling of the app and game management tasks, run by wousocron.
+
+A task runs once the tasks it depends on (management_task_depends) are done.
+Tasks not depending on each other can run in a pool of processes, each with
+its own database connection. Every task is recorded as a CronTaskRun as soon
+as it ends, so an interrupted or failed run can be resumed, skipping the
+tasks that already succeeded.
+"""
+import multiprocessing
+import sys
+import time
+import traceback
+from datetime import datetime
+from StringIO import StringIO
+from django.db import connection, transaction
+from django.utils.datastructures import SortedDict
+from wouso.core.game.models import CronRun, CronTaskRun
+
+
+def get_tasks():
+    """ Return a dictionary of name: app or game class, for those having a management task """
+    from wouso.core.game import get_games
+    from wouso.interface.apps import get_apps
+
+    return SortedDict((t.name(), t) for t in list(get_apps()) + list(get_games()) if t.management_task)
+
+
+def run_task(name, task):
+    """ Run the management task of the app or game, return a dictionary of its results.
+    Errors are caught.
+    """
+    output = StringIO()
+    start = time.time()
+    result = dict(name=name, rows=None, error='')
+    try:
+        result['rows'] = task.management_task(stdout=output)
+    except Exception:
+        result['error'] = traceback.format_exc()
+        transaction.rollback_unless_managed()
+    result.update(duration=time.time() - start, output=output.getvalue())
+    return result
+
+
+class Scheduler(object):
+    # seconds between checks for finished tasks, when running in parallel
+    POLL = 0.1
+
+    def __init__(self, tasks=None, processes=1, stdout=sys.stdout):
+        self.tasks = tasks if tasks is not None else get_tasks()
+        self.processes = processes
+        self.stdout = stdout
+
+    def _pending_depends(self, name, pending):
+        return [d for d in self.tasks[name].management_task_depends if d in pending]
+
+    def check(self, names):
+        """ Raise ValueError if the tasks to run depend on each other in a cycle """
+        pending = set(names)
+        while pending:
+            ready = [n for n in pending if not self._pending_depends(n, pending)]
+            if not ready:
+                raise ValueError('Circular task dependencies: %s' % ', '.join(sorted(pending)))
+            pending.difference_update(ready)
+
+    def run(self, names, run):
+        """ Run the named tasks, recording them in run. Return the names of the failed
+        tasks, and of those skipped because a dependency failed.
+
+        Dependencies on tasks outside names are considered done.
+        """
+        self.check(names)
+        names = [n for n in self.tasks if n in names]
+        pending, running, failed = set(names), {}, set()
+        pool = None
+        if self.processes > 1:
+            # the workers are forked now, and open their own connections
+            connection.close()
+            pool = multiprocessing.Pool(self.processes)
+        try:
+            while pending or running:
+                for name in [n for n in names if n in pending]:
+                    depends = set(self._pending_depends(name, pending | set(running) | failed))
+                    if depends & failed:
+                        pending.discard(name)
+                        self._finish(run, dict(name=name, rows=None, duration=0, output='',
+                                               error='Depends on failed %s' % ', '.join(sorted(depends & failed))),
+                                     failed)
+                    elif not depends:
+                        pending.discard(name)
+                        if pool is None:
+                            self._finish(run, run_task(name, self.tasks[name]), failed)
+                        else:
+                            running[name] = pool.apply_async(run_task, (name, self.tasks[name]))
+
+                done = [n for n, r in running.items() if r.ready()]
+                for name in done:
+                    self._finish(run, running.pop(name).get(), failed)
+                if running and not done:
+                    time.sleep(self.POLL)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return failed
+
+    def _finish(self, run, result, failed):
+        """ Record and print the result of a task, adding it to failed if it did not succeed """
+        succeeded = not result['error']
+        CronTaskRun.objects.create(run=run, name=result['name'], duration=result['duration'],
+                                   rows=result['rows'], succeeded=succeeded, error=result['error'])
+        self.stdout.write('%s ...\n%s' % (result['name'], result['output']))
+        if succeeded:
+            rows = '' if result['rows'] is None else '%d rows, ' % result['rows']
+            self.stdout.write(' done: %s%.2fs\n' % (rows, result['duration']))
+        else:
+            self.stdout.write(' FAILED: %s\n' % result['error'])
+            failed.add(result['name'])
+
+
+def start_run(resume=False):
+    """ Return (run, names of the tasks already done). With resume, the last run
+    is continued if it did not finish.
+    """
+    if resume:
+        last = CronRun.objects.order_by('-id')[:1]
+        if last and last[0].finished is None:
+            return last[0], last[0].succeeded_tasks()
+    return CronRun.objects.create(), set()
+
+
+def finish_run(run, failed):
+    if not failed:
+        run.finished = datetime.now()
+        run.save()
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from optparse import make_option
+from south.management.commands import patch_for_test_db_setup
+from wouso.utils import benchmark
+
+
+class Command(BaseCommand):
+    args = '[case ...]'
+    help = 'Benchmark the game hot paths on a generated dataset, in a throwaway test database'
+    option_list = BaseCommand.option_list + (
+        make_option('--players', type='int', dest='players', default=1000),
+        make_option('--races', type='int', dest='races', default=3),
+        make_option('--groups', type='int', dest='groups', default=6),
+        make_option('--questions', type='int', dest='questions', default=200),
+        make_option('--days', type='int', dest='history_days', default=7,
+                    help='Recorded top days'),
+        make_option('--activities', type='int', dest='activities', default=10,
+                    help='Activity rows per player'),
+        make_option('--seed', type='int', dest='seed', default=0),
+        make_option('--rounds', type='int', dest='rounds', default=20),
+        make_option('--output', dest='output', default=None,
+                    help='Write the results to this JSON file'),
+        make_option('--compare', dest='compare', default=None,
+                    help='Compare the results with a previous JSON file'),
+        make_option('--list', action='store_true', dest='list', default=False,
+                    help='List the benchmark cases'),
+    )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in benchmark.get_cases():
+                self.stdout.write('%s\n' % name)
+            return
+
+        unknown = set(args) - set(benchmark.get_cases())
+        if unknown:
+            raise CommandError('Unknown cases: %s' % ', '.join(sorted(unknown)))
+        previous = benchmark.load(options['compare']) if options['compare'] else None
+
+        dataset = benchmark.Dataset(**dict((k, options[k]) for k in
+                                           ('players', 'races', 'groups', 'questions', 'history_days',
+                                            'activities', 'seed')))
+        old_name = connection.settings_dict['NAME']
+        # build the tables the way the test runner does, migrations included
+        patch_for_test_db_setup()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write('Generating %s\n' % dataset.parameters)
+            dataset.generate()
+            results = benchmark.run(dataset, options['rounds'], args)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write('%-32s %12s %10s %12s\n' % ('case', 'ms/round', 'queries', 'peak KB'))
+        for r in results:
+            self.stdout.write('%-32s %12.2f %10.1f %12d\n' % (r['name'], r['per_round'] * 1000,
+                                                               r['queries_per_round'], r['peak_memory_kb']))
+
+        report = benchmark.report(dataset, results)
+        if options['output']:
+            benchmark.save(report, options['output'])
+        if previous is not None:
+            self.stdout.write('\n%-32s %12s %12s %8s\n' % ('case', 'old ms', 'new ms', 'ratio'))
+            for name, before, after, ratio in benchmark.compare(previous, report):
+                self.stdout.write('%-32s %12.2f %12.2f %8s\n' % (name, before * 1000, after * 1000,
+                                                                 '%.2f' % ratio if ratio else '-'))
@@ -1,30 +1,59 @@
 from datetime import datetime
 from django.core.management.base import BaseCommand, CommandError
-from wouso.core.game import get_games
+from optparse import make_option
 from wouso.core.config.models import Setting
+from wouso.core.game.cron import Scheduler, get_tasks, start_run, finish_run
+from wouso.core.user.presence import Presence
+
+
+def _names(value):
+    return [n.strip() for n in value.split(',') if n.strip()] if value else []
 
 
 class Command(BaseCommand):
     help = 'Wouso repetitive tasks (cron)'
+    option_list = BaseCommand.option_list + (
+        make_option('--only', dest='only', default='',
+                    help='Comma separated names of the tasks to run'),
+        make_option('--skip', dest='skip', default='',
+                    help='Comma separated names of the tasks not to run'),
+        make_option('--processes', type='int', dest='processes', default=1,
+                    help='Run independent tasks in parallel, in this many processes'),
+        make_option('--resume', action='store_true', dest='resume', default=False,
+                    help='Continue the last run if it did not finish, skipping the tasks that succeeded'),
+        make_option('--list', action='store_true', dest='list', default=False,
+                    help='List the tasks and their dependencies'),
+    )
 
     def handle(self, *args, **options):
-        self.stdout.write('Starting at: %s\n' % datetime.now())
+        tasks = get_tasks()
+        if options['list']:
+            for name, task in tasks.iteritems():
+                self.stdout.write('%s %s\n' % (name, ', '.join(task.management_task_depends)))
+            return
 
-        # Now handle other apps
-        from wouso.interface.apps import get_apps
-        apps = get_apps()
+        only, skip = _names(options['only']), _names(options['skip'])
+        unknown = set(only + skip) - set(tasks)
+        if unknown:
+            raise CommandError('Unknown tasks: %s' % ', '.join(sorted(unknown)))
+
+        self.stdout.write('Starting at: %s\n' % datetime.now())
+        run, done = start_run(options['resume'])
+        if done:
+            self.stdout.write('Resuming run of %s, done: %s\n' % (run.started, ', '.join(sorted(done))))
+        names = [n for n in tasks if (not only or n in only) and n not in skip and n not in done]
 
-        for a in apps:
-            if a.management_task:
-                self.stdout.write('%s ...\n' % a.name())
-                a.management_task(stdout=self.stdout)
+        scheduler = Scheduler(tasks, processes=max(options['processes'], 1), stdout=self.stdout)
+        try:
+            failed = scheduler.run(names, run)
+        except ValueError as e:
+            raise CommandError(e)
+        finish_run(run, failed)
 
-        # Now handle games
-        for g in get_games():
-            if g.management_task:
-                self.stdout.write('%s ...\n' % g.name())
-                g.management_task(stdout=self.stdout)
+        Presence.flush()
 
         now = datetime.now()
         Setting.get('wousocron_lastrun').set_value('%s' % now)
+        if failed:
+            self.stdout.write('Failed: %s, run again with --resume\n' % ', '.join(sorted(failed)))
         self.stdout.write('Finished at: %s\n' % now)
@@ -1,4 +1,5 @@
 import logging
+from datetime import datetime
 from django.db import models
 from django.core.urlresolvers import reverse
 from wouso.core.common import App, CachedItem
@@ -57,3 +58,29 @@ class Game(CachedItem, models.Model, App):
 
     def __unicode__(self):
         return self.name
+
+
+class CronRun(models.Model):
+    """ A wousocron run. Unfinished runs, interrupted or with failed tasks, can be resumed. """
+    started = models.DateTimeField(default=datetime.now)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def succeeded_tasks(self):
+        return set(self.tasks.filter(succeeded=True).values_list('name', flat=True))
+
+    def __unicode__(self):
+        return u'%s' % self.started
+
+
+class CronTaskRun(models.Model):
+    """ Duration and outcome of one management task in a wousocron run """
+    run = models.ForeignKey(CronRun, related_name='tasks')
+    name = models.CharField(max_length=100)
+    started = models.DateTimeField(default=datetime.now)
+    duration = models.FloatField(default=0)
+    rows = models.IntegerField(null=True, blank=True, help_text='Rows changed, as returned by the task')
+    succeeded = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return u'%s %s' % (self.name, self.started)
@@ -1,6 +1,9 @@
+from StringIO import StringIO
 from django.core.management import call_command
 from django.test import TestCase
-from models import Game
+from wouso.core.common import App
+from wouso.core.game.cron import Scheduler, start_run, finish_run
+from models import Game, CronRun, CronTaskRun
 
 
 class TestGame(Game):
@@ -18,3 +21,77 @@ class TestGameModule(TestCase):
         self.assertFalse(TestGame.get_modifiers())
         self.assertFalse(gi.get_game_absolute_url())
         self.assertEqual(gi.__unicode__(), gi.name)
+
+
+_ran = []
+
+
+class FirstTask(App):
+    @classmethod
+    def management_task(cls, stdout=None):
+        _ran.append(cls.name())
+        return 3
+
+
+class SecondTask(App):
+    management_task_depends = ('firsttask',)
+
+    @classmethod
+    def management_task(cls, stdout=None):
+        _ran.append(cls.name())
+
+
+class BrokenTask(App):
+    @classmethod
+    def management_task(cls, stdout=None):
+        raise Exception('broken')
+
+
+class AfterBrokenTask(App):
+    management_task_depends = ('brokentask',)
+
+    @classmethod
+    def management_task(cls, stdout=None):
+        _ran.append(cls.name())
+
+
+class SchedulerTest(TestCase):
+    def setUp(self):
+        del _ran[:]
+        tasks = (SecondTask, FirstTask, BrokenTask, AfterBrokenTask)
+        self.scheduler = Scheduler(dict((t.name(), t) for t in tasks), stdout=StringIO())
+
+    def test_dependencies_first(self):
+        run, done = start_run()
+        failed = self.scheduler.run(['secondtask', 'firsttask'], run)
+        finish_run(run, failed)
+
+        self.assertFalse(failed)
+        self.assertEqual(_ran, ['firsttask', 'secondtask'])
+        self.assertEqual(CronTaskRun.objects.get(name='firsttask').rows, 3)
+        self.assertTrue(CronRun.objects.get(pk=run.pk).finished)
+
+    def test_failed_dependency_and_resume(self):
+        run, done = start_run()
+        failed = self.scheduler.run(['firsttask', 'brokentask', 'afterbrokentask'], run)
+        finish_run(run, failed)
+
+        self.assertEqual(failed, set(['brokentask', 'afterbrokentask']))
+        self.assertEqual(_ran, ['firsttask'])
+        self.assertTrue('broken' in CronTaskRun.objects.get(name='brokentask').error)
+        self.assertFalse(CronRun.objects.get(pk=run.pk).finished)
+
+        resumed, done = start_run(resume=True)
+        self.assertEqual(resumed, run)
+        self.assertEqual(done, set(['firsttask']))
+
+    def test_circular_dependencies(self):
+        class CircularTask(FirstTask):
+            management_task_depends = ('secondtask',)
+
+        self.scheduler.tasks['firsttask'] = CircularTask
+        self.assertRaises(ValueError, self.scheduler.check, ['firsttask', 'secondtask'])
+
+    def test_wousocron_only(self):
+        call_command('wousocron', only='top', stdout=StringIO())
+        self.assertEqual(list(CronTaskRun.objects.values_list('name', 'succeeded')), [('top', True)])
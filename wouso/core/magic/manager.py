@@ -1,10 +1,13 @@
 from django.db.utils import IntegrityError
 import logging
+import time
 from datetime import datetime, timedelta
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import ugettext as _
 from wouso.core import signals
 from wouso.core.god import God
-from wouso.core.magic.models import PlayerSpellDue, PlayerSpellAmount, PlayerArtifactAmount
+from wouso.core.magic.models import PlayerSpellDue, PlayerSpellAmount, PlayerArtifactAmount, Artifact, Spell
 
 
 class MagicException(Exception):
@@ -15,6 +18,76 @@ class InsufficientAmount(MagicException):
     pass
 
 
+class ModifierSnapshot(object):
+    """ All the artifacts and spells a player has, loaded in two queries
+    and cached until one of them changes.
+    """
+    VERSION_KEY = 'magic-snapshot-version'
+
+    def __init__(self, player):
+        self.artifacts, self.spells = {}, {}
+        for paamount in PlayerArtifactAmount.objects.filter(player=player).select_related('artifact'):
+            self.artifacts.setdefault(paamount.artifact.name, []).append(paamount)
+        for psdue in PlayerSpellDue.objects.filter(player=player).select_related('spell'):
+            self.spells.setdefault(psdue.spell.name, []).append((psdue.due, psdue.spell.percents))
+
+    @classmethod
+    def _cache_key(cls, player_id):
+        # Changing an artifact or spell definition bumps the version, dropping all snapshots
+        version = cache.get(cls.VERSION_KEY)
+        if version is None:
+            version = cls.bump_version()
+        return 'magic-snapshot-%s-%s' % (version, player_id)
+
+    @classmethod
+    def bump_version(cls):
+        version = repr(time.time())
+        cache.set(cls.VERSION_KEY, version)
+        return version
+
+    @classmethod
+    def get(cls, player):
+        key = cls._cache_key(player.id)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = cls(player)
+            cache.set(key, snapshot)
+        return snapshot
+
+    @classmethod
+    def drop(cls, player_id):
+        cache.delete(cls._cache_key(player_id))
+
+    def has_modifier(self, modifier):
+        if modifier in self.artifacts:
+            return self.artifacts[modifier][0]
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        return any(due >= today for due, percents in self.spells.get(modifier, []))
+
+    def modifier_percents(self, modifier):
+        percents = 100
+        for a in self.artifacts.get(modifier, []):
+            percents += a.amount * a.artifact.percents
+        for due, spell_percents in self.spells.get(modifier, []):
+            percents += spell_percents
+        return percents
+
+
+def _drop_player_snapshot(sender, instance, **kwargs):
+    ModifierSnapshot.drop(instance.player_id)
+
+
+def _drop_all_snapshots(sender, **kwargs):
+    ModifierSnapshot.bump_version()
+
+for model in (PlayerArtifactAmount, PlayerSpellDue):
+    post_save.connect(_drop_player_snapshot, model)
+    post_delete.connect(_drop_player_snapshot, model)
+for model in (Artifact, Spell):
+    post_save.connect(_drop_all_snapshots, model)
+    post_delete.connect(_drop_all_snapshots, model)
+
+
 class MagicManager(object):
     def __init__(self, player):
         self.player = player
@@ -55,34 +128,21 @@ class MagicManager(object):
                 pass
         return players
 
+    @property
+    def snapshot(self):
+        """ The ModifierSnapshot of this player, use it when checking many modifiers """
+        return ModifierSnapshot.get(self.player)
+
     def has_modifier(self, modifier):
         """ Check for an artifact with id = modifier
         or for an active spell cast on me with id = modifier
         """
-        try:
-            return PlayerArtifactAmount.objects.get(player=self.player, artifact__name=modifier)
-        except PlayerArtifactAmount.DoesNotExist:
-            pass
-
-        try:
-            return PlayerSpellDue.objects.filter(player=self.player, spell__name=modifier, due__gte=datetime.now().date()).count() > 0
-        except PlayerSpellDue.DoesNotExist:
-            pass
-        return False
+        return self.snapshot.has_modifier(modifier)
 
     def modifier_percents(self, modifier):
         """ Return the percents integer value of given modifier
         """
-        percents = 100
-        res = PlayerArtifactAmount.objects.filter(player=self.player, artifact__name=modifier)
-        for a in res:
-            percents += a.amount * a.artifact.percents
-            # now add spells to that
-        res = PlayerSpellDue.objects.filter(player=self.player, spell__name=modifier)
-        for a in res:
-            percents += a.spell.percents
-
-        return percents
+        return self.snapshot.modifier_percents(modifier)
 
     def use_modifier(self, modifier, amount):
         """ Substract amount of modifier artifact from players collection.
@@ -90,7 +150,10 @@ class MagicManager(object):
         If the amount after substraction is zero, delete the corresponding
         artifact amount object.
         """
-        paamount = self.has_modifier(modifier)
+        try:
+            paamount = PlayerArtifactAmount.objects.filter(player=self.player, artifact__name=modifier)[0]
+        except IndexError:
+            raise InsufficientAmount()
         if amount > paamount.amount:
             raise InsufficientAmount()
 
@@ -7,7 +7,7 @@ from django.utils.translation import ugettext as _
 from django.conf import settings
 from wouso.core.common import App, Item, CachedItem
 from wouso.core import signals
-from wouso.core.ui import register_header_link
+from wouso.core.ui import register_header_link, invalidate_blocks, BlockCache
 
 
 class Modifier(models.Model):
@@ -265,5 +265,13 @@ class Bazaar(App):
 
             signals.postExpire.send(sender=None, psdue=s)
             s.delete()
+        return len(spells)
 
-register_header_link('bazaar', Bazaar.get_header_link)
+register_header_link('bazaar', Bazaar.get_header_link, BlockCache(BlockCache.PLAYER, keys=('spells',)))
+
+
+def spell_due_changed(sender, instance, **kwargs):
+    invalidate_blocks('spells', instance.player_id)
+
+models.signals.post_save.connect(spell_due_changed, PlayerSpellDue)
+models.signals.post_delete.connect(spell_due_changed, PlayerSpellDue)
@@ -1,4 +1,5 @@
 import unittest
+from StringIO import StringIO
 from datetime import datetime, timedelta
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
@@ -49,6 +50,34 @@ class ManagerTestCase(WousoTest):
         self.player.magic.use_modifier('modifier-name', 1)
         self.assertFalse(self.player.magic.has_modifier('modifier-name'))
 
+    def test_modifier_snapshot(self):
+        Artifact.objects.create(name='modifier-name', percents=50)
+        self.player.magic.give_modifier('modifier-name', 1)
+        self.player.magic.has_modifier('other')
+
+        def check():
+            for i in range(10):
+                self.assertTrue(self.player.magic.has_modifier('modifier-name'))
+                self.assertFalse(self.player.magic.has_modifier('other-%d' % i))
+                self.assertEqual(self.player.magic.modifier_percents('modifier-name'), 150)
+        self.assertNumQueries(0, check)
+
+        self.player.magic.give_modifier('modifier-name', 1)
+        self.assertEqual(self.player.magic.modifier_percents('modifier-name'), 200)
+
+    def test_modifier_snapshot_spells(self):
+        spell = Spell.objects.create(name='le-spell-snapshot', percents=-20)
+        source = self._get_player(1)
+        source.magic.add_spell(spell)
+        self.assertFalse(self.player.magic.has_modifier('le-spell-snapshot'))
+
+        self.player.magic.cast_spell(spell, source, datetime.now() + timedelta(days=1))
+        self.assertTrue(self.player.magic.has_modifier('le-spell-snapshot'))
+        self.assertEqual(self.player.magic.modifier_percents('le-spell-snapshot'), 80)
+
+        Bazaar.management_task(datetime=datetime.now() + timedelta(days=2), stdout=StringIO())
+        self.assertFalse(self.player.magic.has_modifier('le-spell-snapshot'))
+
     def test_cast_spell(self):
         spell1 = Spell.objects.create(name='le-spell')
         spell2 = Spell.objects.create(name='le-spell2', mass=True, type='o')
@@ -57,10 +57,9 @@ def get_questions_with_tag_and_category(tag=None, category='all', active_only=Tr
 
 def get_questions_with_tag_for_day(tag, select):
     if isinstance(tag, str):
-        query = Question.objects.filter(tags__name=tag).exclude(endorsed_by__isnull=True)
-        for q in query:
-            if q.day == select:
-                return q
+        query = Question.objects.filter(tags__name=tag, schedule__day=select).exclude(endorsed_by__isnull=True)
+        for q in query[:1]:
+            return q
         return None
 
 
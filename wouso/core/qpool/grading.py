@@ -0,0 +1,124 @@
+"""
+Grading of responses to qpool questions.
+
+A response set is a dictionary of question id: checked answer ids. The
+answer keys (ids of the active answers of a question, and which of them are
+correct) are cached per question and dropped whenever the question or one of
+its answers changes, so grading does not read the answers again.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from wouso.core.qpool.models import Question, Answer
+
+
+class AnswerKey(object):
+    """ Correct and wrong active answers of a question """
+    CACHE_KEY = 'qpool-answer-key-%d'
+
+    def __init__(self, question_id, correct, wrong):
+        self.question_id = question_id
+        self.correct = frozenset(correct)
+        self.wrong = frozenset(wrong)
+
+    @property
+    def answers(self):
+        return self.correct | self.wrong
+
+    @classmethod
+    def get_many(cls, question_ids):
+        """ Return a dictionary of question id: AnswerKey, raise Question.DoesNotExist
+        if a question is missing.
+        """
+        question_ids = set(int(id) for id in question_ids)
+        cached = cache.get_many([cls.CACHE_KEY % id for id in question_ids])
+        keys = dict((k.question_id, k) for k in cached.itervalues())
+
+        missing = question_ids - set(keys)
+        if missing:
+            answers = {}
+            for id in missing:
+                answers[id] = ([], [])
+            for question_id, answer_id, correct in Answer.objects.filter(question__in=missing, active=True).\
+                    values_list('question', 'id', 'correct'):
+                answers[question_id][0 if correct else 1].append(answer_id)
+            # questions without active answers still have to exist
+            empty = [id for id, (correct, wrong) in answers.iteritems() if not correct and not wrong]
+            if empty and Question.objects.filter(id__in=empty).count() != len(empty):
+                raise Question.DoesNotExist('Question matching query does not exist.')
+
+            new = dict((id, cls(id, correct, wrong)) for id, (correct, wrong) in answers.iteritems())
+            cache.set_many(dict((cls.CACHE_KEY % id, k) for id, k in new.iteritems()))
+            keys.update(new)
+        return keys
+
+    @classmethod
+    def drop(cls, question_id):
+        cache.delete(cls.CACHE_KEY % question_id)
+
+
+class Grader(object):
+    """ Grade responses against the answer keys of their questions.
+
+    The keys of all questions in the given response sets are loaded at once.
+    """
+    def __init__(self, *response_sets):
+        question_ids = set()
+        for responses in response_sets:
+            question_ids.update(responses.keys())
+        self.keys = AnswerKey.get_many(question_ids)
+
+    def is_correct(self, question_id, answer_id):
+        return answer_id in self.keys[int(question_id)].correct
+
+    def is_answer(self, question_id, answer_id):
+        return answer_id in self.keys[int(question_id)].answers
+
+    def partial_score(self, question_id, checked):
+        """ Score between 0 and 1: the fraction of correct answers checked, minus the
+        fraction of wrong answers checked. Return (score, checked correct count, correct count).
+        """
+        key = self.keys[int(question_id)]
+        checked = set(checked)
+        right = len(checked & key.correct)
+        wrong = len(checked & key.wrong)
+        if not key.correct:
+            score = 1 if not checked else 0
+        elif not key.wrong:
+            score = 1 if len(checked) == len(key.correct) else 0
+        else:
+            score = float(right) / len(key.correct) - float(wrong) / len(key.wrong)
+        return max(score, 0), right, len(key.correct)
+
+    def challenge_points(self, responses):
+        """ Sum of partial scores, out of 100 per question, and per question
+        (checked correct count, correct count) results.
+        """
+        points = 0.0
+        results = {}
+        for question_id, checked in responses.iteritems():
+            score, right, correct_count = self.partial_score(question_id, checked)
+            points += score
+            results[question_id] = (right, correct_count)
+        return {'points': int(100.0 * points), 'results': results}
+
+    def is_right(self, question_id, checked):
+        """ Exactly the correct answers are checked """
+        return set(checked) == self.keys[int(question_id)].correct
+
+    def correct_count(self, responses):
+        """ Number of questions with exactly the correct answers checked """
+        return len([q for q, checked in responses.iteritems() if self.is_right(q, checked)])
+
+
+def _drop_question_key(sender, instance, **kwargs):
+    AnswerKey.drop(instance.id)
+
+
+def _drop_answer_key(sender, instance, **kwargs):
+    AnswerKey.drop(instance.question_id)
+
+
+post_save.connect(_drop_question_key, Question)
+post_delete.connect(_drop_question_key, Question)
+post_save.connect(_drop_answer_key, Answer)
+post_delete.connect(_drop_answer_key, Answer)
@@ -35,6 +35,9 @@ class Tag(models.Model):
         self.active = True
         self.save()
         self.question_set.update(active=True)
+        # queryset updates do not send signals
+        from wouso.core.qpool.sampler import QuestionSampler
+        QuestionSampler.invalidate()
 
     def set_inactive(self):
         """ Same as activating, updates all Question objects with the
@@ -45,6 +48,9 @@ class Tag(models.Model):
         self.active = False
         self.save()
         self.question_set.update(active=False)
+        # queryset updates do not send signals
+        from wouso.core.qpool.sampler import QuestionSampler
+        QuestionSampler.invalidate()
 
 
 class Question(models.Model):
@@ -193,3 +199,4 @@ class Schedule(models.Model):
 
     def __unicode__(self):
         return str(self.day)
+
@@ -0,0 +1,106 @@
+"""
+Random sampling of qpool questions.
+
+The ids of the questions matching a (category, tag, active, endorsed)
+filter are cached as a list, so drawing k questions is a sample over the
+list and a query for the k chosen rows only. Cached lists carry a version
+number, bumped whenever a question, its tags or a tag changes.
+"""
+import random
+from md5 import md5
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from wouso.core.qpool.models import Question, Tag
+
+
+class QuestionSampler(object):
+    CACHE_KEY = 'qpool-sampler-%d-%s'
+    VERSION_KEY = 'qpool-sampler-version'
+    SEEN_KEY = 'qpool-sampler-seen-%d-%s'
+    TIMEOUT = 24 * 60 * 60
+    # how many questions per category are remembered as seen by a player
+    SEEN_SIZE = 50
+
+    @classmethod
+    def version(cls):
+        version = cache.get(cls.VERSION_KEY)
+        if version is None:
+            cache.add(cls.VERSION_KEY, 1, cls.TIMEOUT)
+            version = cache.get(cls.VERSION_KEY) or 1
+        return version
+
+    @classmethod
+    def invalidate(cls):
+        try:
+            cache.incr(cls.VERSION_KEY)
+        except ValueError:
+            cache.set(cls.VERSION_KEY, 1, cls.TIMEOUT)
+
+    @classmethod
+    def ids(cls, category=None, tag=None, active_only=True, endorsed_only=False):
+        """ Return the ids of the questions matching the filter. category and tag are names. """
+        filter = repr((category, tag, bool(active_only), bool(endorsed_only)))
+        key = cls.CACHE_KEY % (cls.version(), md5(filter).hexdigest())
+        ids = cache.get(key)
+        if ids is None:
+            questions = Question.objects.all()
+            if category is not None:
+                questions = questions.filter(category__name=category)
+            if tag is not None:
+                questions = questions.filter(tags__name=tag)
+            if active_only:
+                questions = questions.filter(active=True)
+            if endorsed_only:
+                questions = questions.exclude(endorsed_by__isnull=True)
+            ids = list(questions.values_list('id', flat=True).distinct().order_by('id'))
+            cache.set(key, ids, cls.TIMEOUT)
+        return ids
+
+    @classmethod
+    def count(cls, *args, **kwargs):
+        return len(cls.ids(*args, **kwargs))
+
+    @classmethod
+    def sample_ids(cls, k, category=None, tag=None, active_only=True, endorsed_only=False, players=()):
+        """ Return at most k random ids. Questions recently seen by any of the players
+        are only chosen when there are not enough other questions.
+        """
+        ids = cls.ids(category, tag, active_only, endorsed_only)
+        seen = set()
+        for player in players:
+            seen.update(cls.seen(player, category))
+        # draw enough ids to be left with k after dropping the seen ones
+        drawn = random.sample(ids, min(len(ids), k + len(seen)))
+        chosen = [id for id in drawn if id not in seen][:k]
+        if len(chosen) < k:
+            chosen.extend([id for id in drawn if id in seen][:k - len(chosen)])
+        return chosen
+
+    @classmethod
+    def sample(cls, k, *args, **kwargs):
+        """ Return a list of at most k random questions, see sample_ids """
+        ids = cls.sample_ids(k, *args, **kwargs)
+        questions = Question.objects.in_bulk(ids)
+        return [questions[id] for id in ids if id in questions]
+
+    @classmethod
+    def seen(cls, player, category=None):
+        return cache.get(cls.SEEN_KEY % (player.id, category)) or []
+
+    @classmethod
+    def mark_seen(cls, player, questions, category=None):
+        """ Remember the questions as recently seen by player """
+        key = cls.SEEN_KEY % (player.id, category)
+        recent = [q.id for q in questions] + cls.seen(player, category)
+        cache.set(key, recent[:cls.SEEN_SIZE], cls.TIMEOUT)
+
+
+def _invalidate(sender, **kwargs):
+    QuestionSampler.invalidate()
+
+
+post_save.connect(_invalidate, Question)
+post_delete.connect(_invalidate, Question)
+post_save.connect(_invalidate, Tag)
+post_delete.connect(_invalidate, Tag)
+m2m_changed.connect(_invalidate, Question.tags.through)
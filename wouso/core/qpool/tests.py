@@ -1,7 +1,10 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from models import *
+from django.core.cache import cache
 from wouso.core.qpool import get_questions_with_tags
+from wouso.core.qpool.grading import Grader
+from wouso.core.qpool.sampler import QuestionSampler
 
 
 class QpoolTestCase(TestCase):
@@ -163,3 +166,100 @@ class ScheduleTest(TestCase):
         self.assertFalse(q.day)
         Schedule.automatic(qotd='qotd')
         self.assertTrue(q.day)
+
+
+class GradingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.questions = []
+        for i in range(3):
+            q = Question.objects.create(text='question %d' % i, active=True)
+            for j in range(4):
+                Answer.objects.create(question=q, text=str(j), correct=j < 2)
+            self.questions.append(q)
+
+    def responses(self, count_correct):
+        """ Check count_correct correct answers for each question """
+        return dict((q.id, [a.id for a in q.correct_answers[:count_correct]]) for q in self.questions)
+
+    def test_queries(self):
+        responses = self.responses(2)
+        with self.assertNumQueries(1):
+            grader = Grader(responses)
+        with self.assertNumQueries(0):
+            self.assertEqual(grader.challenge_points(responses)['points'], 300)
+            Grader(responses)
+
+    def test_scores(self):
+        grader = Grader(self.responses(2))
+        self.assertEqual(grader.challenge_points(self.responses(1))['points'], 150)
+        self.assertEqual(grader.correct_count(self.responses(2)), 3)
+        self.assertEqual(grader.correct_count(self.responses(1)), 0)
+        q = self.questions[0]
+        self.assertTrue(grader.is_correct(q.id, q.correct_answers[0].id))
+        self.assertFalse(grader.is_correct(q.id, q.answers.filter(correct=False)[0].id))
+
+    def test_answer_edit(self):
+        q = self.questions[0]
+        responses = {q.id: [a.id for a in q.correct_answers]}
+        self.assertEqual(Grader(responses).correct_count(responses), 1)
+
+        answer = q.answers.filter(correct=False)[0]
+        answer.correct = True
+        answer.save()
+        self.assertEqual(Grader(responses).correct_count(responses), 0)
+
+        answer.active = False
+        answer.save()
+        self.assertEqual(Grader(responses).correct_count(responses), 1)
+
+    def test_missing_question(self):
+        self.assertRaises(Question.DoesNotExist, Grader, {0: []})
+
+
+class QuestionSamplerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.add('challenge')
+        self.tag = Tag.objects.create(name='tag')
+        self.questions = [Question.objects.create(text='question %d' % i, active=True, category=self.category)
+                          for i in range(10)]
+        for q in self.questions[:4]:
+            q.tags.add(self.tag)
+        Question.objects.create(text='inactive', active=False, category=self.category)
+
+    def test_sample(self):
+        ids = set(q.id for q in self.questions)
+        sample = QuestionSampler.sample(5, 'challenge')
+        self.assertEqual(len(sample), 5)
+        self.assertEqual(len(set(sample)), 5)
+        self.assertTrue(set(q.id for q in sample) <= ids)
+
+        tagged = QuestionSampler.sample(10, 'challenge', 'tag')
+        self.assertEqual(set(tagged), set(self.questions[:4]))
+
+    def test_queries(self):
+        QuestionSampler.sample(5, 'challenge')
+        with self.assertNumQueries(1):
+            QuestionSampler.sample(5, 'challenge')
+
+    def test_invalidate(self):
+        self.assertEqual(QuestionSampler.count('challenge'), 10)
+        self.questions[0].set_active(False)
+        self.assertEqual(QuestionSampler.count('challenge'), 9)
+        self.questions[1].tags.remove(self.tag)
+        self.assertEqual(QuestionSampler.count('challenge', 'tag'), 2)
+        self.tag.active = True
+        self.tag.save()
+        self.tag.set_inactive()
+        self.assertEqual(QuestionSampler.count('challenge'), 7)
+
+    def test_avoid_seen(self):
+        player = User.objects.create(username='_sampler').get_profile()
+        QuestionSampler.mark_seen(player, self.questions[:6], 'challenge')
+        sample = QuestionSampler.sample(4, 'challenge', players=(player,))
+        self.assertEqual(set(sample), set(self.questions[6:]))
+        # not enough unseen questions, fill with seen ones
+        sample = QuestionSampler.sample(6, 'challenge', players=(player,))
+        self.assertEqual(len(sample), 6)
+        self.assertTrue(set(self.questions[6:]) <= set(sample))
@@ -0,0 +1,180 @@
+"""
+Formula compiler.
+
+A formula expression such as 'points=10+{level}*100;gold=3' is parsed once
+into closures, restricted to arithmetic, comparisons and a few functions over
+the named parameters. The compiled form is cached by expression text.
+"""
+import ast
+import operator
+from decimal import Decimal
+import re
+
+PARAMETER = re.compile(r'\{(\w+)\}')
+
+# Utility functions
+PHI = (1 + 5**0.5) / 2
+
+
+def fib(n):
+    return int(round((PHI**n - (1-PHI)**n) / 5**0.5))
+
+
+FUNCTIONS = {
+    'fib': fib,
+    'min': min,
+    'max': max,
+    'abs': abs,
+    'round': round,
+    'int': int,
+    'float': float,
+}
+
+CONSTANTS = {'True': True, 'False': False, 'None': None}
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    # Same semantics as the former eval: integer operands give integer division
+    ast.Div: operator.div,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+}
+
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+MAX_CACHED = 1000
+_compiled = {}
+
+
+class CompileError(Exception):
+    pass
+
+
+def _compile_node(node):
+    """ Return a function of the parameters dictionary, evaluating node """
+    if isinstance(node, ast.Num):
+        value = node.n
+        return lambda params: value
+
+    if isinstance(node, ast.Name):
+        if node.id in CONSTANTS:
+            value = CONSTANTS[node.id]
+            return lambda params: value
+        name = node.id
+        return lambda params: params[name]
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        op = BINARY_OPERATORS[type(node.op)]
+        left, right = _compile_node(node.left), _compile_node(node.right)
+        return lambda params: op(left(params), right(params))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        op = UNARY_OPERATORS[type(node.op)]
+        operand = _compile_node(node.operand)
+        return lambda params: op(operand(params))
+
+    if isinstance(node, ast.BoolOp):
+        values = [_compile_node(v) for v in node.values]
+        stop_on = not isinstance(node.op, ast.And)
+
+        def boolop(params):
+            for value in values:
+                result = value(params)
+                if bool(result) == stop_on:
+                    return result
+            return result
+        return boolop
+
+    if isinstance(node, ast.Compare):
+        left = _compile_node(node.left)
+        try:
+            ops = [COMPARE_OPERATORS[type(op)] for op in node.ops]
+        except KeyError:
+            raise CompileError('Unsupported comparison')
+        comparators = [_compile_node(c) for c in node.comparators]
+
+        def compare(params):
+            a = left(params)
+            for op, comparator in zip(ops, comparators):
+                b = comparator(params)
+                if not op(a, b):
+                    return False
+                a = b
+            return True
+        return compare
+
+    if isinstance(node, ast.IfExp):
+        test, body, orelse = _compile_node(node.test), _compile_node(node.body), _compile_node(node.orelse)
+        return lambda params: body(params) if test(params) else orelse(params)
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise CompileError('Unknown function')
+        if node.keywords or node.starargs or node.kwargs:
+            raise CompileError('Only positional arguments are allowed')
+        function = FUNCTIONS[node.func.id]
+        args = [_compile_node(a) for a in node.args]
+        return lambda params: function(*[a(params) for a in args])
+
+    raise CompileError('Unsupported syntax: %s' % node.__class__.__name__)
+
+
+def _coerce(value):
+    """ Parameters used to be formatted into the expression text, so numeric
+    strings keep working as numbers.
+    """
+    if isinstance(value, basestring):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def compile_expression(expression):
+    """ Return a function taking keyword parameters and returning
+    a dictionary of coin: amount. Raises CompileError or SyntaxError.
+    """
+    if expression in _compiled:
+        return _compiled[expression]
+
+    assignments = []
+    for a in expression.split(';'):
+        asp = a.split('=')
+        coin = asp[0].strip()
+        text = PARAMETER.sub(r'\1', '='.join(asp[1:])).strip()
+        tree = ast.parse(text, mode='eval')
+        assignments.append((coin, _compile_node(tree.body)))
+
+    def evaluate(**params):
+        params = dict((k, _coerce(v)) for k, v in params.iteritems())
+        ret = {}
+        for coin, function in assignments:
+            try:
+                ret[coin] = function(params)
+            except ZeroDivisionError:
+                ret[coin] = 0
+        return ret
+
+    if len(_compiled) >= MAX_CACHED:
+        _compiled.clear()
+    _compiled[expression] = evaluate
+    return evaluate
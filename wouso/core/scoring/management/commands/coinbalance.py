@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from wouso.core.scoring.models import CoinBalance
+
+
+class Command(BaseCommand):
+    args = '[--rebuild]'
+    help = 'Verify (or rebuild) the per user coin balances against scoring history'
+    option_list = BaseCommand.option_list + (
+        make_option('--rebuild',
+                    action='store_true',
+                    dest='rebuild',
+                    default=False,
+                    help='Recompute all balances from History before verifying them.'
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = CoinBalance.rebuild()
+            self.stdout.write('Rebuilt %d balances.\n' % count)
+
+        mismatches = CoinBalance.verify()
+        for user_id, coin_id, balance, expected in mismatches:
+            self.stdout.write('user %d coin %d: balance %f, history %f\n' % (user_id, coin_id, balance, expected))
+        if mismatches:
+            raise CommandError('%d balances do not match history, run with --rebuild' % len(mismatches))
+        self.stdout.write('OK.\n')
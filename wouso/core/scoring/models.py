@@ -1,8 +1,8 @@
 import logging
 from datetime import datetime
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
-from wouso.core.common import Item, CachedItem
+from wouso.core.common import CachedItem
 from wouso.core.decorators import cached_method, drop_cache
 from wouso.core.game import get_games
 from wouso.core.game.models import Game
@@ -35,12 +35,14 @@ class Coin(CachedItem, models.Model):
         return self.title or self.name
 
 
-class Formula(Item, models.Model):
+class Formula(CachedItem, models.Model):
     """ Define the way coin amounts are given to the user, based
     on keyword arguments formulas.
 
     A formula is owned by a game, or by the system (set owner to None)
     """
+    CACHE_PART = 'name'
+
     name = models.CharField(max_length=100, unique=True)
     expression = models.CharField(max_length=1000, default='')
     owner = models.ForeignKey(Game, null=True, blank=True)
@@ -48,18 +50,18 @@ class Formula(Item, models.Model):
 
     @classmethod
     def get(cls, id_string, default_string=None):
-        """ Performs a get lookup on the Formula table, if no formula exists
+        """ Performs a cached lookup on the Formula table, if no formula exists
         with the first id_string, returns the formula with the default_string
-        id.
+        id. id_string can also be a dictionary of formula fields, as
+        returned by get_formulas, and is then looked up by name.
         """
-        if not default_string:
-            return super(Formula, cls).get(id_string)
-
-        try:
-            formula = Formula.objects.get(name=id_string)
-        except cls.DoesNotExist:
+        if isinstance(id_string, dict):
+            id_string = id_string.get('name')
+            if not id_string:
+                return None
+        formula = super(Formula, cls).get(id_string)
+        if formula is None and default_string:
             formula = super(Formula, cls).get(default_string)
-            return formula
         return formula
 
 
@@ -99,15 +101,11 @@ class History(models.Model):
     @cached_method
     def _user_coins(user):
         """ Returns a dictionary of coins and amounts for a specific user. """
-        allcoins = Coin.objects.all()
         coins = {}
-        for coin in allcoins:
-            hs = History.objects.filter(user=user, coin=coin).aggregate(total=models.Sum('amount'))
-            if hs['total'] is not None:
-                coins[coin.name] = coin.format_value(hs['total'])
-            else:
-                if coin.is_core():
-                    coins[coin.name] = 0
+        for coin in Coin.objects.filter(owner__isnull=True):
+            coins[coin.name] = 0
+        for balance in CoinBalance.objects.filter(user=user).select_related('coin'):
+            coins[balance.coin.name] = balance.coin.format_value(balance.amount)
         return coins
 
     @staticmethod
@@ -137,11 +135,103 @@ class History(models.Model):
             pp[h.coin.name] = pp.get(h.coin.name, 0) + h.amount
         return pp
 
+    def save(self, **kwargs):
+        """ Keep the CoinBalance of the affected (user, coin) pairs in sync.
+        Both writes belong to the caller's transaction, if there is one.
+        """
+        previous = None
+        if self.pk is not None:
+            try:
+                previous = History.objects.get(pk=self.pk)
+            except History.DoesNotExist:
+                pass
+        r = super(History, self).save(**kwargs)
+        if previous is not None:
+            CoinBalance.update(previous.user_id, previous.coin_id, -previous.amount)
+        CoinBalance.update(self.user_id, self.coin_id, self.amount)
+        return r
+
     def delete(self, using=None):
         cls = self.__class__
         drop_cache(cls._user_points, self.user)
         drop_cache(cls._user_coins, self.user)
+        CoinBalance.update(self.user_id, self.coin_id, -self.amount)
         super(History, self).delete(using=using)
 
     def __unicode__(self):
         return "{user} {date}-{formula}[{ext}]: {amount}{coin}".format(user=self.user, date=self.timestamp, formula=self.formula, ext=self.external_id, amount=self.amount, coin=self.coin)
+
+
+class CoinBalance(models.Model):
+    """ Denormalized sum of History amounts, per user and coin.
+
+    It is maintained by History.save and History.delete and can be rebuilt
+    using the coinbalance management command.
+    """
+    user = models.ForeignKey(User)
+    coin = models.ForeignKey(Coin)
+    amount = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'coin')
+
+    @classmethod
+    def update(cls, user, coin, delta):
+        """ Add delta to the (user, coin) balance, creating it if missing.
+        user and coin can be either objects or ids.
+        """
+        user_id = getattr(user, 'id', user)
+        coin_id = getattr(coin, 'id', coin)
+        qs = cls.objects.filter(user__id=user_id, coin__id=coin_id)
+        if qs.update(amount=models.F('amount') + delta):
+            return
+        sid = transaction.savepoint()
+        try:
+            cls.objects.create(user_id=user_id, coin_id=coin_id, amount=delta)
+        except IntegrityError:
+            # Somebody else created it meanwhile
+            transaction.savepoint_rollback(sid)
+            qs.update(amount=models.F('amount') + delta)
+        else:
+            transaction.savepoint_commit(sid)
+
+    @classmethod
+    def get_amount(cls, user, coin):
+        """ Return the raw balance of a single coin, or 0 """
+        coin = Coin.get(coin)
+        if coin is None:
+            return 0
+        amounts = cls.objects.filter(user=user, coin=coin).values_list('amount', flat=True)
+        return amounts[0] if amounts else 0
+
+    @classmethod
+    def compute_from_history(cls):
+        """ Return a dictionary of (user_id, coin_id): amount, aggregated from History """
+        totals = History.objects.values('user', 'coin').annotate(total=models.Sum('amount'))
+        return dict(((t['user'], t['coin']), t['total'] or 0) for t in totals)
+
+    @classmethod
+    def rebuild(cls):
+        """ Recreate all balances from History. Return the number of balances. """
+        totals = cls.compute_from_history()
+        with transaction.commit_on_success():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([cls(user_id=u, coin_id=c, amount=a) for (u, c), a in totals.iteritems()])
+        for user_id in set(u for u, c in totals.keys()):
+            drop_cache(History._user_coins, user=user_id)
+        return len(totals)
+
+    @classmethod
+    def verify(cls, tolerance=0.0001):
+        """ Return a list of (user_id, coin_id, balance, history_total) that do not match """
+        totals = cls.compute_from_history()
+        balances = dict(((b['user'], b['coin']), b['amount']) for b in cls.objects.values('user', 'coin', 'amount'))
+        mismatches = []
+        for key in set(totals.keys()) | set(balances.keys()):
+            expected, actual = totals.get(key, 0), balances.get(key, 0)
+            if abs(expected - actual) > tolerance:
+                mismatches.append(key + (actual, expected))
+        return sorted(mismatches)
+
+    def __unicode__(self):
+        return u"%s %s: %s" % (self.user, self.coin, self.amount)
@@ -1,11 +1,13 @@
 # TODO: why isn't this implemented as a class singleton, the same as God ?
 import logging
 from django.utils.translation import ugettext_noop
-from django.db import models
 from django.contrib.auth.models import User
 from wouso.core import signals
+from wouso.core.common import bulk_insert, chunks
+from wouso.core.decorators import drop_cache
 from wouso.core.user.models import Player
-from wouso.core.scoring.models import Coin, Formula, History
+from wouso.core.scoring.models import Coin, Formula, History, CoinBalance
+from wouso.core.scoring.compiler import compile_expression
 from wouso.core.god import God
 from wouso.core.game import get_games, Game
 
@@ -33,14 +35,6 @@ class InvalidScoreCall(Exception):
 
 CORE_POINTS = ('points', 'gold', 'penalty')
 
-# Utility functions
-PHI = (1 + 5**0.5) / 2
-
-
-def fib(n):
-    return int(round((PHI**n - (1-PHI)**n) / 5**0.5))
-
-
 # Setup
 def check_setup():
     """ Check if the module has been setup """
@@ -84,6 +78,31 @@ def calculate(formula, **params):
     return calculate_expression(formula.expression, formula, **params)
 
 
+def calculate_many(formula, params_list):
+    """ Calculate formula for each parameters dictionary in params_list.
+    Return a list of dictionaries of coin and amounts, in the same order.
+    """
+    formula = Formula.get(formula)
+    if formula is None:
+        raise InvalidFormula(formula)
+
+    if not formula.expression:
+        return [{} for params in params_list]
+
+    evaluate = _compile(formula.expression, formula)
+    try:
+        return [evaluate(**params) for params in params_list]
+    except Exception:
+        raise FormulaParsingError(formula)
+
+
+def _compile(expression, formula=None):
+    try:
+        return compile_expression(expression)
+    except Exception:
+        raise FormulaParsingError(formula)
+
+
 def calculate_expression(expression, formula=None, **params):
     """
     Calculate a formula defintion. Example of such defintions are:
@@ -93,26 +112,14 @@ def calculate_expression(expression, formula=None, **params):
 
     Returns a dictionary with coins and values, example:
         {'points': 30, 'gold': 100}
+
+    The expression is compiled once, see scoring.compiler.
     """
-    ret = {}
+    evaluate = _compile(expression, formula)
     try:
-        frml = expression.format(**params)
-        # Python does not allow assignments inside eval
-        # Using this workaround for now
-        ass = frml.split(';')
-        for a in ass:
-            asp = a.split('=')
-            coin = asp[0].strip()
-            expr = '='.join(asp[1:])
-            try:
-                result = eval(expr)
-            except ZeroDivisionError as e:
-                result = 0
-            ret[coin] = result
-    except Exception as e:
-        #logging.exception(e)
+        return evaluate(**params)
+    except Exception:
         raise FormulaParsingError(formula)
-    return ret
 
 
 def score(user, game, formula, external_id=None, percents=100, **params):
@@ -215,8 +222,9 @@ def score_simple(player, coin, amount, game=None, formula=None,
 
     # update user.points asap
     if coin.name == 'points':
-        if player.magic.has_modifier('top-disguise'):
-            computed_amount = 1.0 * computed_amount * player.magic.modifier_percents('top-disguise') / 100
+        magic = player.magic.snapshot
+        if magic.has_modifier('top-disguise'):
+            computed_amount = 1.0 * computed_amount * magic.modifier_percents('top-disguise') / 100
 
         player.points += computed_amount
         player.save()
@@ -226,6 +234,99 @@ def score_simple(player, coin, amount, game=None, formula=None,
     return hs
 
 
+class ScoreBatch(object):
+    """ Collect score and unset calls, then apply them at once.
+
+    Each formula is computed once for all its calls, see calculate_many. History
+    rows are inserted and deleted in bulk, balances are updated once per (user, coin)
+    and every player is saved once, with its level checked against the final points.
+    apply runs in the caller's transaction, open one to have the batch applied atomically.
+    """
+    def __init__(self):
+        self._scores = []
+        self._unsets = []
+
+    def __len__(self):
+        return len(self._scores) + len(self._unsets)
+
+    def score(self, player, game, formula, external_id=None, percents=100, **params):
+        """ Same arguments as score """
+        self._scores.append((player, game, formula, external_id, percents, params))
+
+    def unset(self, player, game, formula, external_id=None):
+        """ Same arguments as unset """
+        self._unsets.append((player, game, formula, external_id))
+
+    def apply(self):
+        """ Write the collected changes. Return (History rows added, History rows removed). """
+        points, balances, games = {}, {}, {}
+
+        def account(player, history, sign):
+            key = (history.user_id, history.coin_id)
+            balances[key] = balances.get(key, 0) + sign * history.amount
+            games[player.id] = history.game
+
+        removed = []
+        wanted = {}
+        for player, game, formula, external_id in self._unsets:
+            key = (game.get_instance(), Formula.get(formula))
+            wanted.setdefault(key, {})[(player.user_id, external_id)] = player
+        for (game, formula), players in wanted.iteritems():
+            ids = set(external_id for user_id, external_id in players)
+            # external_id__in never matches NULL
+            lookups = [dict(external_id__isnull=True)] if None in ids else []
+            lookups += [dict(external_id__in=chunk) for chunk in chunks(ids - set([None]))]
+            for lookup in lookups:
+                for history in History.objects.filter(game=game, formula=formula,
+                                                      **lookup).select_related('coin'):
+                    player = players.get((history.user_id, history.external_id))
+                    if player is None:
+                        continue
+                    removed.append(history.id)
+                    account(player, history, -1)
+                    if history.coin.name == 'points':
+                        points[player.id] = points.get(player.id, 0) - history.amount
+        for ids in chunks(removed):
+            History.objects.filter(id__in=ids).delete()
+
+        added = []
+        by_formula = {}
+        for call in self._scores:
+            by_formula.setdefault(call[2], []).append(call)
+        for formula, calls in by_formula.iteritems():
+            values = calculate_many(formula, [call[5] for call in calls])
+            formula = Formula.get(formula)
+            for (player, game, f, external_id, percents, params), ret in zip(calls, values):
+                game = game.get_instance() if game is not None and not isinstance(game, Game) else game
+                for coin, amount in ret.items():
+                    coin = Coin.get(coin)
+                    history = History(user_id=player.user_id, coin=coin, amount=1.0 * amount * percents / 100,
+                                      game=game, formula=formula, external_id=external_id, percents=percents)
+                    added.append(history)
+                    account(player, history, 1)
+                    if coin.name == 'points':
+                        amount = history.amount
+                        magic = player.magic.snapshot
+                        if magic.has_modifier('top-disguise'):
+                            amount = 1.0 * amount * magic.modifier_percents('top-disguise') / 100
+                        points[player.id] = points.get(player.id, 0) + amount
+        bulk_insert(History, added)
+
+        for (user_id, coin_id), delta in balances.iteritems():
+            CoinBalance.update(user_id, coin_id, delta)
+        for ids in chunks(points):
+            for player in Player.objects.filter(id__in=ids):
+                player.points += points[player.id]
+                player.save()
+                update_points(player, games[player.id])
+
+        for user_id in set(user_id for user_id, coin_id in balances):
+            drop_cache(History._user_points, user=user_id)
+            drop_cache(History._user_coins, user=user_id)
+        self._scores, self._unsets = [], []
+        return len(added), len(removed)
+
+
 def history_for(user, game, external_id=None, formula=None, coin=None):
     """ Return all history entries for given (user, game) pair.
     """
@@ -258,17 +359,13 @@ def user_coins(user):
 
 
 def real_points(player):
-    coin = Coin.get('points')
-    result = History.objects.filter(user=player.user, coin=coin).aggregate(total=models.Sum('amount'))
-    return result['total'] if result['total'] is not None else 0
+    return CoinBalance.get_amount(player.user, 'points')
 
 
 def sync_user(player):
     """ Synchronise user points with database
     """
-    coin = Coin.get('points')
-    result = History.objects.filter(user=player.user, coin=coin).aggregate(total=models.Sum('amount'))
-    points = result['total'] if result['total'] is not None else 0
+    points = real_points(player)
     if player.points != points and not player.magic.has_modifier('top-disguise'):
         logging.debug('%s had %d instead of %d points' % (player, player.points, points))
         player.points = points
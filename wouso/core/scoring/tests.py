@@ -6,8 +6,8 @@ from wouso.core.game.models import Game
 from wouso.core import scoring, signals
 from wouso.core.tests import WousoTest
 from wouso.core.user.models import Player
-from models import Formula, Coin, History
-from sm import FormulaParsingError, setup_scoring, CORE_POINTS, check_setup, update_points, calculate
+from models import Formula, Coin, History, CoinBalance
+from sm import FormulaParsingError, setup_scoring, CORE_POINTS, check_setup, update_points, calculate, calculate_many
 
 
 class ScoringTestCase(TestCase):
@@ -189,6 +189,61 @@ class ScoringHistoryTest(WousoTest):
         self.assertEqual(player.points, 20)
 
 
+class CoinBalanceTest(WousoTest):
+    def test_balance_follows_history(self):
+        coin = Coin.add('points')
+        player = self._get_player()
+
+        scoring.score_simple(player, 'points', 10)
+        h = scoring.score_simple(player, 'points', 5)
+        self.assertEqual(CoinBalance.get_amount(player.user, coin), 15)
+        self.assertEqual(History.user_coins(player.user)['points'], 15)
+
+        h.delete()
+        self.assertEqual(CoinBalance.get_amount(player.user, coin), 10)
+        self.assertEqual(scoring.real_points(player), 10)
+
+    def test_balance_follows_edit(self):
+        coin = Coin.add('points')
+        player = self._get_player()
+
+        h = History.objects.create(user=player.user, coin=coin, amount=10)
+        h.amount = 3
+        h.save()
+        self.assertEqual(CoinBalance.get_amount(player.user, coin), 3)
+
+    def test_verify_and_rebuild(self):
+        coin = Coin.add('points')
+        player = self._get_player()
+        scoring.score_simple(player, 'points', 10)
+        self.assertEqual(CoinBalance.verify(), [])
+
+        CoinBalance.objects.all().update(amount=0)
+        self.assertEqual(len(CoinBalance.verify()), 1)
+
+        CoinBalance.rebuild()
+        self.assertEqual(CoinBalance.verify(), [])
+        self.assertEqual(CoinBalance.get_amount(player.user, coin), 10)
+
+
+class ScoreBatchTest(WousoTest):
+    def test_unset_without_external_id(self):
+        coin = Coin.add('points')
+        formula = Formula.add('-batch-test', expression='points=10')
+        player = self._get_player()
+        for external_id in (None, 1):
+            History.objects.create(user=player.user, coin=coin, amount=10,
+                                   game=Game.get_instance(), formula=formula,
+                                   external_id=external_id)
+
+        batch = scoring.ScoreBatch()
+        batch.unset(player, Game, formula)
+        self.assertEqual(batch.apply(), (0, 1))
+        left = History.objects.filter(formula=formula).values_list('external_id', flat=True)
+        self.assertEqual(list(left), [1])
+        self.assertEqual(CoinBalance.get_amount(player.user, coin), 10)
+
+
 class ScoringSetupTest(TestCase):
     def test_check_setup(self):
         setup_scoring()
@@ -199,6 +254,17 @@ class ScoringSetupTest(TestCase):
         for c in CORE_POINTS:
             self.assertTrue(Coin.get(c))
 
+    def test_setup_cache_keys(self):
+        import warnings
+        from django.core.cache import CacheKeyWarning
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            setup_scoring()
+        self.assertFalse([w for w in caught if issubclass(w.category, CacheKeyWarning)])
+        formula = Formula.get({'name': 'bonus-points', 'expression': 'points={points}'})
+        self.assertEqual(formula.name, 'bonus-points')
+
 
 class ScoringFirstLogin(WousoTest):
     def test_first_login_points(self):
@@ -243,3 +309,32 @@ class ScoringTestFunctions(TestCase):
         value = calculate(formula)['points']
 
         self.assertEqual(value, 3)
+
+
+class FormulaCompilerTest(TestCase):
+    def test_expressions(self):
+        formula = Formula.add('test-compile', expression='points=4 + (1 if {hour} < 12 else -1);gold={level}*2')
+        self.assertEqual(calculate(formula, hour=10, level=3), {'points': 5, 'gold': 6})
+        self.assertEqual(calculate(formula, hour=13, level='3'), {'points': 3, 'gold': 6})
+
+    def test_integer_division(self):
+        formula = Formula.add('test-div', expression='points=50*({level}+1)/{level_users};gold=1/0')
+        self.assertEqual(calculate(formula, level=1, level_users=3), {'points': 33, 'gold': 0})
+
+    def test_rejects_code(self):
+        for expression in ('points=__import__("os").getcwd()', 'points={a}.real', 'points=[1][0]',
+                           'points=open("x")', 'points={missing}'):
+            formula = Formula(name='test-unsafe', expression=expression)
+            self.assertRaises(FormulaParsingError, calculate, formula, a=1)
+
+    def test_calculate_many(self):
+        formula = Formula.add('test-many', expression='points=fib(12 - {position})')
+        values = calculate_many(formula, [dict(position=i) for i in (10, 11, 12)])
+        self.assertEqual(values, [{'points': 1}, {'points': 1}, {'points': 0}])
+
+    def test_formula_cache(self):
+        formula = Formula.add('test-cached', expression='points=1')
+        self.assertEqual(calculate('test-cached'), {'points': 1})
+        formula.expression = 'points=2'
+        formula.save()
+        self.assertEqual(calculate('test-cached'), {'points': 2})
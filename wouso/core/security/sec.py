@@ -3,6 +3,8 @@ from wouso.core.config.models import BoolSetting
 from wouso.core.common import App
 from wouso.core.scoring.models import Coin, Formula
 from wouso.core.scoring import score
+from wouso.core.scoring.models import History
+from wouso.interface.activity.models import ActivityTask
 
 
 class SecurityInspector:
@@ -74,6 +76,9 @@ class Security(App):
     @classmethod
     def penalise(cls, player, formula, external_id=None):
         coins = Coin.get('penalty')
+        if external_id is not None and History.objects.filter(user=player.user, formula=formula, external_id=external_id).exists():
+            # already penalised for this event
+            return
         if not coins is None:
             score(user=player, game=None, formula=formula, external_id=external_id)
 
@@ -91,6 +96,9 @@ class Security(App):
 
 
 def do_security_check(sender, **kwargs):
-    Security.activity_handler(sender, **kwargs)
+    ActivityTask.dispatch('security', sender, **kwargs)
+
+
+ActivityTask.register('security', Security.activity_handler)
 
 signals.addActivity.connect(do_security_check)
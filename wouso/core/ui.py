@@ -1,22 +1,101 @@
+from md5 import md5
+from uuid import uuid4
+from django.core.cache import cache
 from django.db import models
+from django.utils import translation
 from wouso.core.game.models import Game
 
 
+class BlockCache(object):
+    """ Cache policy of a block.
+
+    The rendered block is cached for timeout seconds, once for everybody
+    (GLOBAL), for each player (PLAYER) or for each race (RACE). The cached
+    block is dropped when one of its invalidation keys is invalidated, see
+    invalidate_blocks, or when a setting changes. Context variables the block
+    output depends on, other than the user, are listed in vary.
+    """
+    GLOBAL, PLAYER, RACE = 'global', 'player', 'race'
+    CACHE_KEY = 'ui-block-%s-%s-%s'
+    VERSION_KEY = 'ui-block-version-%s'
+
+    def __init__(self, scope=GLOBAL, timeout=5 * 60, keys=(), vary=()):
+        self.scope = scope
+        self.timeout = timeout
+        self.keys = keys
+        self.vary = vary
+
+    @classmethod
+    def _player(cls, context):
+        user = context.get('user', None)
+        if user is None or not user.is_authenticated():
+            return None
+        return user.get_profile()
+
+    def scope_id(self, context):
+        player = self._player(context)
+        if player is None:
+            return 'anonymous'
+        if self.scope == self.GLOBAL:
+            return 'all'
+        return player.id if self.scope == self.PLAYER else player.race_id
+
+    def version_keys(self, context):
+        from wouso.core.config.models import SettingsSnapshot
+
+        versions = [SettingsSnapshot.VERSION_KEY]
+        player = self._player(context)
+        for key in self.keys:
+            versions.append(self.VERSION_KEY % key)
+            if self.scope == self.PLAYER and player is not None:
+                versions.append(self.VERSION_KEY % ('%s-%d' % (key, player.id)))
+        return versions
+
+    def cache_key(self, library, name, context):
+        versions = self.version_keys(context)
+        found = cache.get_many(versions)
+        parts = [self.scope_id(context), translation.get_language()]
+        parts += [unicode(context.get(v, '')) for v in self.vary]
+        parts += [found.get(v) for v in versions]
+        return self.CACHE_KEY % (library, name, md5(repr(parts)).hexdigest())
+
+
+def invalidate_blocks(key, player_id=None):
+    """ Drop cached blocks having the invalidation key, for all
+    players or only for the player with the given id.
+    """
+    if player_id is not None:
+        key = '%s-%d' % (key, player_id)
+    cache.set(BlockCache.VERSION_KEY % key, uuid4().hex)
+
+
 class BlockLibrary(object):
-    def __init__(self):
+    def __init__(self, name=''):
+        self.name = name
         self.parts = {}
+        self.policies = {}
 
     def get_blocks(self):
         return self.parts.keys()
 
     def get_block(self, key, context):
         block = self.parts.get(key, '')
-        if callable(block):
+        if not callable(block):
+            return block
+        policy = self.policies.get(key)
+        if policy is None:
             return block(context)
-        return block
 
-    def add(self, key, callback):
+        cache_key = policy.cache_key(self.name, key, context)
+        content = cache.get(cache_key)
+        if content is None:
+            content = block(context)
+            cache.set(cache_key, content, policy.timeout)
+        return content
+
+    def add(self, key, callback, cache=None):
         self.parts[key] = callback
+        self.policies[key] = cache
 
 
 _libraries = {}
@@ -25,7 +104,7 @@ _libraries = {}
 def get_library(library):
     global _libraries
     if not _libraries.get(library, None):
-        _libraries[library] = BlockLibrary()
+        _libraries[library] = BlockLibrary(library)
     return _libraries[library]
 
 
@@ -41,18 +120,18 @@ def get_footer():
     return get_library('footer')
 
 
-def register_block(library, name, callback):
+def register_block(library, name, callback, cache=None):
     lib = get_library(library)
-    lib.add(name, callback)
+    lib.add(name, callback, cache)
 
 
-def register_sidebar_block(name, callback):
-    return register_block('sidebar', name, callback)
+def register_sidebar_block(name, callback, cache=None):
+    return register_block('sidebar', name, callback, cache)
 
 
-def register_header_link(name, callback):
-    return register_block('header', name, callback)
+def register_header_link(name, callback, cache=None):
+    return register_block('header', name, callback, cache)
 
 
-def register_footer_link(name, callback):
-    return register_block('footer', name, callback)
+def register_footer_link(name, callback, cache=None):
+    return register_block('footer', name, callback, cache)
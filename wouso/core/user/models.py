@@ -1,7 +1,6 @@
 # coding=utf-8
 import logging
 from md5 import md5
-from datetime import datetime, timedelta
 from random import shuffle
 from django.db import models
 from django.db.models import Sum, Q
@@ -12,6 +11,8 @@ from wouso.core.game.models import Game
 from wouso.core.magic.manager import MagicManager
 from wouso.core.god import God
 from wouso.core.magic.models import Spell
+from wouso.core.user.ranking import Ranking
+from wouso.core.user.presence import Presence
 from .. import deprecated
 
 
@@ -88,10 +89,7 @@ class PlayerGroup(models.Model):
 
     @property
     def online_players(self):
-        oldest = datetime.now() - timedelta(minutes=10)
-
-        res = self.players.filter(last_seen__gte=oldest)
-        return res
+        return self.players.filter(Presence.online_filter())
 
     def destroy(self):
         """
@@ -115,7 +113,7 @@ class Player(models.Model):
     full_name = models.CharField(max_length=200)
     # Unique differentiator for ladder
     # Do not modify it manually, use scoring.score instead
-    points = models.FloatField(default=0, blank=True, null=True, editable=False)
+    points = models.FloatField(default=0, blank=True, null=True, editable=False, db_index=True)
 
     level_no = models.IntegerField(default=1, blank=True, null=True)
 
@@ -139,44 +137,21 @@ class Player(models.Model):
         """ Returns an array of neighbouring players from top: count up and count down
             user_race and spell_type are used by mass spells for neighbours list.
         """
-        base_query = Player.objects.exclude(user__is_superuser=True).exclude(race__can_play=False)
-
-        allUsers = list(base_query.order_by('-points'))
-        try:
-            pos = allUsers.index(self)
-        except ValueError:
+        playable = Ranking.playable()
+        if not playable.filter(pk=self.pk).exists():
             return []
-
         if (spell_type is not None) and (user_race is not None) and (spell_type != 'o'):
             if spell_type == 'p':
-                allUsers = [user for user in allUsers if user.race.name == user_race.name]
+                playable = playable.filter(race=user_race)
             else:
-                allUsers = [user for user in allUsers if user.race.name != user_race.name]
-
-        if len(allUsers) <= 2*count+1:
-            return allUsers
-
-        start = max(pos-count, 0)
-        if pos + count >= len(allUsers):
-            start = len(allUsers)-2*count-1
-
-        players = allUsers[start:start+2*count+1]
-        return players
+                playable = playable.exclude(race=user_race)
+        return Ranking.neighbours(self, count, playable)
 
     def get_division(self, count):
-        from wouso.interface.top.models import TopUser
-        all_users = list(TopUser.objects.all())
-
-        try:
-            curr_user = TopUser.objects.get(id=self.id)
-        except Exception:
-            return []
-
-        curr_user_pos = curr_user.position
-
-        division = [user for user in all_users if abs(curr_user.position - user.position) < 20]
+        """ Return the players ranked less than count positions away, shuffled
+        """
+        division = Ranking.around(self, count - 1)
         shuffle(division)
-
         return division
 
     def user_name(self):
@@ -362,6 +337,8 @@ def user_post_save(sender, instance, **kwargs):
 models.signals.post_save.connect(user_post_save, User)
 
 
+
+
 def update_display_name(player, save=True):
     display_name = unicode(settings.DISPLAY_NAME).format(first_name=player.user.first_name,
                                                          last_name=player.user.last_name,
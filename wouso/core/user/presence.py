@@ -0,0 +1,134 @@
+"""
+Player presence, kept in cache.
+
+Requests only record a timestamp under the player's own cache key, so
+concurrent requests of different players never overwrite each other. The
+first time a player is seen in a SLOT_SECONDS slot, the id is appended to
+the slot's list: cache.incr on the slot counter hands out the position.
+
+The timestamps are written to Player.last_seen in one batch by flush, which
+runs from wousocron and every PRESENCE_FLUSH_INTERVAL seconds from the
+activityworker command, so a page view is not a Player write. Readers merge
+the timestamps of the slots not flushed yet with the database.
+"""
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+
+def _latest(a, b):
+    if a is None or b is None:
+        return a or b
+    return max(a, b)
+
+
+class Presence(object):
+    PLAYER_KEY = 'user-presence-%d'
+    SLOT_KEY = 'user-presence-slot-%d'
+    SLOT_ENTRY_KEY = 'user-presence-slot-%d-%d'
+    SLOT_MEMBER_KEY = 'user-presence-slot-%d-player-%d'
+    FLUSHED_KEY = 'user-presence-flushed'
+    HOUR_KEY = 'user-presence-hour-%d-%s'
+    SLOT_SECONDS = 60
+    TIMEOUT = 24 * 60 * 60
+    ONLINE_MINUTES = 10
+
+    @classmethod
+    def flush_interval(cls):
+        return timedelta(seconds=getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 60))
+
+    @classmethod
+    def _slot(cls, when):
+        return int(time.mktime(when.timetuple())) // cls.SLOT_SECONDS
+
+    @classmethod
+    def seen(cls, player, now=None):
+        """ Record player as seen now. Return True the first time player is seen in this hour. """
+        now = now or datetime.now()
+        previous = _latest(player.last_seen, cache.get(cls.PLAYER_KEY % player.id))
+        cache.set(cls.PLAYER_KEY % player.id, now, cls.TIMEOUT)
+        slot = cls._slot(now)
+        if cache.add(cls.SLOT_MEMBER_KEY % (slot, player.id), True, cls.TIMEOUT):
+            cls._register(slot, player.id)
+
+        hour = now.strftime('%Y%m%d%H')
+        if previous is not None and previous.strftime('%Y%m%d%H') == hour:
+            return False
+        # add is atomic: only one process gets to announce this hour
+        return cache.add(cls.HOUR_KEY % (player.id, hour), True, 60 * 60)
+
+    @classmethod
+    def _register(cls, slot, player_id):
+        key = cls.SLOT_KEY % slot
+        cache.add(key, 0, cls.TIMEOUT)
+        try:
+            index = cache.incr(key)
+        except ValueError:
+            # evicted in between
+            cache.add(key, 1, cls.TIMEOUT)
+            index = 1
+        cache.set(cls.SLOT_ENTRY_KEY % (slot, index), player_id, cls.TIMEOUT)
+
+    @classmethod
+    def _recent(cls, first, last):
+        """ Return a dictionary of player id: timestamp, for the players seen in the slots first to last """
+        slots = range(first, last + 1)
+        counts = cache.get_many([cls.SLOT_KEY % s for s in slots])
+        entries = [cls.SLOT_ENTRY_KEY % (s, i) for s in slots for i in range(1, counts.get(cls.SLOT_KEY % s, 0) + 1)]
+        ids = set(cache.get_many(entries).values()) if entries else set()
+        times = cache.get_many([cls.PLAYER_KEY % id for id in ids]) if ids else {}
+        return dict((id, times[cls.PLAYER_KEY % id]) for id in ids if cls.PLAYER_KEY % id in times)
+
+    @classmethod
+    def _unflushed(cls, oldest, now=None):
+        """ Return the timestamps of the players seen since oldest, not flushed yet """
+        now = now or datetime.now()
+        first = cls._slot(max(oldest, now - timedelta(seconds=cls.TIMEOUT)))
+        flushed = cache.get(cls.FLUSHED_KEY)
+        if flushed is not None:
+            first = max(first, flushed + 1)
+        return dict((id, t) for id, t in cls._recent(first, cls._slot(now)).iteritems() if t >= oldest)
+
+    @classmethod
+    def flush(cls, now=None):
+        """ Write the pending timestamps to the database, return the number of players """
+        from wouso.core.user.models import Player
+
+        now = now or datetime.now()
+        seen = cls._unflushed(now - timedelta(seconds=cls.TIMEOUT), now)
+        with transaction.commit_on_success():
+            for id, timestamp in seen.iteritems():
+                Player.objects.filter(id=id).filter(Q(last_seen__isnull=True) | Q(last_seen__lt=timestamp)).update(
+                    last_seen=timestamp)
+        # the current slot is still being filled, it is read again next time
+        cache.set(cls.FLUSHED_KEY, cls._slot(now) - 1, cls.TIMEOUT)
+        return len(seen)
+
+    @classmethod
+    def last_seen(cls, player):
+        return _latest(player.last_seen, cache.get(cls.PLAYER_KEY % player.id))
+
+    @classmethod
+    def online_filter(cls, minutes=ONLINE_MINUTES):
+        """ Return a Q object selecting the players seen in the last minutes """
+        oldest = datetime.now() - timedelta(minutes=minutes)
+        return Q(last_seen__gte=oldest) | Q(id__in=cls._unflushed(oldest).keys())
+
+    @classmethod
+    def online_players(cls, queryset=None, minutes=ONLINE_MINUTES):
+        """ Return the players seen in the last minutes, most recent first,
+        with last_seen updated from the cache.
+        """
+        from wouso.core.user.models import Player
+
+        queryset = Player.objects.all() if queryset is None else queryset
+        oldest = datetime.now() - timedelta(minutes=minutes)
+        seen = cls._unflushed(oldest)
+        players = list(queryset.filter(Q(last_seen__gte=oldest) | Q(id__in=seen.keys())))
+        for p in players:
+            p.last_seen = _latest(p.last_seen, seen.get(p.id))
+        players.sort(key=lambda p: p.last_seen, reverse=True)
+        return players
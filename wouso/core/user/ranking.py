@@ -0,0 +1,81 @@
+"""
+Live ranking of players, by points, then id.
+
+Ranks and windows are answered with keyset queries on the index over
+Player.points: a rank counts the players before a player, a window takes
+the players just before and just after it, in (-points, id) order. Nothing
+is cached, so the ranking follows every points, race or superuser change
+without any work on Player.save.
+"""
+from django.db.models import Q
+
+
+class Ranking(object):
+    @classmethod
+    def players(cls):
+        from wouso.core.user.models import Player
+
+        return Player.objects.all()
+
+    @classmethod
+    def _points(cls, player):
+        """ Stored points of player: scoring updates them in the database only """
+        points = cls.players().filter(pk=player.pk).values_list('points', flat=True)
+        return (points[0] if points else player.points) or 0
+
+    @classmethod
+    def _before(cls, player, points):
+        """ Q object selecting the players ranked before player """
+        return Q(points__gt=points) | Q(points=points, id__lt=player.id)
+
+    @classmethod
+    def _after(cls, player, points):
+        """ Q object selecting the players ranked after player """
+        return Q(points__lt=points) | Q(points=points, id__gt=player.id)
+
+    @classmethod
+    def playable(cls, queryset=None):
+        """ Superusers and players in races that cannot play are not part of the top """
+        queryset = cls.players() if queryset is None else queryset
+        return queryset.exclude(user__is_superuser=True).exclude(race__can_play=False)
+
+    @classmethod
+    def rank(cls, player):
+        """ Return the 1-based rank of player among all players """
+        return cls.players().filter(cls._before(player, cls._points(player))).count() + 1
+
+    @classmethod
+    def _window(cls, player, before, after, queryset):
+        """ Return the at most before players ranked just before player, in ranking
+        order, and the at most after players ranked just after it.
+        """
+        points = cls._points(player)
+        above, below = [], []
+        if before:
+            above = queryset.filter(cls._before(player, points)).order_by('points', '-id')
+            above = list(above[:before])
+        if after:
+            below = queryset.filter(cls._after(player, points)).order_by('-points', 'id')
+            below = list(below[:after])
+        return list(reversed(above)), below
+
+    @classmethod
+    def around(cls, player, distance, queryset=None):
+        """ Return the players ranked at most distance away, player included, in ranking order """
+        queryset = cls.players() if queryset is None else queryset
+        above, below = cls._window(player, distance, distance, queryset)
+        return above + [player] + below
+
+    @classmethod
+    def neighbours(cls, player, count, queryset):
+        """ Return 2 * count + 1 players of queryset around player, in ranking order.
+        player is only part of the result if it is in queryset. The window is shifted
+        when the player is near the top or the bottom.
+        """
+        middle = [player] if queryset.filter(pk=player.pk).exists() else []
+        wanted = 2 * count + 1 - len(middle)
+        above, below = cls._window(player, wanted, wanted, queryset)
+        # as many from each side, the one above first, and fill from the other one when short
+        taken_above = min(len(above), max((wanted + 1) // 2, wanted - len(below)))
+        taken_below = min(len(below), wanted - taken_above)
+        return above[len(above) - taken_above:] + middle + below[:taken_below]
@@ -1,11 +1,14 @@
 # coding=utf-8
+from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.test import TestCase
 import logging
 from wouso.core.magic.models import Artifact
 from wouso.core.tests import WousoTest
-from wouso.core.user.models import Race, PlayerGroup
+from wouso.core.user.models import Race, PlayerGroup, Player
+from wouso.core.user.ranking import Ranking
+from wouso.core.user.presence import Presence
 
 
 class PlayerTestCase(TestCase):
@@ -55,6 +58,93 @@ class PlayerTestCase(TestCase):
             self.assertEqual(players[i], v[i + 2])
 
 
+class RankingTest(WousoTest):
+    def setUp(self):
+        super(RankingTest, self).setUp()
+        self.players = []
+        for i in range(5):
+            player = self._get_player(i)
+            player.points = 10000 - i * 10
+            player.save()
+            self.players.append(player)
+
+    def test_rank_follows_points(self):
+        first = Ranking.rank(self.players[0])
+        self.assertEqual(Ranking.rank(self.players[4]), first + 4)
+
+        self.players[4].points = 20000
+        self.players[4].save()
+        self.assertEqual(Ranking.rank(self.players[4]), first)
+        self.assertEqual(Ranking.rank(self.players[0]), first + 1)
+
+    def test_ties_ranked_by_id(self):
+        self.players[1].points = self.players[0].points
+        self.players[1].save()
+        self.assertEqual(Ranking.rank(self.players[1]), Ranking.rank(self.players[0]) + 1)
+        self.assertEqual(Ranking.around(self.players[1], 1), self.players[0:3])
+
+    def test_neighbours_skip_not_playable(self):
+        race = Race.objects.create(name='norace', can_play=False)
+        self.players[1].race = race
+        self.players[1].save()
+
+        neighbours = self.players[2].get_neighbours_from_top(1)
+        self.assertEqual(neighbours, [self.players[0], self.players[2], self.players[3]])
+        self.assertEqual(self.players[1].get_neighbours_from_top(1), [])
+
+    def test_division(self):
+        division = self.players[2].get_division(2)
+        self.assertEqual(sorted(p.id for p in division), sorted(p.id for p in self.players[1:4]))
+
+
+class PresenceTest(WousoTest):
+    def test_seen_once_per_hour(self):
+        player = self._get_player()
+        now = datetime.now().replace(minute=10)
+        self.assertTrue(Presence.seen(player, now))
+        self.assertFalse(Presence.seen(player, now + timedelta(minutes=20)))
+        self.assertTrue(Presence.seen(player, now + timedelta(minutes=60)))
+
+    def test_flush(self):
+        player = self._get_player()
+        Presence.seen(player)
+        # nothing written yet, but the player is online
+        self.assertIsNone(Player.objects.get(pk=player.pk).last_seen)
+        self.assertEqual(Presence.online_players(), [player])
+
+        Presence.flush()
+        self.assertIsNotNone(Player.objects.get(pk=player.pk).last_seen)
+        self.assertEqual(Presence.online_players(), [player])
+
+    def test_seen_does_not_write(self):
+        player, other = self._get_player(), self._get_player(2)
+        now = datetime.now()
+        Presence.seen(player, now)
+        Presence.seen(other, now + Presence.flush_interval())
+        self.assertIsNone(Player.objects.get(pk=player.pk).last_seen)
+        self.assertEqual(Presence.flush(now + Presence.flush_interval()), 2)
+        self.assertEqual(Player.objects.get(pk=player.pk).last_seen, now)
+
+    def test_players_kept_apart(self):
+        players = [self._get_player(i) for i in range(3)]
+        for p in players:
+            Presence.seen(p)
+        self.assertEqual(set(Presence.online_players()), set(players))
+        # flushed slots are read from the database
+        Presence.flush()
+        Presence.seen(players[0])
+        self.assertEqual(Presence.online_players()[0], players[0])
+        self.assertEqual(set(Presence.online_players()), set(players))
+
+    def test_group_online_players(self):
+        player = self._get_player()
+        group = PlayerGroup.objects.create(name='group')
+        group.players.add(player)
+        self.assertEqual(group.online_players.count(), 0)
+        Presence.seen(player)
+        self.assertEqual(list(group.online_players), [player])
+
+
 class PlayerCacheTest(WousoTest):
     def test_race_name(self):
         p = self._get_player()
@@ -0,0 +1,94 @@
+"""
+Batched expiry of the challenges left launched or accepted before yesterday.
+
+Expiring them one by one (refuse or set_expired) costs several queries per
+challenge. ChallengeExpiry loads them in one query and applies the same
+outcome in bulk: status updates, a ScoreBatch for the warranty refunds and
+the results, Activity.add_many for the activity and one stats update per
+player. Challenges owned by games with their own manager still expire one
+by one.
+"""
+import time
+from django.db import transaction
+from wouso.core import scoring
+from wouso.core.common import chunks
+from wouso.interface.activity.models import Activity
+from wouso.games.challenge.models import Challenge, ChallengeUser, ChallengeStats, ChallengeGame, \
+    DefaultChallengeManager
+
+
+class ChallengeExpiry(object):
+    def __init__(self, today):
+        self.today = today
+
+    @staticmethod
+    def _is_default(challenge):
+        # Game's primary key is its name, no need to join the owner
+        return challenge.owner_id in (None, 'ChallengeGame')
+
+    def run(self):
+        """ Expire the challenges, return a dictionary of counts and the duration in seconds """
+        start = time.time()
+        refused, played, other = [], [], []
+        with transaction.commit_on_success():
+            # owner is nullable, an outer join can't be locked FOR UPDATE
+            challenges = Challenge.get_expired(self.today).select_for_update().select_related(
+                'user_from__user', 'user_to__user')
+            for c in challenges:
+                if not self._is_default(c):
+                    other.append(c)
+                elif c.is_launched():
+                    refused.append(c)
+                else:
+                    played.append(c)
+
+            batch = scoring.ScoreBatch()
+            activities = []
+            updates = {}
+            for c in refused:
+                # launched before yesterday, automatically refuse
+                c.status = 'R'
+                updates.setdefault(('R', None), []).append(c.id)
+                manager = DefaultChallengeManager(c)
+                activities.append(manager.refuse_activity(auto=True))
+                if c.WARRANTY:
+                    # give warranty back to initiator
+                    batch.unset(c.user_from.user, ChallengeGame, 'chall-warranty', external_id=c.id)
+            for c in played:
+                # launched and accepted before yesterday, but not played by both
+                for p in c.participants:
+                    if not p.played:
+                        p.score = 0.0
+                        p.played = True
+                manager = DefaultChallengeManager(c)
+                result = manager.get_result()
+                if result == 'draw':
+                    c.status = 'D'
+                else:
+                    c.status = 'P'
+                    c.user_won, c.user_lost = result
+                    c.winner = c.user_won.user
+                updates.setdefault((c.status, c.winner_id), []).append(c.id)
+                activities.append(manager.result_activity())
+                for player, formula, kwargs in manager.scores():
+                    batch.score(player, ChallengeGame, formula, **kwargs)
+
+            for (status, winner_id), ids in updates.iteritems():
+                for chunk in chunks(ids):
+                    Challenge.objects.filter(id__in=chunk).update(status=status, winner=winner_id)
+            for ids in chunks(set(c.user_from.user_id for c in refused)):
+                ChallengeUser.objects.filter(id__in=ids).update(last_launched=None)
+            ChallengeStats.record_many(refused + played)
+            Activity.add_many(activities)
+            added, removed = batch.apply()
+
+        for c in other:
+            if c.is_launched():
+                c.refuse(auto=True)
+            else:
+                c.set_expired()
+
+        return dict(refused=len(refused), played=len([c for c in played if c.status == 'P']),
+                    draw=len([c for c in played if c.status == 'D']), other=len(other),
+                    activities=len(activities), history_added=added, history_removed=removed,
+                    duration=time.time() - start)
@@ -0,0 +1,32 @@
+import pickle
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from wouso.core.qpool.models import Question
+from wouso.games.challenge.models import Participant, ResponseRecord
+
+
+class Command(BaseCommand):
+    help = 'Convert the pickled responses of challenge participants to response records'
+    option_list = BaseCommand.option_list + (
+        make_option('--keep',
+                    action='store_true',
+                    dest='keep',
+                    default=False,
+                    help='Do not clear the pickled responses after converting them.'
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        participants = Participant.objects.exclude(responses__isnull=True).exclude(responses='')
+        converted, failed = 0, 0
+        for participant in participants.iterator():
+            try:
+                responses = pickle.loads(str(participant.responses))
+                ResponseRecord.record(participant, responses)
+            except (pickle.UnpicklingError, ValueError, EOFError, Question.DoesNotExist):
+                failed += 1
+                continue
+            if not options['keep']:
+                Participant.objects.filter(id=participant.id).update(responses='')
+            converted += 1
+        self.stdout.write('Converted %d participants, %d failed.\n' % (converted, failed))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from wouso.games.challenge.models import ChallengeStats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per player and per opponent challenge statistics from the challenges'
+
+    def handle(self, *args, **options):
+        count = ChallengeStats.rebuild()
+        self.stdout.write('Rebuilt challenge statistics of %d players\n' % count)
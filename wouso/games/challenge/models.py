@@ -1,17 +1,19 @@
 import random
 from datetime import datetime, time, timedelta, date
-from random import shuffle
-import pickle as pk
 import sys
-from django.db import models
-from django.db.models import Q, Avg
+from django.db import models, transaction
+from django.db.models import Q, F, Avg, Count
 from django.utils.translation import ugettext_noop, ugettext as _
 from django.core.urlresolvers import reverse
 from django.shortcuts import get_object_or_404
 from wouso.core.user.models import Player
+from wouso.core.user.ranking import Ranking
 from wouso.core.magic.manager import InsufficientAmount
 from wouso.core.qpool.models import Question
-from wouso.core.qpool import get_questions_with_category, register_category
+from wouso.core.qpool.grading import Grader
+from wouso.core.qpool import register_category
+from wouso.core.qpool.sampler import QuestionSampler
+from wouso.core.common import bulk_insert, chunks
 from wouso.core.game.models import Game
 from wouso.core import scoring, signals
 from wouso.core.god import God
@@ -25,18 +27,23 @@ class ChallengeException(Exception):
 
 class ChallengeUser(Player):
     """ Extension of the userprofile, customized for challenge """
+    # Maximum rank difference between players in the same division
+    DIVISION_RANGE = 20
 
     last_launched = models.DateTimeField(blank=True, null=True)
 
     def is_eligible(self):
         return God.user_is_eligible(self, ChallengeGame)
 
+    @staticmethod
+    def _today():
+        now = datetime.now()
+        return datetime.combine(now, time()), datetime.combine(now, time(23, 59, 59))
+
     def can_launch(self):
         """ Check if 1 challenge per day restriction apply
         """
-        now = datetime.now()
-        today_start = datetime.combine(now, time())
-        today_end = datetime.combine(now, time(23, 59, 59))
+        today_start, today_end = self._today()
         logging.info("today_start: %s, today_end: %s, self.last_launched: %s" % (today_start, today_end, self.last_launched))
         if self.magic.has_modifier('challenge-cannot-challenge'):
             return False
@@ -53,11 +60,7 @@ class ChallengeUser(Player):
         return self.points >= REQ_POINTS
 
     def in_same_division(self, user):
-        from wouso.interface.top.models import TopUser
-        position_diff = abs(self.get_extension(TopUser).position - user.get_extension(TopUser).position)
-        if position_diff <= 20:
-            return True
-        return False
+        return abs(Ranking.rank(self) - Ranking.rank(user)) <= self.DIVISION_RANGE
 
     def can_challenge(self, user):
         """ Check if the target user is available.
@@ -95,6 +98,13 @@ class ChallengeUser(Player):
         return challenge.can_play(self)
 
     def launch_against(self, destination):
+        """ Launch a challenge against destination, raise ChallengeException if not allowed.
+
+        The rows of both players are locked, in id order, for the launch; launches
+        between other players run concurrently. Today's launch is claimed with a
+        conditional update, so two launches of the same player cannot both pass.
+        Everything the launch writes, warranty included, is rolled back on error.
+        """
         destination = destination.get_extension(ChallengeUser)
 
         if destination.id == self.id:
@@ -109,7 +119,22 @@ class ChallengeUser(Player):
         if not self.can_challenge(destination):
             raise ChallengeException('Player cannot launch against this opponent')
 
-        return Challenge.create(user_from=self, user_to=destination)
+        with transaction.commit_on_success():
+            list(ChallengeUser.objects.select_for_update().filter(id__in=(self.id, destination.id)).order_by('id'))
+
+            if Challenge.pending_between(self, destination):
+                raise ChallengeException('There is already a pending challenge between you')
+
+            today_start, today_end = self._today()
+            now = datetime.now()
+            not_today = Q(last_launched__isnull=True) | Q(last_launched__lt=today_start) | \
+                Q(last_launched__gt=today_end)
+            if not ChallengeUser.objects.filter(id=self.id).filter(not_today).update(last_launched=now):
+                raise ChallengeException('Player cannot launch')
+
+            challenge = Challenge.create(user_from=self, user_to=destination)
+            self.last_launched = now
+        return challenge
 
     def set_last_launched(self, value):
         logging.info("set last launched of %s to %s" % (hex(id(self)), value))
@@ -132,22 +157,29 @@ class ChallengeUser(Player):
         return self.get_all_challenges().filter(status=u'R')
 
     def get_win_percentage(self):
-        w = self.get_won_challenges().count()
-        d = self.get_draw_challenges().count()
-        l = self.get_lost_challenges().count()
-        # 1 draw counts as 1/2 win, 1/2 loss
-        return 0 if w + d == 0 else (w + d / 2.0) / (w + l + d) * 100
+        return ChallengeStats.get_for(self).win_percentage
+
+    def get_opponent_pool(self):
+        """ Return the ids of the players in the same division which can play.
+        The division is read from the live ranking, so it follows points and race changes.
+        """
+        ids = [p.id for p in Ranking.around(self, self.DIVISION_RANGE)]
+        playable = set(Ranking.playable().filter(id__in=ids).values_list('id', flat=True))
+        return [id for id in ids if id != self.id and id in playable]
 
     def get_random_opponent(self):
-        players = ChallengeUser.objects.exclude(user=self.user)
-        players = players.exclude(race__can_play=False)
-        players = [p for p in players if self.can_challenge(p) and self.in_same_division(p)]
-        if not players:
-            return False
-        # selects the user to be challenged
-        import random
-        i = random.randrange(0, len(players))
-        return players[i]
+        """ Draw candidates from the opponent pool until one of them can be challenged.
+        """
+        pool = self.get_opponent_pool()
+        random.shuffle(pool)
+        for id in pool:
+            try:
+                candidate = ChallengeUser.objects.get(pk=id)
+            except ChallengeUser.DoesNotExist:
+                candidate = Player.objects.get(pk=id).get_extension(ChallengeUser)
+            if self.can_challenge(candidate):
+                return candidate
+        return False
 
     def get_related_challenges(self, target_user):
         # Gets the challenges between self and target_user
@@ -158,51 +190,19 @@ class ChallengeUser(Player):
         return chall_total
 
     def get_stats(self):
-        chall_total = self.get_all_challenges()
-        chall_won = self.get_won_challenges()
-        chall_sent = chall_total.filter(user_from__user=self)
-        chall_rec = chall_total.filter(user_to__user=self)
-
-        n_chall_sent = chall_sent.count()
-        n_chall_rec = chall_rec.count()
-        n_chall_played = chall_sent.count() + chall_rec.count()
-        n_chall_won = chall_won.count()
-        n_chall_ref = self.get_refused_challenges().count()
-        all_participation = Participant.objects.filter(user=self)
-
-        opponents_from = list(set(map(lambda x: x.user_to.user, chall_sent)))
-        opponents_to = list(set(map(lambda x: x.user_from.user, chall_rec)))
-        opponents = list(set(opponents_from + opponents_to))
-
-        result = []
-        for op in opponents:
-            chall_against_op = chall_total.filter(Q(user_to__user=op) | Q(user_from__user=op))
-            won = chall_against_op.filter(Q(status=u'P') & Q(winner=self)).count()
-            lost = chall_against_op.filter(Q(status=u'P') & Q(winner=op)).count()
-            draw = chall_against_op.filter(Q(status=u'D')).count()
-            refused = chall_against_op.filter(Q(status=u'R')).count()
-            total = won + lost + draw + refused
-            result.append((op, won, lost, draw, refused, total))
+        stats = ChallengeStats.get_for(self)
+        pairs = ChallengePairStats.objects.filter(player=self).select_related('opponent')
+        result = [(p.opponent, p.won, p.lost, p.draw, p.refused, p.total) for p in pairs]
 
         # Sort results by 'total'
         result = sorted(result, key=lambda by: by[5], reverse=True)
 
-        average_time = all_participation.aggregate(Avg('seconds_took'))['seconds_took__avg']
-        average_score = all_participation.aggregate(Avg('score'))['score__avg']
-
-        if average_time is None:
-            average_time = 0
-        if average_score is None:
-            average_score = 0
-
-        win_percentage = self.get_win_percentage()
+        return dict(n_chall_played=stats.sent + stats.received, n_chall_won=stats.won,
+                    n_chall_sent=stats.sent, n_chall_rec=stats.received,
+                    n_chall_ref=stats.refused, current_player=self,
+                    average_time=stats.average_time, average_score=stats.average_score,
+                    win_percentage=stats.win_percentage, opponents=result)
 
-        stats = dict(n_chall_played=n_chall_played, n_chall_won=n_chall_won,
-                     n_chall_sent=n_chall_sent, n_chall_rec=n_chall_rec,
-                     n_chall_ref=n_chall_ref, current_player=self,
-                     average_time=average_time, average_score=average_score,
-                     win_percentage=win_percentage, opponents=result)
-        return stats
 
 Player.register_extension('challenge', ChallengeUser)
 
@@ -212,6 +212,7 @@ class Participant(models.Model):
     start = models.DateTimeField(null=True, blank=True)
     seconds_took = models.IntegerField(null=True, blank=True)
     played = models.BooleanField(default=False)
+    # Legacy pickled responses, see ResponseRecord and the convertresponses command
     responses = models.TextField(default='', blank=True, null=True)
     # score = models.FloatField(null=True, blank=True)
     score = models.IntegerField(null=True, blank=True)
@@ -227,6 +228,220 @@ class Participant(models.Model):
         return unicode(self.user)
 
 
+class ResponseRecord(models.Model):
+    """ The answers checked by a participant at a question, and their grade """
+    participant = models.ForeignKey(Participant, related_name='response_records')
+    question = models.ForeignKey(Question)
+    # comma separated ids of the checked answers
+    answer_ids = models.CharField(max_length=255, blank=True, default='')
+    # partial score, out of 100
+    score = models.IntegerField(default=0)
+    correct = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('participant', 'question')
+
+    @property
+    def checked(self):
+        return [int(id) for id in self.answer_ids.split(',') if id]
+
+    @classmethod
+    def record(cls, participant, responses, grader=None):
+        """ Store the responses of a participant, given as a dict of question id: checked answer ids """
+        grader = grader or Grader(responses)
+        records = []
+        for question_id, checked in responses.iteritems():
+            score, right, correct_count = grader.partial_score(question_id, checked)
+            records.append(cls(participant=participant, question_id=int(question_id),
+                               answer_ids=','.join(str(id) for id in sorted(checked)),
+                               score=int(100.0 * score), correct=grader.is_right(question_id, checked)))
+        cls.objects.filter(participant=participant).delete()
+        cls.objects.bulk_create(records)
+        return records
+
+    @classmethod
+    def _per_question(cls, records):
+        """ Return a dict of question id: (answered, correct) """
+        answered = dict(records.values_list('question').annotate(Count('id')).order_by())
+        correct = dict(records.filter(correct=True).values_list('question').annotate(Count('id')).order_by())
+        return dict((q, (n, correct.get(q, 0))) for q, n in answered.iteritems())
+
+    @classmethod
+    def question_stats(cls, records=None, group=0.27):
+        """ Per question statistics, as a dict of question id: dict with:
+         - answered: number of responses
+         - difficulty: fraction of correct responses, lower is harder
+         - score: average partial score
+         - discrimination: fraction of correct responses among the participants
+        in the best group (27% by default) minus the fraction among the worst group,
+        ranking participants by challenge score.
+        """
+        records = cls.objects.all() if records is None else records
+        stats = {}
+        for q, (answered, correct) in cls._per_question(records).iteritems():
+            stats[q] = {'answered': answered, 'difficulty': float(correct) / answered,
+                        'score': 0.0, 'discrimination': None}
+        for q, score in records.values_list('question').annotate(Avg('score')).order_by():
+            stats[q]['score'] = score
+
+        participants = Participant.objects.filter(id__in=records.values('participant'), score__isnull=False)
+        size = int(participants.count() * group)
+        if not size:
+            return stats
+        upper = participants.order_by('-score').values_list('score', flat=True)[size - 1]
+        lower = participants.order_by('score').values_list('score', flat=True)[size - 1]
+        if upper <= lower:
+            return stats
+        best = cls._per_question(records.filter(participant__score__gte=upper))
+        worst = cls._per_question(records.filter(participant__score__lte=lower))
+        for q in stats:
+            if q in best and q in worst:
+                (b_answered, b_correct), (w_answered, w_correct) = best[q], worst[q]
+                stats[q]['discrimination'] = float(b_correct) / b_answered - float(w_correct) / w_answered
+        return stats
+
+
+def _result_counts(challenge):
+    """ Return (player id, opponent id, counts) for both participants of a finished or refused challenge """
+    ret = []
+    for me, other, direction in ((challenge.user_from, challenge.user_to, 'sent'),
+                                 (challenge.user_to, challenge.user_from, 'received')):
+        counts = {direction: 1}
+        if challenge.status == 'R':
+            counts['refused'] = 1
+        else:
+            counts['played'] = 1
+            counts['score'] = max(me.score or 0, 0)
+            if me.seconds_took is not None:
+                counts['seconds'] = me.seconds_took
+                counts['timed'] = 1
+            if challenge.status == 'D':
+                counts['draw'] = 1
+            elif challenge.winner_id == me.user_id:
+                counts['won'] = 1
+            else:
+                counts['lost'] = 1
+        ret.append((me.user_id, other.user_id, counts))
+    return ret
+
+
+class ChallengeStats(models.Model):
+    """ Challenge results of a player, updated as challenges end.
+    Rebuild them from the challenges with the rebuildchallengestats command.
+    """
+    player = models.OneToOneField(ChallengeUser, primary_key=True)
+    played = models.IntegerField(default=0)
+    won = models.IntegerField(default=0)
+    lost = models.IntegerField(default=0)
+    draw = models.IntegerField(default=0)
+    refused = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    received = models.IntegerField(default=0)
+    seconds = models.IntegerField(default=0, help_text='Total seconds taken')
+    timed = models.IntegerField(default=0, help_text='Played challenges having a time')
+    score = models.IntegerField(default=0, help_text='Total score')
+
+    FIELDS = ('played', 'won', 'lost', 'draw', 'refused', 'sent', 'received', 'seconds', 'timed', 'score')
+
+    @property
+    def win_percentage(self):
+        # 1 draw counts as 1/2 win, 1/2 loss
+        w, d, l = self.won, self.draw, self.lost
+        return 0 if w + d == 0 else (w + d / 2.0) / (w + l + d) * 100
+
+    @property
+    def average_time(self):
+        return float(self.seconds) / self.timed if self.timed else 0
+
+    @property
+    def average_score(self):
+        return float(self.score) / self.played if self.played else 0
+
+    @classmethod
+    def get_for(cls, player):
+        """ Return the stats of player, empty and unsaved if it has none """
+        try:
+            return cls.objects.get(player=player.id)
+        except cls.DoesNotExist:
+            return cls(player_id=player.id)
+
+    @classmethod
+    def attach(cls, players):
+        """ Load the stats of all players at once, see TopUser.challenge_stats """
+        stats = cls.objects.in_bulk([p.id for p in players])
+        for p in players:
+            p._challenge_stats = stats.get(p.id) or cls(player_id=p.id)
+        return players
+
+    @classmethod
+    def record(cls, challenge):
+        """ Add the result of a challenge which has just ended or was refused """
+        cls.record_many([challenge])
+
+    @classmethod
+    def record_many(cls, challenges):
+        """ Add the results of challenges which have just ended or were refused, once per player and pair """
+        players, pairs = {}, {}
+        for ids in chunks(c.pk for c in challenges):
+            # count the stored results, as rebuild does
+            for challenge in Challenge.objects.filter(pk__in=ids).select_related('user_from', 'user_to'):
+                for player_id, opponent_id, counts in _result_counts(challenge):
+                    for totals, fields in ((players.setdefault(player_id, {}), cls.FIELDS),
+                                           (pairs.setdefault((player_id, opponent_id), {}), ChallengePairStats.FIELDS)):
+                        for k, v in counts.iteritems():
+                            if k in fields:
+                                totals[k] = totals.get(k, 0) + v
+
+        for player_id, totals in players.iteritems():
+            cls.objects.get_or_create(player_id=player_id)
+            cls.objects.filter(player=player_id).update(**dict((k, F(k) + v) for k, v in totals.iteritems()))
+        for (player_id, opponent_id), totals in pairs.iteritems():
+            ChallengePairStats.objects.get_or_create(player_id=player_id, opponent_id=opponent_id)
+            if totals:
+                pair = dict((k, F(k) + v) for k, v in totals.iteritems())
+                ChallengePairStats.objects.filter(player=player_id, opponent=opponent_id).update(**pair)
+
+    @classmethod
+    def rebuild(cls):
+        """ Recompute all stats from the ended and refused challenges, return the number of players """
+        players, pairs = {}, {}
+        challenges = Challenge.objects.filter(status__in=('P', 'D', 'R')).select_related('user_from', 'user_to')
+        for challenge in challenges.iterator():
+            for player_id, opponent_id, counts in _result_counts(challenge):
+                for totals in (players.setdefault(player_id, {}), pairs.setdefault((player_id, opponent_id), {})):
+                    for k, v in counts.iteritems():
+                        totals[k] = totals.get(k, 0) + v
+
+        with transaction.commit_on_success():
+            ChallengePairStats.objects.all().delete()
+            cls.objects.all().delete()
+            bulk_insert(cls, [cls(player_id=id, **totals) for id, totals in players.iteritems()])
+            bulk_insert(ChallengePairStats, [
+                ChallengePairStats(player_id=id, opponent_id=opponent_id,
+                                   **dict((k, v) for k, v in totals.iteritems() if k in ChallengePairStats.FIELDS))
+                for (id, opponent_id), totals in pairs.iteritems()])
+        return len(players)
+
+
+class ChallengePairStats(models.Model):
+    """ Challenge results of a player against one opponent """
+    player = models.ForeignKey(ChallengeUser, related_name='pair_stats')
+    opponent = models.ForeignKey(ChallengeUser, related_name='+')
+    won = models.IntegerField(default=0)
+    lost = models.IntegerField(default=0)
+    draw = models.IntegerField(default=0)
+    refused = models.IntegerField(default=0)
+
+    FIELDS = ('won', 'lost', 'draw', 'refused')
+
+    class Meta:
+        unique_together = ('player', 'opponent')
+
+    @property
+    def total(self):
+        return self.won + self.lost + self.draw + self.refused
+
+
 class Challenge(models.Model):
     STATUS = (
         ('L', 'Launched'),
@@ -253,13 +468,13 @@ class Challenge(models.Model):
     @classmethod
     def create(cls, user_from, user_to, ignore_questions=False):
         """ Assigns questions, and returns the number of assigned q """
-        questions = [q for q in get_questions_with_category('challenge')]
+        questions = QuestionSampler.sample(cls.LIMIT, 'challenge', players=(user_from, user_to))
         if (len(questions) < cls.LIMIT) and not ignore_questions:
             raise ChallengeException('Too few questions')
-        shuffle(questions)
 
-        questions_qs = questions[:cls.LIMIT]
-        challenge = cls.create_custom(user_from, user_to, questions_qs)
+        challenge = cls.create_custom(user_from, user_to, questions)
+        for player in (user_from, user_to):
+            QuestionSampler.mark_seen(player, questions, 'challenge')
 
         # set last_launched
         user_from = user_from.get_extension(ChallengeUser)
@@ -295,6 +510,12 @@ class Challenge(models.Model):
         yesterday = today + timedelta(days=-1)
         return Challenge.objects.filter(user_from__user=user_from, user_to__user=user_to, date__gt=yesterday).count() > 0
 
+    @classmethod
+    def pending_between(cls, player, other):
+        """ Return true if there is a launched or accepted challenge between the two players, in any direction """
+        return Challenge.objects.filter(status__in=('L', 'A')).filter(
+            Q(user_from__user=player, user_to__user=other) | Q(user_from__user=other, user_to__user=player)).exists()
+
     @classmethod
     def last_between(cls, user_from, user_to):
         try:
@@ -329,6 +550,7 @@ class Challenge(models.Model):
         self.status = 'R'
         self.save()
         self.manager.refuse(auto)
+        ChallengeStats.record(self)
 
     def cancel(self):
         self.manager.cancel()
@@ -443,6 +665,7 @@ class Challenge(models.Model):
             self.user_won, self.user_lost = result
             self.winner = self.user_won.user
         self.save()
+        ChallengeStats.record(self)
 
         self.manager.handle_result()
         self.manager.score()
@@ -453,31 +676,7 @@ class Challenge(models.Model):
         Example:
             {1 : [14,], ...}, - has answered answer with id 14 at the question with id 1
         """
-        points = 0.0
-        results = {}
-        for r, v in responses.iteritems():
-            checked, missed, wrong = 0, 0, 0
-            q = Question.objects.get(id=r)
-            for a in q.answers.all():
-                if a.correct:
-                    if a.id in v:
-                        checked += 1
-                    else:
-                        missed += 1
-                elif a.id in v:
-                    wrong += 1
-            correct_count = len([a for a in q.answers if a.correct])
-            wrong_count = len([a for a in q.answers if not a.correct])
-            if correct_count == 0:
-                qpoints = 1 if (len(v) == 0) else 0
-            elif wrong_count == 0:
-                qpoints = 1 if (len(v) == q.answers.count()) else 0
-            else:
-                qpoints = float(checked) / correct_count - float(wrong) / wrong_count
-            qpoints = qpoints if qpoints > 0 else 0
-            points += qpoints
-            results[r] = ((checked, correct_count))
-        return {'points': int(100.0 * points), 'results': results}
+        return Grader(responses).challenge_points(responses)
 
     def set_played(self, user, responses):
         """ Set user's results. If both users have played, also update self and activity. """
@@ -485,14 +684,15 @@ class Challenge(models.Model):
 
         user_played.seconds_took = (datetime.now() - user_played.start).seconds
         user_played.played = True
-        user_played.responses = pk.dumps(responses)
         exp = False
         if self.is_expired(user_played):
             exp = True
             user_played.score = 0.0
         else:
-            results = Challenge._calculate_points(responses)
+            grader = Grader(responses)
+            results = grader.challenge_points(responses)
             user_played.score = results['points']
+            ResponseRecord.record(user_played, responses, grader)
         user_played.save()
 
         if self.user_to.played and self.user_from.played:
@@ -586,18 +786,7 @@ class DefaultChallengeManager(ChallengeManager):
         self.challenge.user_from.user.set_last_launched(None)
 
         # send activity signal
-        if auto:
-            signal_msg = ugettext_noop('has refused challenge from {chall_from} (expired)')
-        else:
-            signal_msg = ugettext_noop('has refused challenge from {chall_from}')
-        action_msg = 'chall-refused'
-        signals.addActivity.send(sender=None,
-                                 user_from=self.challenge.user_to.user,
-                                 user_to=self.challenge.user_from.user,
-                                 message=signal_msg,
-                                 arguments=dict(chall_from=self.challenge.user_from),
-                                 action=action_msg,
-                                 game=ChallengeGame.get_instance())
+        signals.addActivity.send(sender=None, **self.refuse_activity(auto))
         self.challenge.save()
         if self.challenge.WARRANTY:
             # give warranty back to initiator
@@ -622,83 +811,112 @@ class DefaultChallengeManager(ChallengeManager):
 
         return result
 
+    def refuse_activity(self, auto):
+        """ Return the addActivity arguments for the refusal """
+        if auto:
+            signal_msg = ugettext_noop('has refused challenge from {chall_from} (expired)')
+        else:
+            signal_msg = ugettext_noop('has refused challenge from {chall_from}')
+        return dict(user_from=self.challenge.user_to.user,
+                    user_to=self.challenge.user_from.user,
+                    message=signal_msg,
+                    arguments=dict(chall_from=self.challenge.user_from),
+                    action='chall-refused',
+                    game=ChallengeGame.get_instance())
+
     def handle_result(self):
+        activity = self.result_activity()
+        if activity is not None:
+            signals.addActivity.send(sender=None, **activity)
+
+    def result_activity(self):
+        """ Return the addActivity arguments for the result, None if the challenge has not ended """
         if self.challenge.status == 'D':
             action_msg = "chall-draw"
             signal_msg = ugettext_noop('draw result between {user_from} and {user_to}:\n{extra}')
-            signals.addActivity.send(sender=None, user_from=self.challenge.user_to.user,
-                                     user_to=self.challenge.user_from.user,
-                                     message=signal_msg,
-                                     arguments=dict(user_to=self.challenge.user_to, user_from=self.challenge.user_from,
-                                                    extra=self.challenge.extraInfo(self.challenge.user_from, self.challenge.user_to)),
-                                     action=action_msg,
-                                     game=ChallengeGame.get_instance())
+            return dict(user_from=self.challenge.user_to.user,
+                        user_to=self.challenge.user_from.user,
+                        message=signal_msg,
+                        arguments=dict(user_to=self.challenge.user_to, user_from=self.challenge.user_from,
+                                       extra=self.challenge.extraInfo(self.challenge.user_from, self.challenge.user_to)),
+                        action=action_msg,
+                        game=ChallengeGame.get_instance())
         elif self.challenge.status == 'P':
             action_msg = "chall-won"
             signal_msg = ugettext_noop('won challenge with {user_lost}: {extra}')
-            signals.addActivity.send(sender=None, user_from=self.challenge.user_won.user,
-                                     user_to=self.challenge.user_lost.user,
-                                     message=signal_msg,
-                                     arguments=dict(user_lost=self.challenge.user_lost, id=self.challenge.id,
-                                                    extra=self.challenge.extraInfo(self.challenge.user_won, self.challenge.user_lost)),
-                                     action=action_msg,
-                                     game=ChallengeGame.get_instance())
+            return dict(user_from=self.challenge.user_won.user,
+                        user_to=self.challenge.user_lost.user,
+                        message=signal_msg,
+                        arguments=dict(user_lost=self.challenge.user_lost, id=self.challenge.id,
+                                       extra=self.challenge.extraInfo(self.challenge.user_won, self.challenge.user_lost)),
+                        action=action_msg,
+                        game=ChallengeGame.get_instance())
+        return None
 
     def score(self):
+        for player, formula, kwargs in self.scores():
+            scoring.score(player, ChallengeGame, formula, **kwargs)
+
+    def scores(self):
+        """ Return the (player, formula, score arguments) due for the result """
         if not self.challenge.SCORING:
-            return
+            return []
 
         for u in (self.challenge.user_to, self.challenge.user_from):
                 u.percents = 100
 
+        ret = []
         if self.challenge.status == 'D':
-            scoring.score(self.challenge.user_to.user, ChallengeGame, 'chall-draw', percents=self.challenge.user_to.percents)
-            scoring.score(self.challenge.user_from.user, ChallengeGame, 'chall-draw', percents=self.challenge.user_from.percents)
+            ret.append((self.challenge.user_to.user, 'chall-draw', dict(percents=self.challenge.user_to.percents)))
+            ret.append((self.challenge.user_from.user, 'chall-draw', dict(percents=self.challenge.user_from.percents)))
         else:
-            diff_race = self.challenge.user_won.user.race != self.challenge.user_lost.user.race
+            diff_race = self.challenge.user_won.user.race_id != self.challenge.user_lost.user.race_id
             diff_class = self.challenge.user_won.user.group != self.challenge.user_lost.user.group
             diff_race = 1 if diff_race else 0
             diff_class = 1 if diff_class else 0
             winner_points = self.challenge.user_won.user.points
             loser_points = self.challenge.user_lost.user.points
+            winner_magic = self.challenge.user_won.user.magic.snapshot
+            loser_magic = self.challenge.user_lost.user.magic.snapshot
 
             # Check for charge
-            if self.challenge.user_won.user.magic.has_modifier('challenge-affect-scoring-won'):
-                self.challenge.user_won.percents += self.challenge.user_won.user.magic.modifier_percents('challenge-affect-scoring-won') - 100
+            if winner_magic.has_modifier('challenge-affect-scoring-won'):
+                self.challenge.user_won.percents += winner_magic.modifier_percents('challenge-affect-scoring-won') - 100
 
             # Check for weakness
-            if self.challenge.user_won.user.magic.has_modifier('challenge-affect-scoring-lost'):
-                self.challenge.user_won.percents += self.challenge.user_won.user.magic.modifier_percents('challenge-affect-scoring-lost') - 100
+            if winner_magic.has_modifier('challenge-affect-scoring-lost'):
+                self.challenge.user_won.percents += winner_magic.modifier_percents('challenge-affect-scoring-lost') - 100
 
             # Check for frenzy on the winning player
-            if self.challenge.user_won.user.magic.has_modifier('challenge-affect-scoring'):
-                self.challenge.user_won.percents += self.challenge.user_won.user.magic.modifier_percents('challenge-affect-scoring') - 100
+            if winner_magic.has_modifier('challenge-affect-scoring'):
+                self.challenge.user_won.percents += winner_magic.modifier_percents('challenge-affect-scoring') - 100
 
             if self.challenge.WARRANTY:
                 # warranty not affected by percents
-                scoring.score(self.challenge.user_won.user, ChallengeGame, 'chall-warranty-return', external_id=self.challenge.id)
+                ret.append((self.challenge.user_won.user, 'chall-warranty-return', dict(external_id=self.challenge.id)))
 
-            scoring.score(self.challenge.user_won.user, ChallengeGame, 'chall-won',
-                          external_id=self.challenge.id, percents=self.challenge.user_won.percents,
-                          points=self.challenge.user_won.score, points2=self.challenge.user_lost.score,
-                          different_race=diff_race, different_class=diff_class,
-                          winner_points=winner_points, loser_points=loser_points)
+            ret.append((self.challenge.user_won.user, 'chall-won',
+                        dict(external_id=self.challenge.id, percents=self.challenge.user_won.percents,
+                             points=self.challenge.user_won.score, points2=self.challenge.user_lost.score,
+                             different_race=diff_race, different_class=diff_class,
+                             winner_points=winner_points, loser_points=loser_points)))
 
             # Check for frenzy on the losing player
-            if self.challenge.user_lost.user.magic.has_modifier('challenge-affect-scoring'):
-                self.challenge.user_lost.percents += self.challenge.user_lost.user.magic.modifier_percents('challenge-affect-scoring') - 100
+            if loser_magic.has_modifier('challenge-affect-scoring'):
+                self.challenge.user_lost.percents += loser_magic.modifier_percents('challenge-affect-scoring') - 100
 
             # Check for spell evade
-            if self.challenge.user_lost.user.magic.has_modifier('challenge-evade'):
+            if loser_magic.has_modifier('challenge-evade'):
                 random.seed()
                 if random.random() < 0.20:
                     # He's lucky, no penalty, return warranty
-                    scoring.score(self.challenge.user_lost.user, ChallengeGame, 'chall-warranty-return', external_id=self.challenge.id)
+                    ret.append((self.challenge.user_lost.user, 'chall-warranty-return', dict(external_id=self.challenge.id)))
                     Message.send(sender=None, receiver=self.challenge.user_lost.user, subject="Challenge evaded", text="You have just evaded losing points in a challenge")
 
-            scoring.score(self.challenge.user_lost.user, ChallengeGame, 'chall-lost',
-                          external_id=self.challenge.id, percents=self.challenge.user_lost.percents,
-                          points=self.challenge.user_lost.score, points2=self.challenge.user_lost.score)
+            ret.append((self.challenge.user_lost.user, 'chall-lost',
+                        dict(external_id=self.challenge.id, percents=self.challenge.user_lost.percents,
+                             points=self.challenge.user_lost.score, points2=self.challenge.user_lost.score)))
+        return ret
 
 
 class ChallengeGame(Game):
@@ -786,15 +1004,15 @@ class ChallengeGame(Game):
     def management_task(cls, now=None, stdout=sys.stdout):
         now = now if now else datetime.now()
         today = now.date()
-        challenges = Challenge.get_expired(today)
-        stdout.write(' Updating %d expired challenges (at %s)\n' % (len(challenges), today))
-        for c in challenges:
-            if c.is_launched():
-                # launched before yesterday, automatically refuse
-                c.refuse(auto=True)
-            else:
-                # launched and accepted before yesterday, but not played by both
-                c.set_expired()
+        from wouso.games.challenge.expiry import ChallengeExpiry
+
+        result = ChallengeExpiry(today).run()
+        stdout.write(' Expired challenges (at %s): %d refused, %d won, %d draw, %d other games, '
+                     '%d activities, %d/%d history rows added/removed in %.2fs\n' % (
+                         today, result['refused'], result['played'], result['draw'], result['other'],
+                         result['activities'], result['history_added'], result['history_removed'],
+                         result['duration']))
+        return result['refused'] + result['played'] + result['draw'] + result['other']
 
     @classmethod
     def get_api(kls):
@@ -3,15 +3,19 @@ import unittest
 from datetime import datetime,timedelta
 from mock import patch
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.test import TransactionTestCase
 from django.test.client import Client, RequestFactory
 from django.utils.translation import ugettext as _
 from wouso.core.qpool.models import Question, Answer, Category
+from wouso.core.qpool.sampler import QuestionSampler
 from wouso.core.tests import WousoTest
-from wouso.games.challenge.models import ChallengeUser, Challenge, ChallengeGame
+from wouso.games.challenge.models import ChallengeUser, Challenge, ChallengeGame, Participant, ResponseRecord, \
+    ChallengeException, ChallengeStats, ChallengePairStats
 from wouso.core.user.models import Player, Race
 from wouso.core import scoring
-from wouso.core.scoring.models import Formula, Coin
+from wouso.core.scoring.models import Formula, Coin, CoinBalance
 from wouso.games.challenge.views import challenge_random, launch
 from wouso.interface.top.models import Top, TopUser, History
 
@@ -74,6 +78,23 @@ class ChallengeTestCase(WousoTest):
         chall.delete()
 
 
+    def test_launch_against_once_a_day_and_pair(self):
+        category = Category.add('challenge')
+        for i in range(Challenge.LIMIT):
+            Question.objects.create(text='text %s' % i, category=category, active=True)
+        chall_user3 = self._get_player(3).get_extension(ChallengeUser)
+
+        chall = self.chall_user.launch_against(self.chall_user2)
+        self.assertTrue(chall.is_launched())
+        self.assertTrue(ChallengeUser.objects.get(pk=self.chall_user.pk).last_launched)
+        self.assertRaises(ChallengeException, self.chall_user.launch_against, chall_user3)
+
+        # a new day, but the challenge between the two is still pending
+        ChallengeUser.objects.filter(pk=self.chall_user.pk).update(last_launched=datetime.now() - timedelta(days=1))
+        self.chall_user.last_launched = None
+        self.assertRaises(ChallengeException, self.chall_user2.launch_against, self.chall_user)
+        self.assertTrue(self.chall_user.launch_against(chall_user3))
+
     def test_run_accept(self):
         chall = Challenge.create(user_from=self.chall_user, user_to=self.chall_user2, ignore_questions=True)
 
@@ -264,6 +285,28 @@ class ChallengeTestCase(WousoTest):
         self.assertFalse(players[t].in_same_division(players[min(n-1, t+division_range+1)]))
 
 
+    def test_random_opponent_from_division(self):
+        players = [self._get_player(i).get_extension(ChallengeUser) for i in xrange(30)]
+        for i, p in enumerate(players):
+            scoring.score_simple(p, 'points', 10000 + i * 10)
+
+        # players[29] is on top, its division ends at players[9]
+        pool = players[29].get_opponent_pool()
+        self.assertEqual(sorted(pool), sorted(p.id for p in players[9:29]))
+
+        for i in xrange(10):
+            opponent = players[29].get_random_opponent()
+            self.assertIn(opponent.id, pool)
+
+    def test_random_opponent_checks_candidate(self):
+        players = [self._get_player(i).get_extension(ChallengeUser) for i in xrange(2)]
+        for i, p in enumerate(players):
+            scoring.score_simple(p, 'points', 10000 + i * 10)
+
+        with patch.object(ChallengeUser, 'can_challenge', return_value=False):
+            self.assertFalse(players[0].get_random_opponent())
+
+
 class ChallengeApi(WousoTest):
     def setUp(self):
         super(ChallengeApi, self).setUp()
@@ -397,6 +440,71 @@ class TestCalculatePoints(WousoTest):
         self.assertEqual(Challenge._calculate_points(post)['points'], 0)
 
 
+class TestResponseRecord(WousoTest):
+    def setUp(self):
+        super(TestResponseRecord, self).setUp()
+        self.q1 = Question.objects.create(text='q1')
+        self.q2 = Question.objects.create(text='q2')
+        self.right = {}
+        self.wrong = {}
+        for q in (self.q1, self.q2):
+            self.right[q.id] = Answer.objects.create(question=q, correct=True, text='correct').id
+            self.wrong[q.id] = Answer.objects.create(question=q, correct=False, text='wrong').id
+
+    def participant(self, i, score):
+        user = self._get_player(i).get_extension(ChallengeUser)
+        return Participant.objects.create(user=user, score=score, played=True)
+
+    def test_set_played_records_responses(self):
+        p1, p2 = self._get_player(1), self._get_player(2)
+        challenge = Challenge.create(p1, p2, ignore_questions=True)
+        challenge.accept()
+        participant = challenge.participant_for_player(p1)
+        participant.start = datetime.now()
+        participant.save()
+
+        challenge.set_played(p1, {self.q1.id: [self.right[self.q1.id]], self.q2.id: [self.wrong[self.q2.id]]})
+        records = dict((r.question_id, r) for r in participant.response_records.all())
+        self.assertEqual(len(records), 2)
+        self.assertTrue(records[self.q1.id].correct)
+        self.assertEqual(records[self.q1.id].score, 100)
+        self.assertEqual(records[self.q1.id].checked, [self.right[self.q1.id]])
+        self.assertFalse(records[self.q2.id].correct)
+        self.assertEqual(records[self.q2.id].score, 0)
+
+    def test_question_stats(self):
+        # q1 is answered correctly only by the best participants, q2 by everybody
+        for i in range(4):
+            best = i < 2
+            participant = self.participant(i, 200 if best else 100)
+            ResponseRecord.record(participant, {
+                self.q1.id: [self.right[self.q1.id] if best else self.wrong[self.q1.id]],
+                self.q2.id: [self.right[self.q2.id]]})
+
+        with self.assertNumQueries(10):
+            stats = ResponseRecord.question_stats(group=0.5)
+        self.assertEqual(stats[self.q1.id]['answered'], 4)
+        self.assertEqual(stats[self.q1.id]['difficulty'], 0.5)
+        self.assertEqual(stats[self.q1.id]['discrimination'], 1.0)
+        self.assertEqual(stats[self.q2.id]['difficulty'], 1.0)
+        self.assertEqual(stats[self.q2.id]['score'], 100)
+        self.assertEqual(stats[self.q2.id]['discrimination'], 0.0)
+
+    def test_convert_pickled_responses(self):
+        import pickle
+        from django.core.management import call_command
+
+        participant = self.participant(1, 100)
+        participant.responses = pickle.dumps({self.q1.id: [self.right[self.q1.id]]})
+        participant.save()
+        call_command('convertresponses')
+
+        record = ResponseRecord.objects.get(participant=participant)
+        self.assertEqual(record.question, self.q1)
+        self.assertTrue(record.correct)
+        self.assertEqual(Participant.objects.get(pk=participant.pk).responses, '')
+
+
 class TestCustomChallenge(WousoTest):
     def test_custom_create(self):
         Challenge.WARRANTY = False
@@ -423,6 +531,164 @@ class TestChallengeCache(WousoTest):
         p1 = p1.user.get_profile()
         self.assertEqual(p1.points, initial_points)
 
+class TestChallengeStats(WousoTest):
+    def setUp(self):
+        super(TestChallengeStats, self).setUp()
+        scoring.setup_scoring()
+        ChallengeGame.get_instance().save()
+        self.p1 = self._get_player(1).get_extension(ChallengeUser)
+        self.p2 = self._get_player(2).get_extension(ChallengeUser)
+        self.p3 = self._get_player(3).get_extension(ChallengeUser)
+
+    def _finish(self, user_from, user_to, winner=None):
+        challenge = Challenge.create(user_from, user_to, ignore_questions=True)
+        challenge.accept()
+        if winner is None:
+            challenge.set_expired()
+        else:
+            challenge.set_won_by_player(winner)
+        return challenge
+
+    def _stats(self, player):
+        stats = ChallengeStats.get_for(player)
+        return dict((f, getattr(stats, f)) for f in ChallengeStats.FIELDS)
+
+    def test_recorded_and_rebuilt(self):
+        self._finish(self.p1, self.p2, winner=self.p1)
+        self._finish(self.p2, self.p1, winner=self.p1)
+        self._finish(self.p1, self.p3)
+        Challenge.create(self.p3, self.p1, ignore_questions=True).refuse()
+
+        stats = ChallengeStats.get_for(self.p1)
+        self.assertEqual((stats.played, stats.won, stats.lost, stats.draw, stats.refused), (3, 2, 0, 1, 1))
+        self.assertEqual((stats.sent, stats.received), (2, 2))
+        self.assertEqual(stats.win_percentage, 2.5 / 3 * 100)
+        self.assertEqual(ChallengeStats.get_for(self.p2).lost, 2)
+        self.assertEqual(self.p1.get_win_percentage(), stats.win_percentage)
+
+        opponents = self.p1.get_stats()['opponents']
+        self.assertEqual([(op.id, won, lost, draw, refused, total) for op, won, lost, draw, refused, total in opponents],
+                         [(self.p2.id, 2, 0, 0, 0, 2), (self.p3.id, 0, 0, 1, 1, 2)])
+
+        before = dict((p.id, self._stats(p)) for p in (self.p1, self.p2, self.p3))
+        ChallengeStats.objects.all().update(won=100)
+        self.assertEqual(ChallengeStats.rebuild(), 3)
+        self.assertEqual(dict((p.id, self._stats(p)) for p in (self.p1, self.p2, self.p3)), before)
+        self.assertEqual(ChallengePairStats.objects.get(player=self.p1, opponent=self.p3).refused, 1)
+
+    def test_top_user_properties(self):
+        from wouso.interface.top.models import TopUser
+
+        self._finish(self.p1, self.p2, winner=self.p2)
+        users = ChallengeStats.attach([self.p1.get_extension(TopUser), self.p2.get_extension(TopUser)])
+        with self.assertNumQueries(0):
+            self.assertEqual((users[0].lost_challenges, users[1].won_challenges), (1, 1))
+            self.assertEqual(users[1].win_percentage, 100)
+
+
+class TestChallengeExpiry(WousoTest):
+    def setUp(self):
+        super(TestChallengeExpiry, self).setUp()
+        scoring.setup_scoring()
+        ChallengeGame.get_instance().save()
+        Challenge.WARRANTY = True
+
+    def _scenario(self, offset):
+        """ A launched, a won and a draw challenge, all stale, between three new players """
+        p1, p2, p3 = [self._get_player(offset + i).get_extension(ChallengeUser) for i in range(3)]
+        launched = Challenge.create(p1, p2, ignore_questions=True)
+        won = Challenge.create(p2, p3, ignore_questions=True)
+        won.accept()
+        Participant.objects.filter(pk=won.user_to.pk).update(score=3, played=True, seconds_took=40)
+        draw = Challenge.create(p1, p3, ignore_questions=True)
+        draw.accept()
+        stale = datetime.now() - timedelta(days=3)
+        challenges = [launched, won, draw]
+        Challenge.objects.filter(pk__in=[c.pk for c in challenges]).update(date=stale)
+        return [p1, p2, p3], [Challenge.objects.get(pk=c.pk) for c in challenges]
+
+    def _outcome(self, players, challenges):
+        from wouso.interface.activity.models import Activity
+
+        players = [Player.objects.get(pk=p.pk) for p in players]
+        challenges = [Challenge.objects.get(pk=c.pk) for c in challenges]
+        winners = [[p.pk for p in players].index(c.winner_id) if c.winner_id else None for c in challenges]
+        activities = Activity.objects.filter(user_from__in=players).exclude(action=None)
+        return dict(points=[p.points for p in players],
+                    balances=[scoring.real_points(p) for p in players],
+                    statuses=[c.status for c in challenges], winners=winners,
+                    activities=sorted(activities.values_list('action', flat=True)),
+                    stats=[(s.played, s.won, s.lost, s.draw, s.refused) for s in map(ChallengeStats.get_for, players)],
+                    launched=[p.get_extension(ChallengeUser).last_launched is None for p in players])
+
+    def test_batch_matches_one_by_one(self):
+        from wouso.games.challenge.expiry import ChallengeExpiry
+
+        one_players, one_challenges = self._scenario(0)
+        for c in one_challenges:
+            if c.is_launched():
+                c.refuse(auto=True)
+            else:
+                c.set_expired()
+        batch_players, batch_challenges = self._scenario(10)
+
+        result = ChallengeExpiry(datetime.now().date()).run()
+        self.assertEqual((result['refused'], result['played'], result['draw'], result['other']), (1, 1, 1, 0))
+        self.assertEqual(result['history_removed'], 1)
+        self.assertEqual(self._outcome(batch_players, batch_challenges), self._outcome(one_players, one_challenges))
+        self.assertEqual([scoring.real_points(p) for p in batch_players], [1, -1, 7])
+        self.assertEqual(ChallengeExpiry(datetime.now().date()).run()['refused'], 0)
+
+    def test_management_task(self):
+        from StringIO import StringIO
+
+        players, challenges = self._scenario(0)
+        output = StringIO()
+        self.assertEqual(ChallengeGame.management_task(stdout=output), 3)
+        self.assertEqual([Challenge.objects.get(pk=c.pk).status for c in challenges], ['R', 'P', 'D'])
+        self.assertIn('1 refused, 1 won, 1 draw', output.getvalue())
+
+
+class TestLaunchTransaction(TransactionTestCase):
+    """ Commits are real here, unlike in WousoTest. The database is not flushed,
+    so the data created by the migrations stays; what the test writes is deleted.
+    """
+    def _fixture_setup(self):
+        pass
+
+    def setUp(self):
+        cache.clear()
+        self.existing = [(model, list(model.objects.values_list('id', flat=True))) for model in (Formula, Coin, Category)]
+        scoring.setup_scoring()
+        self.warranty, Challenge.WARRANTY = Challenge.WARRANTY, True
+        category = Category.add('challenge')
+        self.questions = [Question.objects.create(text='_launch %s' % i, category=category, active=True).id
+                          for i in range(Challenge.LIMIT)]
+        self.chall_user, self.chall_user2 = [User.objects.create(username='_launch%d' % i).get_profile().get_extension(
+            ChallengeUser) for i in range(2)]
+
+    def tearDown(self):
+        User.objects.filter(username__startswith='_launch').delete()
+        Question.objects.filter(id__in=self.questions).delete()
+        for model, ids in self.existing:
+            model.objects.exclude(id__in=ids).delete()
+        Challenge.WARRANTY = self.warranty
+        cache.clear()
+
+    def test_launch_is_atomic(self):
+        # fails after the challenge, the warranty and last_launched are written
+        with patch.object(QuestionSampler, 'mark_seen', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, self.chall_user.launch_against, self.chall_user2)
+
+        self.assertFalse(Challenge.objects.exists())
+        self.assertFalse(CoinBalance.objects.filter(user=self.chall_user.user).exclude(amount=0).exists())
+        self.assertEqual(scoring.real_points(self.chall_user), 0)
+        self.assertTrue(ChallengeUser.objects.get(pk=self.chall_user.pk).last_launched is None)
+
+        chall = self.chall_user.launch_against(self.chall_user2)
+        self.assertTrue(chall.is_launched())
+
+
 # TODO: add page tests (views) for challenge run
 
 class TestChallengeViews(WousoTest):
@@ -547,6 +813,9 @@ class TestChallengeViews(WousoTest):
                                                  category=self.category, active=True)
         question5 = Question.objects.create(text='question5', answer_type='F',
                                                  category=self.category, active=True)
+        # no pending challenge between the two players
+        self.ch.status = 'P'
+        self.ch.save()
         self.c.login(username='testuser2', password='test')
         response = self.c.get(reverse('challenge_random'), follow=True)
         challenge = Challenge.objects.filter(user_from__user__user__username='testuser2')
@@ -593,10 +862,10 @@ class TestChallengeViews(WousoTest):
         self.assertContains(response, '50')
 
     def test_challenge_stats_view_mine(self):
-        self.ch.status = 'A'
-        self.ch.save()
         self.ch.user_from.seconds_took = 100
         self.ch.user_from.save()
+        # statistics count ended challenges
+        self.ch.set_expired()
         response = self.c.get(reverse('challenge_stats'))
         self.assertContains(response, 'Challenges - testuser1')
         self.assertContains(response, 'Challenges played:  1')
@@ -608,10 +877,9 @@ class TestChallengeViews(WousoTest):
         admin = User.objects.create_superuser('admin', 'admin@myemail.com', 'admin')
         self.c.login(username='admin', password='admin')
 
-        self.ch.status = 'A'
-        self.ch.save()
         self.ch.user_to.seconds_took = 100
         self.ch.user_to.save()
+        self.ch.set_expired()
         response = self.c.get(reverse('challenge_stats', args=[self.ch_player2.id]))
         self.assertContains(response, 'Challenges - testuser2')
         self.assertContains(response, 'Challenges played:  1')
@@ -16,21 +16,7 @@ from wouso.games.challenge.models import ChallengeException
 from models import ChallengeUser, ChallengeGame, Challenge, Participant
 from forms import ChallengeForm
 import os
-import fcntl
 import logging
-from django.db import transaction
-
-@transaction.commit_manually
-def flush_transaction():
-    """ Flush the current transaction so we don't read stale data
-
-    Use in long running processes to make sure fresh data is read from
-    the database.  This is a problem with MySQL and the default
-    transaction mode.  You can fix it by setting
-    "transaction-isolation = READ-COMMITTED" in my.cnf or by calling
-    this function at the appropriate moment
-    """
-    transaction.commit()
 
 class PlayerViewMixin():
     def get_player(self):
@@ -111,102 +97,54 @@ class ChallengeView(View):
 
 challenge = login_required(ChallengeView.as_view())
 
-class FileLock:
-    def __init__(self, filename):
-        handle = open(filename, 'w')
-        self.handle = handle
-        fcntl.flock(handle, fcntl.LOCK_EX)
-
-    def unlock(self):
-        fcntl.flock(self.handle, fcntl.LOCK_UN)
-        self.handle.close()
-        self.handle = None
-
-    def __del__(self):
-        if self.handle != None:
-            self.unlock()
-
-class NamedFileLock:
-    def __init__(self, filename):
-        self.filename = filename
-
-    def lock(self):
-        return FileLock(self.filename)
-
-challengeLock = NamedFileLock("/tmp/wouso_challenge_launch_lock")
-
-#import logging
-#logger = logging.
-
-# http://stackoverflow.com/questions/3346124/how-do-i-force-django-to-ignore-any-caches-and-reload-data
-
 @login_required
 def launch(request, to_id):
-    lock = challengeLock.lock()
-    logging.info("Locked.")
-
-    flush_transaction()
     user_to = get_object_or_404(Player, pk=to_id)
     user_to = user_to.get_extension(ChallengeUser)
     user_from = request.user.get_profile().get_extension(ChallengeUser)
 
-
     if ChallengeGame.disabled():
         messages.error(request, _('Challenges have been disabled.'))
-        logging.info("Ready to unlock (disabled).")
-        lock.unlock()
         return redirect('challenge_index_view')
 
     if (not user_to.is_eligible()) or (not user_from.is_eligible()):
         messages.error(request, _('Sorry, challenge failed.'))
-        logging.info("Ready to unlock (is eligible).")
-        lock.unlock()
         return redirect('challenge_index_view')
 
     if not user_from.can_launch():
         messages.error(request, _('You cannot launch another challenge today.'))
-        logging.info("Ready to unlock (cannot launch today).")
-        lock.unlock()
         return redirect('challenge_index_view')
 
     if not user_from.in_same_division(user_to):
         messages.error(request, _('You are not in the same division'))
-        logging.info("Ready to unlock (not in same divission).")
-        lock.unlock()
         return redirect('challenge_index_view')
 
     if not user_from.has_enough_points():
         messages.error(request, _('You need at least 30 points to launch a challenge'))
-        logging.info("Ready to unlock (not enough points).")
-        lock.unlock()
         return redirect('challenge_index_view')
 
-    if user_from.can_challenge(user_to):
-        try:
-            chall = Challenge.create(user_from=user_from, user_to=user_to)
-            logging.info("Created challenge: %s" %(chall))
-        except ChallengeException as e:
-            # Some error occurred during question fetch. Clean up, and display error
-            messages.error(request, e.message)
-            lock.unlock()
-            return redirect('challenge_index_view')
-        #Checking if user_to is stored in session
-        PREFIX = "_user:"
-        action_msg = "multiple-login"
-        if (PREFIX + user_to.user.username) in request.session:
-            from wouso.core.signals import addActivity
-            addActivity.send(sender=None, user_to=user_to, user_from=user_from, action=action_msg,
-                             game=None, public=False)
-        messages.success(request, _('Successfully challenged'))
-        logging.info("Ready to unlock (save).")
-        lock.unlock()
-        return redirect('challenge_index_view')
-    else:
+    if not user_from.can_challenge(user_to):
         messages.error(request, _('This user cannot be challenged.'))
-        logging.info("Ready to unlock (no user challenge).")
-        lock.unlock()
         return redirect('challenge_index_view')
 
+    try:
+        chall = user_from.launch_against(user_to)
+        logging.info("Created challenge: %s" % chall)
+    except ChallengeException as e:
+        # A concurrent launch won, or some error occurred during question fetch
+        messages.error(request, e.message)
+        return redirect('challenge_index_view')
+
+    #Checking if user_to is stored in session
+    PREFIX = "_user:"
+    action_msg = "multiple-login"
+    if (PREFIX + user_to.user.username) in request.session:
+        from wouso.core.signals import addActivity
+        addActivity.send(sender=None, user_to=user_to, user_from=user_from, action=action_msg,
+                         game=None, public=False)
+    messages.success(request, _('Successfully challenged'))
+    return redirect('challenge_index_view')
+
 @login_required
 def accept(request, id):
     if ChallengeGame.disabled():
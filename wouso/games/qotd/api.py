@@ -2,7 +2,7 @@ from django.db import models
 from django.http import Http404
 from piston.handler import BaseHandler
 from models import QotdGame, QotdUser
-from wouso.core.qpool.models import Answer
+from wouso.core.qpool.grading import Grader
 
 
 class QotdHandler(BaseHandler):
@@ -34,9 +34,11 @@ class QotdHandler(BaseHandler):
             return {'success': False, 'error': 'Answer not provided'}
         try:
             answer_id = int(attrs['answer'])
-            answer = Answer.objects.get(pk=answer_id)
-        except ValueError, Answer.DoesNotExist:
+        except ValueError:
             return {'success': False, 'error': 'Invalid answer'}
-        else:
-            qotduser.set_answered(answer.id, answer.correct)
-            return {'success': True, 'correct': answer.correct, 'has_answered': qotduser.has_answered}
\ No newline at end of file
+        grader = Grader({question.id: [answer_id]})
+        if not grader.is_answer(question.id, answer_id):
+            return {'success': False, 'error': 'Invalid answer'}
+        correct = grader.is_correct(question.id, answer_id)
+        qotduser.set_answered(answer_id, correct)
+        return {'success': True, 'correct': correct, 'has_answered': qotduser.has_answered}
\ No newline at end of file
@@ -9,6 +9,7 @@ from wouso.core.game.models import Game
 from wouso.core import scoring, signals
 from wouso.core.qpool import register_category
 from wouso.core.qpool.models import Schedule, Answer, Question
+from wouso.core.qpool.grading import Grader
 
 # Qotd uses questions from qpool
 
@@ -104,12 +105,7 @@ class QotdGame(Game):
 
     @staticmethod
     def answered(user, question, choice):
-        correct = False
-        for i, a in enumerate(question.answers):
-            if a.id == choice:
-                if a.correct:
-                    correct = True
-                break
+        correct = Grader({question.id: [choice]}).is_correct(question.id, choice)
 
         user.set_answered(choice, correct)  # answer id
 
@@ -8,7 +8,7 @@ from models import *
 from wouso.core.tests import WousoTest
 from wouso.core.user.models import Player
 from wouso.core import scoring
-from wouso.core.qpool.models import Question, Schedule, Tag, Category
+from wouso.core.qpool.models import Question, Answer, Schedule, Tag, Category
 
 class QotdTestCase(WousoTest):
     def setUp(self):
@@ -20,16 +20,10 @@ class QotdTestCase(WousoTest):
         scoring.setup_scoring()
 
     def _get_foo_question(self, correct=2):
-        """ Return a Question object selected for Today """
-        class Question: pass
-        class Answer: pass
-        q = Question()
-        q.text = 'How many'
-        q.answers = []
+        """ Return a Question object with four answers, the correct one at index correct """
+        q = Question.objects.create(text='How many', active=True)
         for i in range(4):
-            a = Answer()
-            a.id, a.text, a.correct = i, str(i), True if i == correct else False
-            q.answers.append(a)
+            Answer.objects.create(question=q, text=str(i), correct=True if i == correct else False)
         return q
 
     def testUserCreate(self):
@@ -48,14 +42,14 @@ class QotdTestCase(WousoTest):
 
         h1 = scoring.history_for(self.user, QotdGame)
 
-        QotdGame.answered(self.qotd_user, q, correct - 1)
+        QotdGame.answered(self.qotd_user, q, q.answers[correct - 1].id)
         # Check if history didn't change
         self.assertEqual(len(h1), len(scoring.history_for(self.qotd_user, QotdGame)))
 
         # Answer correctly
         self.qotd_user.reset_answered()
 
-        QotdGame.answered(self.qotd_user, q, correct)
+        QotdGame.answered(self.qotd_user, q, q.answers[correct].id)
         # History changed
         h2 = scoring.history_for(self.qotd_user, QotdGame)
         self.assertGreater(len(h2), len(h1))
@@ -1,4 +1,4 @@
-import pickle
+import json
 from random import shuffle
 from datetime import datetime
 
@@ -75,7 +75,7 @@ class AddQuizForm(forms.ModelForm):
         self.fields['time_limit'].label = "Time limit (seconds)"
         self.fields['another_chance'].label = "Retake quiz after (days)"
 
-        tags = pickle.loads(self.instance.tags) if self.instance.tags else {}
+        tags = json.loads(self.instance.tags) if self.instance.tags else {}
 
         for t in Tag.objects.filter(category__name='quiz'):
             initial = tags[t.name] if t.name in tags else 0
@@ -95,7 +95,7 @@ class AddQuizForm(forms.ModelForm):
                 tags[k] = v
 
         self.instance.save()
-        self.instance.tags = pickle.dumps(tags)
+        self.instance.tags = json.dumps(tags)
 
         self.instance.save()
 
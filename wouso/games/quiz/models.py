@@ -1,5 +1,5 @@
+import json
 import os
-import pickle
 
 from datetime import datetime
 from random import shuffle
@@ -10,11 +10,13 @@ from django.utils.translation import ugettext as _
 
 from wouso.core import scoring
 from wouso.core.signals import add_activity
+from wouso.core.ui import invalidate_blocks
 from wouso.core.user.models import Player
 from wouso.core.game.models import Game
-from wouso.core.qpool import register_category,\
-get_questions_with_tag_and_category
+from wouso.core.qpool import register_category
+from wouso.core.qpool.sampler import QuestionSampler
 from wouso.core.qpool.models import Question, Tag
+from wouso.core.qpool.grading import Grader
 
 
 class QuizCategory(models.Model):
@@ -116,16 +118,9 @@ class Quiz(models.Model):
         if len(responses) == 0:
             return 0, 0
 
-        correct_count = 0.0
+        correct_count = float(Grader(responses).correct_count(responses))
         total_count = len(responses)
 
-        for question_id, checked_answer_id in responses.iteritems():
-            question = Question.objects.get(id=question_id)
-            correct_answer_id = [ans.id \
-            for ans in question.answers if ans.correct]
-            if checked_answer_id == correct_answer_id:
-                correct_count += 1
-
         points = int((correct_count / total_count) * int(self.points_reward))
         gold = int((correct_count / total_count) * int(self.gold_reward))
         return points, gold
@@ -226,15 +221,10 @@ class UserToQuiz(models.Model):
         if self.questions.count() != 0:
             return
 
-        t = pickle.loads(self.quiz.tags)
+        t = json.loads(self.quiz.tags)
         questions = []
         for k in t:
-            q = get_questions_with_tag_and_category(k, 'quiz')
-            # Cannot shuffle a queryset, create list from it
-            q = list(q)
-            shuffle(q)
-            for i in q[:t[k]]:
-                questions.append(i)
+            questions.extend(QuestionSampler.sample(t[k], 'quiz', k))
 
         shuffle(questions)
         self.questions = questions
@@ -272,7 +262,7 @@ class UserToQuiz(models.Model):
         # player will not be bonused in case of new highscore
         self.state = 'P'
         self._give_bonus(points, gold)
-        a = QuizAttempt.objects.create(results=str(results),
+        a = QuizAttempt.objects.create(results=json.dumps(results),
                                        points=points,
                                        gold=gold)
         self.attempts.add(a)
@@ -314,3 +304,10 @@ class QuizAttempt(models.Model):
     results = models.TextField(blank=True, null=True)
     points = models.IntegerField(default=-1)
     gold = models.IntegerField(default=0)
+
+
+def quiz_changed(sender, instance, **kwargs):
+    invalidate_blocks('quiz')
+
+models.signals.post_save.connect(quiz_changed, Quiz)
+models.signals.post_delete.connect(quiz_changed, Quiz)
@@ -10,7 +10,7 @@ from django.views.generic import ListView
 
 from models import Quiz, QuizUser, QuizGame, UserToQuiz, QuizCategory
 from forms import QuizForm
-from wouso.core.ui import register_sidebar_block
+from wouso.core.ui import register_sidebar_block, BlockCache
 
 
 class QuizIndexView(ListView):
@@ -120,4 +120,4 @@ def sidebar_widget(context):
                             {'number_of_active_quizzes': number_of_active_quizzes})
 
 
-register_sidebar_block('quiz', sidebar_widget)
+register_sidebar_block('quiz', sidebar_widget, BlockCache(keys=('quiz',)))
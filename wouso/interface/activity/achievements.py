@@ -9,8 +9,8 @@ from wouso.core.user.models import Player
 from wouso.core.scoring.models import History
 from wouso.interface.apps.messaging.models import Message
 from wouso.games.challenge.models import Challenge
-from wouso.core.magic.models import PlayerSpellDue, SpellHistory, Spell
-from models import Activity
+from wouso.core.magic.models import PlayerArtifactAmount, PlayerSpellDue, SpellHistory, Spell
+from models import Activity, ActivityTask, AchievementProgress
 from wouso.core.signals import addActivity, messageSignal
 
 
@@ -61,17 +61,23 @@ def login_between(time, first, second):
 
 
 def login_at_start(player, start_day, start_month):
-    # Get player's first login
-    first_seen = Activity.objects.filter(action__contains='login', user_to=player).order_by('timestamp')[:1]
-    month = first_seen[0].timestamp.month
-    day = first_seen[0].timestamp.day
-    if day == start_day and month == start_month:
+    # Get player's first login, kept by the progress as old activity may be archived
+    first_login = AchievementProgress.get(player).first_login
+    if first_login is None:
+        return False
+    if first_login.day == start_day and first_login.month == start_month:
         return True
 
     return False
 
 
+# hour ranges counted by the achievement progress
+SEEN_COUNTERS = {(3, 5): 'seen_night', (6, 8): 'seen_morning'}
+
+
 def login_between_count(player, first, second):
+    if (first, second) in SEEN_COUNTERS:
+        return getattr(AchievementProgress.get(player), SEEN_COUNTERS[(first, second)])
     activities = Activity.objects.filter(action__contains='seen', user_to=player)
     activities = filter(lambda x: first <= x.timestamp.hour < second, activities)
     return len(activities)
@@ -105,7 +111,8 @@ def challenge_count(player, days=None):
      All challenges if days == None
     """
     if not days:
-        return Activity.get_player_activity(player).filter(action__contains='chall').count()
+        # all time, from the progress: old activity may be archived
+        return AchievementProgress.get(player).challenge_count()
     start = datetime.now() - timedelta(days=days)
     return Activity.get_player_activity(player).filter(
         action__contains='chall', timestamp__gte=start).count()
@@ -116,10 +123,8 @@ def first_seen(player):
     Return the number of days passed between the current time and the first time
     the player logged in
     """
-    first_seen = Activity.objects.filter(action='seen', user_to=player).order_by('timestamp')[:1]
-    if first_seen.count() > 0:
-        return (datetime.now() - first_seen[0].timestamp).days
-    return -1  # user has not logged in ever
+    # -1 if the user has not logged in ever
+    return AchievementProgress.get(player).days_since_first_seen()
 
 
 def consecutive_chall_won(player):
@@ -241,55 +246,57 @@ def gold_amount(player):
     return coins['gold']
 
 
-def used_all_spells(player, mass):
+def used_all_spells(player, mass, used=None):
     """
      Return True if player used all non-mass spells if mass is False,
      or True if player used all mass spells if mass is True.
+     used is the set of spell ids used by the player, if already known.
     """
-    all_spells = Spell.objects.filter(mass=mass)
-    magic_activity = SpellHistory.objects.filter(user_from=player, type='u')
-    used_spells = [m.spell for m in magic_activity if m.spell.mass == mass]
-
-    for s in all_spells:
-        if not s in used_spells:
-            return False
-    return True
+    if used is None:
+        used = set(SpellHistory.objects.filter(user_from=player, type='u').values_list('spell', flat=True))
+    all_spells = Spell.objects.filter(mass=mass).values_list('id', flat=True)
+    return set(all_spells) <= used
 
 
 class Achievements(App):
     @classmethod
     def earn_achievement(cls, player, modifier):
-        result = player.magic.give_modifier(modifier)
-        if result is not None:
+        artifact = God.get_artifact_for_modifier(modifier, player)
+        if artifact is None:
+            logging.debug('%s would have earned %s, but there was no artifact' % (player, modifier))
+            return
+        # Only the first grant is announced, handlers may run again for the same activity
+        result, new = PlayerArtifactAmount.objects.get_or_create(player=player, artifact=artifact)
+        if new:
             message = ugettext_noop('earned {artifact}')
             action_msg = 'earned-ach'
             addActivity.send(sender=None, user_from=player, game=None, message=message,
                              arguments=dict(artifact=result.artifact), action=action_msg
             )
             Message.send(sender=None, receiver=player, subject="Achievement", text="You have just earned " + modifier)
-        else:
-            logging.debug('%s would have earned %s, but there was no artifact' % (player, modifier))
 
     @classmethod
     def activity_handler(cls, sender, **kwargs):
         action = kwargs.get('action', None)
         player = kwargs.get('user_from', None)
+        progress = None
 
         if player:
             player = player.get_extension(Player)
+            progress = AchievementProgress.get(player)
 
         if not action:
             return
 
         if 'qotd' in action:
             # Check 10 qotd in a row
-            if consecutive_qotd_correct(player) >= 10:
+            if progress.qotd_streak >= 10:
                 if not player.magic.has_modifier('ach-qotd-10'):
                     cls.earn_achievement(player, 'ach-qotd-10')
 
         if 'chall' in action:
             # Check if number of challenge games is >= 100
-            games_played = challenge_count(player)
+            games_played = progress.challenge_count()
             if games_played >= 100:
                 if not player.magic.has_modifier('ach-chall-100'):
                     cls.earn_achievement(player, 'ach-chall-100')
@@ -297,14 +304,14 @@ class Achievements(App):
             # Check if the number of refused challenges in the past week is 0
             # also check for minimum number of challenges played = 5
             if not player.magic.has_modifier('ach-this-is-sparta'):
-                if refused_challenges(player) == 0 and \
-                                challenge_count(player, days=7) >= 5 and \
-                                first_seen(player) >= 7:
+                if progress.refused_challenges() == 0 and \
+                                progress.challenge_count(days=7) >= 5 and \
+                                progress.days_since_first_seen() >= 7:
                     cls.earn_achievement(player, 'ach-this-is-sparta')
 
             # Check if player played 10 challenges in a day"
             if not player.magic.has_modifier('ach-chall-10-a-day'):
-                if challenges_played_today(player) >= 10:
+                if progress.challenges_played_today() >= 10:
                     cls.earn_achievement(player, 'ach-chall-10-a-day')
 
         if action == 'chall-won':
@@ -314,20 +321,13 @@ class Achievements(App):
                     cls.earn_achievement(player, 'ach-flawless-victory')
             # Check 10 won challenge games in a row
             if not player.magic.has_modifier('ach-chall-won-10'):
-                if consecutive_chall_won(player) >= 10:
+                if progress.chall_won_streak >= 10:
                     cls.earn_achievement(player, 'ach-chall-won-10')
 
-            # Check if player defeated 2 levels or more bigger opponent
+            # Check if player defeated 5 times an opponent 2 levels or more bigger
             if not player.magic.has_modifier('ach-chall-def-big'):
-                if (kwargs.get('user_to').level_no - player.level_no) >= 2:
-                    Activity.objects.create(timestamp=datetime.now(),
-                                            user_from=player, user_to=player,
-                                            action='defeat-better-player')
-                    victories = Activity.objects.filter(user_to=player,
-                                                        action='defeat-better-player')
-                    if victories.count() >= 5:
-                        cls.earn_achievement(player, 'ach-chall-def-big')
-                        victories.delete()
+                if progress.better_defeated >= 5:
+                    cls.earn_achievement(player, 'ach-chall-def-big')
 
             # Check if the player finished the challenge in less than 1 minute
             if not player.magic.has_modifier('ach-win-fast'):
@@ -343,18 +343,18 @@ class Achievements(App):
 
         if action in ("login", "seen"):
             # Check login between 2-4 am
-            if login_between_count(player, 3, 5) > 2:
+            if progress.seen_night > 2:
                 if not player.magic.has_modifier('ach-night-owl'):
                     cls.earn_achievement(player, 'ach-night-owl')
-            if login_between_count(player, 6, 8) > 2:
+            if progress.seen_morning > 2:
                 if not player.magic.has_modifier('ach-early-bird'):
                     cls.earn_achievement(player, 'ach-early-bird')
 
             if not player.magic.has_modifier('ach-god-mode-on'):
-                if check_for_god_mode(player, 5, 5):
+                if progress.god_mode(5, 5):
                     cls.earn_achievement(player, 'ach-god-mode-on')
             # Check previous 10 seens
-            if consecutive_days_seen(player, datetime.now()) >= 14:
+            if progress.days_seen() >= 14:
                 if not player.magic.has_modifier('ach-login-10'):
                     cls.earn_achievement(player, 'ach-login-10')
 
@@ -366,18 +366,18 @@ class Achievements(App):
 
             # Check if player used all non-mass spells
             if not player.magic.has_modifier('ach-use-all-spells'):
-                if used_all_spells(player, False):
+                if used_all_spells(player, False, progress.used_spells()):
                     cls.earn_achievement(player, 'ach-use-all-spells')
 
             # Check if player used all mass spells
             if not player.magic.has_modifier('ach-use-all-mass'):
-                if used_all_spells(player, True):
+                if used_all_spells(player, True, progress.used_spells()):
                     cls.earn_achievement(player, 'ach-use-all-mass')
 
         if 'buy' in action:
             # Check if player spent 500 gold on spells
             if not player.magic.has_modifier('ach-spent-gold'):
-                if spent_gold(player) >= 500:
+                if progress.gold_spent >= 500:
                     cls.earn_achievement(player, 'ach-spent-gold')
 
         if action == 'gold-won':
@@ -403,7 +403,8 @@ class Achievements(App):
                 # server start date: hour, day, month
                 # hour_offset = offset from start date when player will be rewarded
                 head_start_date = God.get_head_start_date()
-                if login_at_start(player, start_day=head_start_date.day, start_month=head_start_date.month):
+                first_login = progress.first_login
+                if first_login and (first_login.day, first_login.month) == (head_start_date.day, head_start_date.month):
                     cls.earn_achievement(player, 'ach-head-start')
 
 
@@ -434,7 +435,10 @@ class Achievements(App):
 
 
 def check_for_achievements(sender, **kwargs):
-    Achievements.activity_handler(sender, **kwargs)
+    ActivityTask.dispatch('achievements', sender, **kwargs)
+
+
+ActivityTask.register('achievements', Achievements.activity_handler)
 
 
 addActivity.connect(check_for_achievements)
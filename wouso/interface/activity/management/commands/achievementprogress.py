@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from wouso.core.user.models import Player
+from wouso.interface.activity.models import AchievementProgress
+
+
+class Command(BaseCommand):
+    args = '[--player ID ...]'
+    help = 'Rebuild the achievement progress of players from their activity history'
+    option_list = BaseCommand.option_list + (
+        make_option('--player',
+                    action='append',
+                    type='int',
+                    dest='players',
+                    default=[],
+                    help='Only rebuild the given player id (may be repeated).'
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        players = Player.objects.all()
+        if options['players']:
+            players = players.filter(id__in=options['players'])
+
+        count = 0
+        for player in players.iterator():
+            AchievementProgress.build(player)
+            count += 1
+        self.stdout.write('Rebuilt progress for %d players.\n' % count)
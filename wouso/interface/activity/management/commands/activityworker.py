@@ -0,0 +1,51 @@
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from django.db import connection
+from optparse import make_option
+from wouso.core.user.presence import Presence
+from wouso.interface.activity.models import ActivityTask
+
+
+class Command(BaseCommand):
+    args = '[--once] [--sleep SECONDS] [--batch SIZE]'
+    help = 'Run the achievement and security checks queued by activity signals, and write player presence'
+    option_list = BaseCommand.option_list + (
+        make_option('--once',
+                    action='store_true',
+                    dest='once',
+                    default=False,
+                    help='Exit when the queue is empty, instead of waiting for new tasks.'
+                    ),
+        make_option('--sleep',
+                    type='float',
+                    dest='sleep',
+                    default=2,
+                    help='Seconds to wait before polling an empty queue again.'
+                    ),
+        make_option('--batch',
+                    type='int',
+                    dest='batch',
+                    default=100,
+                    help='Number of tasks claimed in one pass.'
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        total = 0
+        flushed = datetime.now()
+        while True:
+            if datetime.now() - flushed >= Presence.flush_interval():
+                Presence.flush()
+                flushed = datetime.now()
+            done = ActivityTask.process(limit=options['batch'])
+            total += done
+            if done:
+                continue
+            if options['once']:
+                Presence.flush()
+                break
+            # don't keep a connection open while idle
+            connection.close()
+            time.sleep(options['sleep'])
+        self.stdout.write('Processed %d tasks.\n' % total)
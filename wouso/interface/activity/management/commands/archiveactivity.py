@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from wouso.interface.activity.retention import Archiver
+
+
+class Command(BaseCommand):
+    help = 'Move the activity older than its retention period (ACTIVITY_RETENTION) to gzipped JSON lines files'
+    option_list = BaseCommand.option_list + (
+        make_option('--dir', dest='directory', default=None,
+                    help='Archive directory, ACTIVITY_ARCHIVE_DIR by default'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Rows written and deleted in one transaction'),
+        make_option('--max-batches', type='int', dest='max_batches', default=None,
+                    help='Stop after this many batches'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only count the rows to archive'),
+    )
+
+    def handle(self, *args, **options):
+        archiver = Archiver(options['directory'], batch_size=options['batch_size'],
+                            max_batches=options['max_batches'])
+        if options['dry_run']:
+            for action, count in archiver.count():
+                self.stdout.write('%s: %d\n' % (action or '(other actions)', count))
+            return
+
+        archived = archiver.run()
+        for action, count in sorted(archived.items()):
+            self.stdout.write('%s: %d\n' % (action or '(other actions)', count))
+        if archived:
+            self.stdout.write('Archived %d rows to %s\n' % (sum(archived.values()), archiver.path))
+        else:
+            self.stdout.write('Nothing to archive\n')
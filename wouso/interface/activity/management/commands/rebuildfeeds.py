@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from wouso.interface.activity.models import ActivityFeed
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the wall, player, group and race activity timelines from the activity history'
+
+    def handle(self, *args, **options):
+        count = ActivityFeed.rebuild()
+        self.stdout.write('Rebuilt %d timeline entries.\n' % count)
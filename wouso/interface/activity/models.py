@@ -1,11 +1,15 @@
 import json
-from datetime import datetime
-from django.db import models
-from django.db.models import Q
+import logging
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q, F, Sum
 from django.utils.translation import ugettext as _
+from wouso.core.common import bulk_insert, chunks
 from wouso.core.decorators import cached_method
 from wouso.core.game.models import Game
-from wouso.core.user.models import Player
+from wouso.core.magic.models import SpellHistory
+from wouso.core.user.models import Player, PlayerGroup
 from wouso.interface import logger
 from wouso.core.signals import addActivity, addedActivity
 
@@ -102,6 +106,46 @@ class Activity(models.Model):
     def get_private_activity(cls, player):
         return cls.queryset().filter(user_from=player, public=False)
 
+    @classmethod
+    def build(cls, **kwargs):
+        """ Return a new, unsaved activity from the addActivity signal arguments """
+        a = cls()
+        a.user_from = kwargs['user_from']
+        a.user_to = kwargs.get('user_to', a.user_from)
+        a.message_string = kwargs.get('message', '')
+        a.action = kwargs.get('action', None)
+        args = kwargs.get('arguments', {})
+        for k in args.keys():
+            args[k] = unicode(args[k])
+        a.arguments = json.dumps(args)
+        a.game = kwargs['game']
+        a.public = kwargs.get('public', True)
+        return a
+
+    @classmethod
+    def add_many(cls, entries):
+        """ Record many activities, entries being dictionaries of addActivity signal arguments.
+        The rows are inserted one by one, in the caller's transaction, so each activity gets
+        its own id; the timelines and the achievement progress are then updated once for all
+        of them and the ActivityTask handlers get every entry, as they would from the signal.
+        Return the activities.
+        """
+        created = [cls.build(**entry) for entry in entries]
+        if not created:
+            return []
+        for activity in created:
+            # fan out and achievements are done below, for the whole batch
+            activity._batched = True
+            activity.save()
+
+        ActivityFeed.fan_out(created)
+        AchievementProgress.activities_added(created)
+        for activity in created:
+            addedActivity.send(sender=None, activity=activity)
+        for name in ActivityTask.handlers():
+            ActivityTask.dispatch_many(name, None, entries)
+        return created
+
     @classmethod
     def delete(cls, game, user_from, user_to, message, arguments):
         """ Note: must be called with the _same_ arguments as the original to work """
@@ -125,22 +169,473 @@ class Activity(models.Model):
     def __unicode__(self):
         return u"#%d" % (self.id)
 
+class FeedPage(object):
+    """ A window of a timeline, newest first. It has no page count: the next window
+    starts before next_cursor.
+    """
+    def __init__(self, object_list, has_next, cursor=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = cursor is not None
+
+    @property
+    def next_cursor(self):
+        return self.object_list[-1].id if self.has_next else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class ActivityFeed(models.Model):
+    """ Public activity ids per timeline, written when activities are added (fan out
+    on write), so timelines are read by keyset without joins, distinct or counts.
+
+    The timelines are the same as the Activity.get_*_activity querysets: the wall
+    (no game, sender in a playing race), all games, and the player, group and race
+    of both the sender and the receiver. Membership is taken when the activity is
+    added; the rebuildfeeds command rebuilds all timelines from Activity.
+    """
+    WALL, ALL, PLAYER, GROUP, RACE = 'w', 'a', 'p', 'g', 'r'
+    SCOPES = ((WALL, 'Wall'), (ALL, 'All'), (PLAYER, 'Player'), (GROUP, 'Group'), (RACE, 'Race'))
+
+    scope = models.CharField(max_length=1, choices=SCOPES)
+    target = models.IntegerField(default=0, help_text='Player, group or race id, 0 for the wall and all')
+    activity = models.ForeignKey(Activity, related_name='feeds')
+    timestamp = models.DateTimeField(help_text='Same as the activity timestamp')
+
+    @classmethod
+    def fan_out(cls, activities):
+        """ Add the public activities to their timelines, return the number of rows written """
+        activities = [a for a in activities if a.public]
+        players = set(a.user_from_id for a in activities) | set(a.user_to_id for a in activities)
+        players.discard(None)
+        races, groups = {}, {}
+        for ids in chunks(players):
+            for id, race, can_play in Player.objects.filter(id__in=ids).values_list('id', 'race', 'race__can_play'):
+                races[id] = (race, can_play)
+            for id, group in PlayerGroup.players.through.objects.filter(player__in=ids).values_list('player',
+                                                                                                  'playergroup'):
+                groups.setdefault(id, set()).add(group)
+
+        rows = []
+        for a in activities:
+            involved = set([a.user_from_id, a.user_to_id]) - set([None])
+            targets = []
+            can_play = races.get(a.user_from_id, (None, None))[1]
+            if can_play is None or can_play:
+                targets.append((cls.ALL, 0))
+                if a.game_id is None:
+                    targets.append((cls.WALL, 0))
+            targets.extend((cls.PLAYER, id) for id in involved)
+            targets.extend((cls.GROUP, g) for g in set(g for id in involved for g in groups.get(id, ())))
+            targets.extend((cls.RACE, r) for r in set(races[id][0] for id in involved if id in races) - set([None]))
+            rows.extend(cls(scope=scope, target=target, activity_id=a.id, timestamp=a.timestamp)
+                        for scope, target in targets)
+        return bulk_insert(cls, rows)
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """ Recreate all timelines from Activity, return the number of rows written """
+        count, last_id = 0, 0
+        with transaction.commit_on_success():
+            cls.objects.all().delete()
+            while True:
+                activities = list(Activity.objects.filter(id__gt=last_id, public=True).order_by('id')[:batch_size])
+                if not activities:
+                    break
+                count += cls.fan_out(activities)
+                last_id = activities[-1].id
+        return count
+
+    @classmethod
+    def page(cls, scope, target=0, before=None, limit=10):
+        """ Return a FeedPage of at most limit activities, older than the activity id before """
+        qs = cls.objects.filter(scope=scope, target=target)
+        try:
+            before = int(before) if before else None
+        except ValueError:
+            before = None
+        if before is not None:
+            timestamps = qs.filter(activity=before).values_list('timestamp', flat=True)[:1]
+            if timestamps:
+                qs = qs.filter(Q(timestamp__lt=timestamps[0]) | Q(timestamp=timestamps[0], activity__lt=before))
+            else:
+                # not in this timeline (anymore), start from the newest
+                before = None
+        ids = list(qs.order_by('-timestamp', '-activity').values_list('activity', flat=True)[:limit + 1])
+        activities = Activity.queryset().in_bulk(ids[:limit])
+        return FeedPage([activities[id] for id in ids[:limit] if id in activities], len(ids) > limit, before)
+
+
+class ActivityTask(models.Model):
+    """ A signal handler call, queued to be run by the activityworker command.
+
+    Tasks are deleted once their handler returns. A worker leases a task
+    before running it, so a task left by a crashed worker is retried after
+    the lease expires: handlers must tolerate being run more than once.
+    """
+    LEASE = timedelta(minutes=5)
+    MAX_ATTEMPTS = 5
+
+    handler = models.CharField(max_length=32)
+    payload = models.TextField()
+    created = models.DateTimeField(default=datetime.now)
+    locked_until = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.IntegerField(default=0)
+    failed = models.BooleanField(default=False)
+
+    _handlers = {}
+
+    @classmethod
+    def register(cls, name, handler):
+        cls._handlers[name] = handler
+
+    @classmethod
+    def is_async(cls):
+        return getattr(settings, 'ACTIVITY_QUEUE_ASYNC', False)
+
+    @classmethod
+    def dispatch(cls, name, sender, **kwargs):
+        """ Run the registered handler now, or queue it if the queue is enabled """
+        if not cls.is_async():
+            return cls._handlers[name](sender, **kwargs)
+        kwargs.pop('signal', None)
+        return cls.objects.create(handler=name, payload=json.dumps(_encode(kwargs)))
+
+    @classmethod
+    def handlers(cls):
+        return sorted(cls._handlers)
+
+    @classmethod
+    def dispatch_many(cls, name, sender, kwargs_list):
+        """ Run the registered handler for each of kwargs_list now, or queue them with a bulk insert """
+        if not cls.is_async():
+            for kwargs in kwargs_list:
+                cls._handlers[name](sender, **kwargs)
+            return
+        bulk_insert(cls, [cls(handler=name, payload=json.dumps(_encode(kwargs))) for kwargs in kwargs_list])
+
+    @classmethod
+    def pending(cls, now=None):
+        now = now or datetime.now()
+        return cls.objects.filter(failed=False).filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+
+    @classmethod
+    def process(cls, limit=100):
+        """ Run up to limit pending tasks, oldest first. Return the number of tasks run. """
+        done = 0
+        for task in cls.pending().order_by('id')[:limit]:
+            if task.claim() and task.run():
+                done += 1
+        return done
+
+    def claim(self):
+        """ Lease the task, unless another worker got it first """
+        now = datetime.now()
+        claimed = ActivityTask.pending(now).filter(pk=self.pk, attempts=self.attempts).update(
+            locked_until=now + self.LEASE, attempts=F('attempts') + 1)
+        if claimed:
+            self.attempts += 1
+        return bool(claimed)
+
+    def run(self):
+        try:
+            kwargs = _decode(json.loads(self.payload))
+        except models.ObjectDoesNotExist:
+            # an object involved in the activity is gone, nothing left to check
+            self.delete()
+            return True
+        try:
+            self._handlers[self.handler](None, **kwargs)
+        except Exception as e:
+            logging.exception(e)
+            if self.attempts >= self.MAX_ATTEMPTS:
+                ActivityTask.objects.filter(pk=self.pk).update(failed=True)
+            return False
+        self.delete()
+        return True
+
+    def __unicode__(self):
+        return u"%s #%d" % (self.handler, self.id)
+
+
+class AchievementProgress(models.Model):
+    """ Per player counters and streaks used by the achievement rules.
+
+    The state is built once from the player's Activity history, then every new
+    Activity (or spell bought or used) updates it in place, so achievement
+    checks don't depend on the length of the history.
+    """
+    # days of per day counters kept, enough for the 7 days rules
+    DAYS_KEPT = 10
+    # counters also checked over a rolling window, their times of day are kept too
+    TIMED = ('chall', 'refused')
+
+    player = models.OneToOneField(Player, primary_key=True, related_name='achievement_progress')
+    last_activity_id = models.IntegerField(default=0)
+
+    first_seen = models.DateTimeField(null=True, blank=True)
+    first_login = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    seen_streak = models.IntegerField(default=0, help_text='Consecutive days with a private seen activity')
+    seen_night = models.IntegerField(default=0, help_text='Seen between 3 and 5 am')
+    seen_morning = models.IntegerField(default=0, help_text='Seen between 6 and 8 am')
+
+    last_qotd = models.DateTimeField(null=True, blank=True)
+    last_qotd_wrong = models.BooleanField(default=False)
+    qotd_streak = models.IntegerField(default=0)
+
+    chall_count = models.IntegerField(default=0)
+    chall_won_streak = models.IntegerField(default=0)
+    better_defeated = models.IntegerField(default=0, help_text='Challenges won against players 2 levels above')
+
+    gold_spent = models.FloatField(default=0)
+    spells_used = models.TextField(default='[]', help_text='Ids of the spells used, JSON')
+    days = models.TextField(default='{}', help_text='Per day counters, JSON')
+
+    @classmethod
+    def get(cls, player):
+        """ Return the progress for player, building it from history the first time """
+        try:
+            return cls.objects.get(player=player)
+        except cls.DoesNotExist:
+            return cls.build(player)
+
+    @classmethod
+    def build(cls, player):
+        """ (Re)build the progress of a player from Activity and SpellHistory """
+        progress = cls(player=player)
+        activities = Activity.objects.filter(Q(user_from=player) | Q(user_to=player))
+        for activity in activities.select_related('user_from', 'user_to').order_by('timestamp', 'id').iterator():
+            progress.apply(activity)
+        spells = SpellHistory.objects.filter(user_from=player)
+        progress.gold_spent = spells.filter(type='b').aggregate(gold=Sum('spell__price'))['gold'] or 0
+        progress.spells_used = json.dumps(sorted(set(spells.filter(type='u').values_list('spell', flat=True))))
+        progress.save()
+        return progress
+
+    @classmethod
+    def activity_added(cls, activity):
+        """ Update the players involved in activity, if their progress is already built """
+        cls.activities_added([activity])
+
+    @classmethod
+    def activities_added(cls, activities):
+        """ Update the players involved in the activities, in the order of their ids """
+        activities = sorted(activities, key=lambda a: a.id)
+        players = set(a.user_from_id for a in activities) | set(a.user_to_id for a in activities)
+        players.discard(None)
+        for ids in chunks(players):
+            for progress in cls.objects.filter(player__in=ids):
+                progress._add(activities)
+
+    def _add(self, activities):
+        """ Apply the activities newer than last_activity_id. The row is only written if
+        last_activity_id is unchanged; otherwise somebody else updated it, so it is read
+        again and what is left is applied on top.
+        """
+        progress = self
+        while True:
+            last = progress.last_activity_id
+            new = [a for a in activities if progress.player_id in (a.user_from_id, a.user_to_id) and a.id > last]
+            if not new:
+                return
+            for activity in new:
+                progress.apply(activity)
+            fields = dict((f.attname, getattr(progress, f.attname)) for f in progress._meta.fields
+                          if not f.primary_key and f.name not in ('gold_spent', 'spells_used'))
+            if AchievementProgress.objects.filter(pk=progress.pk, last_activity_id=last).update(**fields):
+                return
+            try:
+                progress = AchievementProgress.objects.get(pk=progress.pk)
+            except AchievementProgress.DoesNotExist:
+                return
+
+    @classmethod
+    def spell_logged(cls, entry):
+        qs = cls.objects.filter(player=entry.user_from_id)
+        if entry.type == 'b':
+            qs.update(gold_spent=F('gold_spent') + entry.spell.price)
+        elif entry.type == 'u':
+            for spells_used in qs.values_list('spells_used', flat=True):
+                used = set(json.loads(spells_used))
+                if entry.spell_id in used:
+                    return
+                used.add(entry.spell_id)
+                if not qs.filter(spells_used=spells_used).update(spells_used=json.dumps(sorted(used))):
+                    # used another spell meanwhile
+                    cls.spell_logged(entry)
+
+    def apply(self, activity):
+        """ Account for a new activity, in O(1) """
+        action = activity.action or ''
+        timestamp = activity.timestamp
+        mine = activity.user_from_id == self.player_id
+        to_me = activity.user_to_id == self.player_id
+        self.last_activity_id = max(self.last_activity_id, activity.id)
+        days = json.loads(self.days)
+
+        def count(key, date=timestamp.date()):
+            day = days.setdefault(date.isoformat(), {})
+            day[key] = day.get(key, 0) + 1
+            if key in self.TIMED:
+                day.setdefault(key + '-times', []).append(timestamp.time().isoformat())
+
+        if action == 'seen' and mine and not activity.public:
+            date = timestamp.date()
+            if self.last_seen is None or date - self.last_seen.date() > timedelta(days=1):
+                self.seen_streak = 1
+            elif date - self.last_seen.date() == timedelta(days=1):
+                self.seen_streak += 1
+            if self.last_seen is None or timestamp > self.last_seen:
+                self.last_seen = timestamp
+        if to_me:
+            if action == 'seen' and (self.first_seen is None or timestamp < self.first_seen):
+                self.first_seen = timestamp
+            if 'login' in action and (self.first_login is None or timestamp < self.first_login):
+                self.first_login = timestamp
+            if 'seen' in action:
+                if 3 <= timestamp.hour < 5:
+                    self.seen_night += 1
+                elif 6 <= timestamp.hour < 8:
+                    self.seen_morning += 1
+
+        if 'qotd' in action:
+            if activity.public:
+                self.qotd_streak = self.qotd_streak + 1 if 'correct' in action else 0
+            if mine:
+                self.last_qotd = timestamp
+                self.last_qotd_wrong = action == 'qotd-wrong'
+                if action == 'qotd-correct':
+                    count('qotd-correct')
+
+        if 'chall' in action:
+            if activity.public:
+                self.chall_count += 1
+                self.chall_won_streak = self.chall_won_streak + 1 if 'won' in action and mine else 0
+                count('chall')
+                if 'refused' in action:
+                    if mine:
+                        count('refused')
+                else:
+                    count('played')
+            if action == 'chall-won':
+                if mine:
+                    count('won')
+                    if activity.user_to and activity.user_to.level_no - activity.user_from.level_no >= 2:
+                        self.better_defeated += 1
+                if to_me:
+                    count('lost')
+
+        first_kept = (timestamp - timedelta(days=self.DAYS_KEPT)).date().isoformat()
+        self.days = json.dumps(dict((d, c) for d, c in days.iteritems() if d >= first_kept))
+
+    def day_count(self, key, first, last=None):
+        """ Sum the key counter for days between first and last, inclusive """
+        first, last = first.isoformat(), (last or datetime.now().date()).isoformat()
+        return sum(c.get(key, 0) for d, c in json.loads(self.days).iteritems() if first <= d <= last)
+
+    def window_count(self, key, start):
+        """ Count the key events since start, at most DAYS_KEPT days ago; key must be TIMED """
+        first, since = start.date().isoformat(), start.time().isoformat()
+        total = 0
+        for d, c in json.loads(self.days).iteritems():
+            if d > first:
+                total += c.get(key, 0)
+            elif d == first:
+                total += len([t for t in c.get(key + '-times', []) if t >= since])
+        return total
+
+    def days_seen(self, today=None):
+        """ Consecutive days seen, counting today """
+        today = today or datetime.now().date()
+        if self.last_seen is None:
+            return 1
+        if self.last_seen.date() == today:
+            return self.seen_streak
+        if self.last_seen.date() == today - timedelta(days=1):
+            return self.seen_streak + 1
+        return 1
+
+    def challenge_count(self, days=None):
+        if not days:
+            return self.chall_count
+        return self.window_count('chall', datetime.now() - timedelta(days=days))
+
+    def refused_challenges(self):
+        return self.window_count('refused', datetime.now() - timedelta(days=7))
+
+    def challenges_played_today(self):
+        return self.day_count('played', datetime.now().date())
+
+    def days_since_first_seen(self):
+        if self.first_seen is None:
+            return -1
+        return (datetime.now() - self.first_seen).days
+
+    def god_mode(self, days, chall_min):
+        """ Won all challenges and answered all qotd, for days in a row ending
+        with the last qotd, with at least chall_min challenges
+        """
+        if self.last_qotd is None or self.last_qotd_wrong:
+            return False
+        last = self.last_qotd.date()
+        first = last - timedelta(days=days - 1)
+        return self.day_count('won', first, last) >= chall_min and \
+               self.day_count('lost', first, last) == 0 and \
+               self.day_count('qotd-correct', first, last) == days
+
+    def used_spells(self):
+        return set(json.loads(self.spells_used))
+
+    def __unicode__(self):
+        return u"%s" % self.player
+
+
+def _encode(value):
+    """ Make signal arguments JSON serializable; model instances are stored by reference """
+    if isinstance(value, models.Model):
+        return {'__model__': '%s.%s' % (value._meta.app_label, value._meta.module_name), 'pk': value.pk}
+    if isinstance(value, dict):
+        return dict((k, _encode(v)) for k, v in value.iteritems())
+    if value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return value
+    return unicode(value)
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if '__model__' in value:
+            model = models.get_model(*value['__model__'].split('.'))
+            return model.objects.get(pk=value['pk'])
+        return dict((str(k), _decode(v)) for k, v in value.iteritems())
+    return value
+
+
 def save_activity_handler(sender, **kwargs):
     """ Callback function for addActivity signal """
-    a = Activity()
-    a.user_from = kwargs['user_from']
-    a.user_to = kwargs.get('user_to', a.user_from)
-    a.message_string = kwargs.get('message', '')
-    a.action = kwargs.get('action', None)
-    args = kwargs.get('arguments', {})
-    for k in args.keys():
-        args[k] = unicode(args[k])
-    a.arguments = json.dumps(args)
-    a.game = kwargs['game']
-    a.public = kwargs.get('public', True)
+    a = Activity.build(**kwargs)
     a.save()
     # Notify others
     addedActivity.send(sender=None, activity=a)
 
 
 addActivity.connect(save_activity_handler)
+
+
+def activity_post_save(sender, instance, created, **kwargs):
+    if created and not getattr(instance, '_batched', False):
+        ActivityFeed.fan_out([instance])
+        AchievementProgress.activity_added(instance)
+
+
+def spellhistory_post_save(sender, instance, created, **kwargs):
+    if created:
+        AchievementProgress.spell_logged(instance)
+
+
+models.signals.post_save.connect(activity_post_save, Activity)
+models.signals.post_save.connect(spellhistory_post_save, SpellHistory)
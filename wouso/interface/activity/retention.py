@@ -0,0 +1,106 @@
+"""
+Retention of the Activity table.
+
+Activity older than its retention period, set per action in
+ACTIVITY_RETENTION (days, ACTIVITY_RETENTION_DEFAULT for the other actions,
+None keeping it forever), is moved to gzipped JSON lines files by the
+archiveactivity command. Rows are written then deleted in bounded batches,
+each in its own transaction, so a run can be stopped and started again.
+
+Long running counters don't need the archived rows: the achievement
+progress of the players involved is built before their activity goes,
+then it is updated incrementally, see AchievementProgress.
+"""
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from wouso.core.common import chunks
+from wouso.core.user.models import Player
+from wouso.interface.activity.models import Activity, AchievementProgress
+
+FIELDS = ('id', 'timestamp', 'user_from', 'user_to', 'message_string', 'arguments', 'game',
+          'public', 'action')
+
+
+def get_policies():
+    """ Return ({action: days}, default days) """
+    return (getattr(settings, 'ACTIVITY_RETENTION', {}),
+            getattr(settings, 'ACTIVITY_RETENTION_DEFAULT', None))
+
+
+def expired(now=None):
+    """ Return a list of (action, queryset of the expired activity), for the actions
+    having a retention period. The action is None for the default period.
+    """
+    now = now or datetime.now()
+    policies, default = get_policies()
+    ret = []
+    for action, days in sorted(policies.iteritems()):
+        if days is not None:
+            qs = Activity.objects.filter(action=action, timestamp__lt=now - timedelta(days=days))
+            ret.append((action, qs))
+    if default is not None:
+        qs = Activity.objects.filter(timestamp__lt=now - timedelta(days=default))
+        qs = qs.exclude(action__in=policies.keys())
+        ret.append((None, qs))
+    return ret
+
+
+def _row(values):
+    values['timestamp'] = values['timestamp'].isoformat()
+    return json.dumps(values)
+
+
+class Archiver(object):
+    def __init__(self, directory=None, batch_size=1000, max_batches=None, now=None):
+        self.directory = directory or getattr(settings, 'ACTIVITY_ARCHIVE_DIR', 'archive')
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.now = now or datetime.now()
+        name = 'activity-%s.jsonl.gz' % self.now.strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(self.directory, name)
+
+    def count(self):
+        """ Return a list of (action, number of rows to archive) """
+        return [(action, qs.count()) for action, qs in expired(self.now)]
+
+    def run(self):
+        """ Archive the expired activity, return a dictionary of action: rows archived """
+        archived = {}
+        batches = 0
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        archive = None
+        try:
+            for action, qs in expired(self.now):
+                while self.max_batches is None or batches < self.max_batches:
+                    rows = list(qs.order_by('id').values(*FIELDS)[:self.batch_size])
+                    if not rows:
+                        break
+                    if archive is None:
+                        archive = gzip.open(self.path, 'ab')
+                    self._archive_batch(rows, archive)
+                    archived[action] = archived.get(action, 0) + len(rows)
+                    batches += 1
+        finally:
+            if archive is not None:
+                archive.close()
+        return archived
+
+    def _archive_batch(self, rows, archive):
+        players = set(r['user_from'] for r in rows) | set(r['user_to'] for r in rows)
+        players.discard(None)
+        with transaction.commit_on_success():
+            # the progress is built from the whole history, so before any of it goes
+            for ids in chunks(players):
+                built = AchievementProgress.objects.filter(player__in=ids)
+                built = built.values_list('player', flat=True)
+                for player in Player.objects.filter(id__in=ids).exclude(id__in=list(built)):
+                    AchievementProgress.build(player)
+            archive.write(''.join('%s\n' % _row(r) for r in rows))
+            archive.flush()
+            for ids in chunks(r['id'] for r in rows):
+                Activity.objects.filter(id__in=ids).delete()
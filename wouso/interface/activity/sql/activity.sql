@@ -0,0 +1,2 @@
+CREATE INDEX activity_activity_action_user_from_timestamp ON activity_activity (action, user_from_id, timestamp);
+CREATE INDEX activity_activity_public_timestamp ON activity_activity (public, timestamp);
@@ -0,0 +1 @@
+CREATE INDEX activity_activityfeed_timeline ON activity_activityfeed (scope, target, timestamp, activity_id);
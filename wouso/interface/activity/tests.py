@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import connection
 from wouso.core.magic.models import Artifact, Spell, SpellHistory
 from wouso.core.magic.manager import MagicManager
 from wouso.core.tests import WousoTest
@@ -10,8 +12,8 @@ from wouso.interface.apps.messaging.models import Message, MessagingUser
 from achievements import consecutive_days_seen, consecutive_qotd_correct, consecutive_chall_won, challenge_count, \
                 refused_challenges, get_challenge_time, unique_users_pm, wrong_first_qotd, get_chall_score, \
                 challenges_played_today, check_for_god_mode, spell_count, spent_gold, gold_amount, \
-                Achievements
-from models import Activity
+                Achievements, first_seen
+from models import Activity, ActivityTask, AchievementProgress, ActivityFeed
 
 class AchievementTest(WousoTest):
     def test_login_with_multiple_seens(self):
@@ -474,6 +476,280 @@ class NotificationsTest(WousoTest):
         Achievements.earn_achievement(player, 'ach-notfication')
         self.assertEqual(len(Message.objects.all()), 1)
 
+    def test_ach_notification_once(self):
+        player = self._get_player()
+        Artifact.objects.create(group=None, name='ach-notfication')
+        Achievements.earn_achievement(player, 'ach-notfication')
+        Achievements.earn_achievement(player, 'ach-notfication')
+        self.assertEqual(len(Message.objects.all()), 1)
+        self.assertEqual(player.playerartifactamount_set.get().amount, 1)
+
+
+class AchievementProgressTest(WousoTest):
+    def test_built_from_history(self):
+        player1 = self._get_player()
+        player2 = self._get_player(2)
+        for i in range(1, 15):
+            timestamp = datetime.now() + timedelta(days=-i)
+            Activity.objects.create(timestamp=timestamp, user_from=player1, user_to=player1, action='seen', public=False)
+            Activity.objects.create(timestamp=timestamp, user_from=player1, user_to=player2, action='chall-won')
+        Activity.objects.create(timestamp=datetime.now(), user_from=player2, user_to=player1, action='chall-won')
+
+        progress = AchievementProgress.get(player1)
+        self.assertEqual(progress.days_seen(), consecutive_days_seen(player1, datetime.now()))
+        self.assertEqual(progress.challenge_count(), challenge_count(player1))
+        self.assertEqual(progress.challenge_count(days=7), challenge_count(player1, days=7))
+        self.assertEqual(progress.chall_won_streak, 0)
+        self.assertEqual(progress.days_since_first_seen(), 14)
+
+    def test_rolling_window(self):
+        """ The 7 days rules count the last 7*24 hours, not calendar days """
+        player1 = self._get_player()
+        player2 = self._get_player(2)
+        AchievementProgress.get(player1)
+        for hours in (-1, 1):
+            timestamp = datetime.now() - timedelta(days=7, hours=hours)
+            Activity.objects.create(timestamp=timestamp, user_from=player1, user_to=player2, action='chall-refused')
+
+        progress = AchievementProgress.objects.get(player=player1)
+        self.assertEqual(progress.refused_challenges(), 1)
+        self.assertEqual(progress.challenge_count(days=7), challenge_count(player1, days=7))
+        self.assertEqual(AchievementProgress.build(player1).refused_challenges(), 1)
+
+    def test_incremental(self):
+        player1 = self._get_player()
+        player2 = self._get_player(2)
+        progress = AchievementProgress.get(player1)
+        self.assertEqual(progress.challenge_count(), 0)
+
+        for i in range(3):
+            Activity.objects.create(user_from=player1, user_to=player2, action='chall-won')
+        Activity.objects.create(user_from=player1, user_to=player2, action='chall-refused')
+
+        progress = AchievementProgress.objects.get(player=player1)
+        self.assertEqual(progress.challenge_count(), 4)
+        self.assertEqual(progress.challenges_played_today(), 3)
+        self.assertEqual(progress.refused_challenges(), 1)
+        self.assertEqual(progress.chall_won_streak, 0)
+        self.assertFalse(AchievementProgress.objects.filter(player=player2).exists())
+        self.assertEqual(AchievementProgress.get(player2).challenge_count(), 4)
+
+    def test_check_cost(self):
+        """ Checking a new activity costs the same, whatever the history """
+        player = self._get_player()
+        AchievementProgress.get(player)
+
+        def queries():
+            start = len(connection.queries)
+            signals.addActivity.send(sender=None, user_from=player, user_to=player, action='chall-won', game=None)
+            return len(connection.queries) - start
+
+        connection.use_debug_cursor = True
+        try:
+            first = queries()
+            for i in range(50):
+                Activity.objects.create(user_from=player, user_to=player, action='chall-won')
+            self.assertEqual(queries(), first)
+        finally:
+            connection.use_debug_cursor = False
+
+    def test_spells(self):
+        player = self._get_player()
+        spell = Spell.objects.create(name="test", title="", description="", image=None, percents=100, type='s', price=20)
+        progress = AchievementProgress.get(player)
+        SpellHistory.objects.create(type='b', user_from=player, user_to=player, date=datetime.now(), spell=spell)
+        SpellHistory.objects.create(type='u', user_from=player, user_to=player, date=datetime.now(), spell=spell)
+
+        progress = AchievementProgress.objects.get(player=player)
+        self.assertEqual(progress.gold_spent, 20)
+        self.assertEqual(progress.used_spells(), set([spell.id]))
+        self.assertEqual(AchievementProgress.build(player).used_spells(), set([spell.id]))
+
+
+class ActivityQueueTest(WousoTest):
+    def setUp(self):
+        super(ActivityQueueTest, self).setUp()
+        settings.ACTIVITY_QUEUE_ASYNC = True
+
+    def tearDown(self):
+        settings.ACTIVITY_QUEUE_ASYNC = False
+        super(ActivityQueueTest, self).tearDown()
+
+    def _send_qotd_correct(self, player):
+        for i in range(10):
+            timestamp = datetime.now() + timedelta(days=-i)
+            Activity.objects.create(timestamp=timestamp, user_from=player, user_to=player, action='qotd-correct')
+        signals.addActivity.send(sender=None, user_from=player, user_to=player,
+                                 action='qotd-correct', game=QotdGame.get_instance(),
+                                 arguments=dict(qotd=player))
+
+    def test_queued(self):
+        Artifact.objects.create(group=None, name='ach-qotd-10')
+        player = self._get_player()
+        self._send_qotd_correct(player)
+
+        # activity is saved right away, checks are left to the worker
+        self.assertEqual(Activity.objects.filter(action='qotd-correct').count(), 11)
+        self.assertFalse(player.magic.has_modifier('ach-qotd-10'))
+        self.assertEqual(ActivityTask.objects.count(), 2)
+
+        ActivityTask.process()
+        self.assertTrue(player.magic.has_modifier('ach-qotd-10'))
+        # the earned-ach activity and the notification message queued their own checks
+        self.assertEqual(ActivityTask.objects.count(), 3)
+        ActivityTask.process()
+        self.assertFalse(ActivityTask.objects.exists())
+
+    def test_run_twice(self):
+        Artifact.objects.create(group=None, name='ach-qotd-10')
+        player = self._get_player()
+        self._send_qotd_correct(player)
+        task = ActivityTask.objects.get(handler='achievements')
+        self.assertTrue(task.claim())
+        self.assertFalse(ActivityTask.objects.get(pk=task.pk).claim())
+
+        # a worker died after granting, the task is run again once the lease expires
+        task.run()
+        ActivityTask.objects.create(handler=task.handler, payload=task.payload)
+        ActivityTask.process()
+        self.assertEqual(player.playerartifactamount_set.get(artifact__name='ach-qotd-10').amount, 1)
+        self.assertEqual(Message.objects.filter(receiver=player).count(), 1)
+
+    def test_missing_object(self):
+        player = self._get_player()
+        self._send_qotd_correct(player)
+        player.delete()
+        ActivityTask.process()
+        self.assertFalse(ActivityTask.objects.exists())
+
+
+class ActivityFeedTest(WousoTest):
+    def setUp(self):
+        super(ActivityFeedTest, self).setUp()
+        from wouso.core.user.models import PlayerGroup, Race
+
+        self.race = Race.objects.create(name='race', can_play=True)
+        self.other = Race.objects.create(name='others', can_play=False)
+        self.group = PlayerGroup.objects.create(name='group', parent=self.race)
+        self.p1, self.p2, self.p3 = self._get_player(1), self._get_player(2), self._get_player(3)
+        for player, race in ((self.p1, self.race), (self.p2, self.race), (self.p3, self.other)):
+            player.race = race
+            player.save()
+        self.group.players.add(self.p1)
+
+    def _ids(self, scope, target=0, limit=100):
+        return [a.id for a in ActivityFeed.page(scope, target, limit=limit)]
+
+    def _add(self, user_from, user_to, game=None, public=True):
+        signals.addActivity.send(sender=None, user_from=user_from, user_to=user_to, action='chall-won', game=game,
+                                 public=public)
+        return Activity.objects.order_by('-id')[0]
+
+    def test_timelines_match_querysets(self):
+        now = datetime.now()
+        self._add(self.p1, self.p2)
+        self._add(self.p2, self.p3, game=ChallengeGame.get_instance())
+        self._add(self.p3, self.p1)
+        self._add(self.p1, self.p1, public=False)
+        Activity.add_many([dict(user_from=self.p3, user_to=self.p2, action='chall-won', game=None)])
+        # same timestamp, ordered by id
+        Activity.objects.filter(id__in=Activity.objects.values_list('id', flat=True)[:2]).update(timestamp=now)
+        ActivityFeed.objects.filter(activity__timestamp=now).update(timestamp=now)
+
+        def ids(qs):
+            return [a.id for a in qs.order_by('-timestamp', '-id')]
+        self.assertEqual(self._ids(ActivityFeed.WALL), ids(Activity.get_global_activity()))
+        self.assertEqual(self._ids(ActivityFeed.ALL), ids(Activity.get_global_activity(wouso_only=False)))
+        for p in (self.p1, self.p2, self.p3):
+            self.assertEqual(self._ids(ActivityFeed.PLAYER, p.id), ids(Activity.get_player_activity(p)))
+        self.assertEqual(self._ids(ActivityFeed.GROUP, self.group.id), ids(Activity.get_group_activiy(self.group)))
+        for race in (self.race, self.other):
+            self.assertEqual(self._ids(ActivityFeed.RACE, race.id), ids(Activity.get_race_activity(race)))
+
+        count = ActivityFeed.objects.count()
+        self.assertEqual(ActivityFeed.rebuild(), count)
+
+    def test_keyset_pages(self):
+        for i in range(5):
+            self._add(self.p1, self.p2)
+        expected = self._ids(ActivityFeed.PLAYER, self.p1.id)
+        self.assertEqual(len(expected), 5)
+
+        seen, before = [], None
+        while True:
+            page = ActivityFeed.page(ActivityFeed.PLAYER, self.p1.id, before=before, limit=2)
+            self.assertEqual(page.has_previous, before is not None)
+            seen.extend(a.id for a in page)
+            if not page.has_next:
+                break
+            before = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(ActivityFeed.page(ActivityFeed.PLAYER, self.p1.id, before='junk', limit=2)), 2)
+
+        connection.use_debug_cursor = True
+        try:
+            start = len(connection.queries)
+            ActivityFeed.page(ActivityFeed.RACE, self.race.id, before=expected[1], limit=2)
+            self.assertFalse([q for q in connection.queries[start:] if 'COUNT' in q['sql'].upper()])
+        finally:
+            connection.use_debug_cursor = False
+
+
+class RetentionTest(WousoTest):
+    def setUp(self):
+        super(RetentionTest, self).setUp()
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.policies = (getattr(settings, 'ACTIVITY_RETENTION', {}),
+                         getattr(settings, 'ACTIVITY_RETENTION_DEFAULT', None))
+        settings.ACTIVITY_RETENTION, settings.ACTIVITY_RETENTION_DEFAULT = {'seen': 30}, None
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+        settings.ACTIVITY_RETENTION, settings.ACTIVITY_RETENTION_DEFAULT = self.policies
+        super(RetentionTest, self).tearDown()
+
+    def _add(self, player, action, days):
+        return Activity.objects.create(timestamp=datetime.now() - timedelta(days=days), user_from=player,
+                                       user_to=player, action=action, public=action != 'seen')
+
+    def _archived(self, archiver):
+        import gzip
+        import json
+        with gzip.open(archiver.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_archive(self):
+        from retention import Archiver
+
+        player = self._get_player()
+        old = [self._add(player, 'seen', 40 + i) for i in range(3)]
+        recent = self._add(player, 'seen', 5)
+        won = self._add(player, 'chall-won', 100)
+        other = self._add(player, None, 100)
+
+        now = datetime.now()
+        archiver = Archiver(self.directory, batch_size=2, max_batches=1, now=now)
+        self.assertEqual(archiver.count(), [('seen', 3)])
+        self.assertEqual(archiver.run(), {'seen': 2})
+        # runs started at the same second append to the same file
+        self.assertEqual(Archiver(self.directory, batch_size=2, now=now).run(), {'seen': 1})
+        self.assertEqual(sorted(Activity.objects.values_list('id', flat=True)), [recent.id, won.id, other.id])
+
+        rows = self._archived(archiver)
+        self.assertEqual([r['id'] for r in rows], [a.id for a in old])
+        self.assertEqual((rows[0]['user_from'], rows[0]['action'], rows[0]['public']), (player.id, 'seen', False))
+
+        # the progress was built before the history went
+        self.assertEqual(first_seen(player), 42)
+        self.assertEqual(challenge_count(player), 1)
+
+        settings.ACTIVITY_RETENTION_DEFAULT = 60
+        self.assertEqual(Archiver(self.directory).run(), {None: 2})
+        self.assertEqual(list(Activity.objects.values_list('id', flat=True)), [recent.id])
+        self.assertEqual(challenge_count(player), 1)
+
 
 class FlawlessVictoryTest(WousoTest):
     def setUp(self):
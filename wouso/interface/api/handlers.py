@@ -1,8 +1,12 @@
 from datetime import datetime, timedelta
+from functools import wraps
+from md5 import md5
 from django.shortcuts import get_object_or_404
 from django.template.defaultfilters import slugify
 from django.utils.html import strip_tags
+from django.utils.http import parse_etags, quote_etag
 from piston.handler import BaseHandler
+from piston.resource import Resource
 from piston.utils import rc
 
 from django.db.models.query_utils import Q
@@ -14,15 +18,16 @@ from wouso.core.scoring.models import Coin
 from wouso.core.user.templatetags.user import player_avatar
 from wouso.core.game import get_games
 from wouso.core.user.models import Player, Race, PlayerGroup
+from wouso.core.user.presence import Presence
 from wouso.core.magic.models import Spell, SpellHistory
 from wouso.core.god import God
 from wouso.core import scoring
 from wouso.interface import get_custom_theme
 from wouso.interface.apps import get_apps
-from wouso.interface.activity.models import Activity
+from wouso.interface.activity.models import ActivityFeed
 from wouso.interface.api.c2dm.models import register_device
 from wouso.interface.apps.messaging.models import Message, MessagingUser
-from wouso.interface.top.models import TopUser, GroupHistory
+from wouso.interface.top.models import TopUser, GroupHistory, NewHistory
 from wouso.interface.apps.lesson.models import LessonCategory, LessonTag
 
 from . import API_VERSION
@@ -61,8 +66,7 @@ class OnlineUsers(BaseHandler):
     allowed_methods = ('GET',)
 
     def read(self, request, type=None):
-        oldest = datetime.now() - timedelta(minutes = 10)
-        online_last10 = Player.objects.filter(last_seen__gte=oldest).order_by('-last_seen')
+        online_last10 = Presence.online_players()
 
         if type == 'list':
             return [u.nickname for u in online_last10]
@@ -426,20 +430,126 @@ class CastHandler(BaseHandler):
         return {'success': True}
 
 
+TOP_PAGE_SIZE = 100
+TOP_MAX_PAGE_SIZE = 500
+ACTIVITY_PAGE_SIZE = 100
+ACTIVITY_MAX_PAGE_SIZE = 500
+
+
+def get_page_args(request):
+    """ Read the keyset pagination arguments of a top: after_points, after_id and limit.
+    Return None if they are invalid.
+    """
+    try:
+        after_points = request.GET.get('after_points')
+        after_points = float(after_points) if after_points is not None else None
+        after_id = int(request.GET.get('after_id', 0))
+        limit = min(int(request.GET.get('limit', TOP_PAGE_SIZE)), TOP_MAX_PAGE_SIZE)
+    except ValueError:
+        return None
+    if limit <= 0:
+        return None
+    return after_points, after_id, limit
+
+
+def keyset_page(qs, page, points='points', id='id'):
+    """ Filter a queryset ordered by points, descending, then id, to the requested page """
+    after_points, after_id, limit = page
+    if after_points is not None:
+        qs = qs.filter(Q(**{'%s__lt' % points: after_points}) |
+                       Q(**{points: after_points, '%s__gt' % id: after_id}))
+    return qs.order_by('-%s' % points, id)[:limit]
+
+
+def keyset_page_list(items, page):
+    """ Same as keyset_page, for a list of dictionaries with points and id keys """
+    after_points, after_id, limit = page
+    items = sorted(items, key=lambda o: (-o['points'], o['id']))
+    if after_points is not None:
+        items = [o for o in items if (-o['points'], o['id']) > (-after_points, after_id)]
+    return items[:limit]
+
+
+def snapshot_etag(object_type):
+    """ Tops served from a snapshot only change when a new snapshot is recorded """
+    date = NewHistory.latest_date(object_type)
+    if date is None:
+        return None
+    return 'top-%s-%s' % (object_type, date.isoformat())
+
+
+def conditional(read):
+    """ Skip the read when If-None-Match holds the tag returned by the etag(request,
+    *args, **kwargs) class method of the handler; ConditionalResource then answers
+    304 Not Modified. Being a handler method, it only runs once the request is
+    authenticated.
+    """
+    @wraps(read)
+    def wrapper(self, request, *args, **kwargs):
+        etag = self.etag(request, *args, **kwargs)
+        if etag is not None:
+            request.etag = etag
+            etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            if etag in etags or '*' in etags:
+                request.not_modified = True
+                return []
+        return read(self, request, *args, **kwargs)
+    return wrapper
+
+
+class ConditionalResource(Resource):
+    """ Resource adding the ETag computed by a conditional read to the response """
+    def __call__(self, request, *args, **kwargs):
+        response = super(ConditionalResource, self).__call__(request, *args, **kwargs)
+        etag = getattr(request, 'etag', None)
+        if etag is None or response.status_code != 200:
+            return response
+        if getattr(request, 'not_modified', False):
+            response.status_code = 304
+            response.content = ''
+        response['ETag'] = quote_etag(etag)
+        return response
+
+
 class TopRaces(BaseHandler):
     allowed_methods = ('GET',)
 
+    @classmethod
+    def etag(cls, request):
+        return snapshot_etag('r')
+
+    @conditional
     def read(self, request):
-        races = [{'name': r.name, 'points': r.points, 'title': r.title or r.name, 'id': r.id} for r in Race.objects.all()]
-        races.sort(key=lambda o: o['points'], reverse=True)
+        page = get_page_args(request)
+        if page is None:
+            return rc.BAD_REQUEST
+
+        date = NewHistory.latest_date('r')
+        if date is None:
+            races = [{'name': r.name, 'points': r.total or 0, 'title': r.title or r.name, 'id': r.id}
+                     for r in Race.objects.annotate(total=Sum('player__points'))]
+            return keyset_page_list(races, page)
 
-        return races
+        rows = keyset_page(NewHistory.objects.filter(object_type='r', relative_to__isnull=True, date=date),
+                           page, id='object')
+        races = Race.objects.in_bulk([h.object for h in rows])
+        return [{'name': races[h.object].name, 'points': h.points, 'title': races[h.object].title or races[h.object].name,
+                 'id': h.object} for h in rows if h.object in races]
 
 
 class TopGroups(BaseHandler):
     allowed_methods = ('GET',)
 
+    @classmethod
+    def etag(cls, request, race_id=None):
+        return snapshot_etag('g')
+
+    @conditional
     def read(self, request, race_id=None):
+        page = get_page_args(request)
+        if page is None:
+            return rc.BAD_REQUEST
+
         if race_id:
             try:
                 race = Race.objects.get(pk=race_id)
@@ -449,32 +559,59 @@ class TopGroups(BaseHandler):
         else:
             qs = PlayerGroup.objects.all()
 
-        groups = [{'name': g.name, 'id': g.id, 'points': g.points, 'title': g.title or g.name} for g in qs]
-        groups.sort(key=lambda g: g['points'], reverse=True)
+        date = NewHistory.latest_date('g')
+        if date is None:
+            groups = keyset_page(qs, page)
+            return [{'name': g.name, 'id': g.id, 'points': g.points, 'title': g.title or g.name} for g in groups]
 
-        return groups
+        rows = NewHistory.objects.filter(object_type='g', relative_to_type='r', date=date)
+        if race_id:
+            rows = rows.filter(relative_to=race.id)
+        rows = keyset_page(rows, page, id='object')
+        groups = qs.in_bulk([h.object for h in rows])
+        return [{'name': groups[h.object].name, 'id': h.object, 'points': h.points,
+                 'title': groups[h.object].title or groups[h.object].name} for h in rows if h.object in groups]
 
 
 class TopPlayers(BaseHandler):
     allowed_methods = ('GET',)
 
-    def read(self, request, group_id=None, race_id=None):
+    @classmethod
+    def get_queryset(cls, group_id=None, race_id=None):
+        """ Return the players in the requested top, or None if the race or group does not exist """
         if race_id:
             try:
                 race = Race.objects.get(pk=race_id)
             except Race.DoesNotExist:
-                return rc.NOT_FOUND
-            qs = race.player_set.all()
+                return None
+            return race.player_set.all()
         elif group_id:
             try:
                 group = PlayerGroup.objects.get(pk=group_id)
             except PlayerGroup.DoesNotExist:
-                return rc.NOT_FOUND
-            qs = group.players.all()
-        else:
-            qs = Player.objects.all()
+                return None
+            return group.players.all()
+        return Player.objects.all()
+
+    @classmethod
+    def etag(cls, request, group_id=None, race_id=None):
+        """ Points are live, so the tag is a digest of the requested page """
+        page = get_page_args(request)
+        qs = cls.get_queryset(group_id=group_id, race_id=race_id)
+        if page is None or qs is None:
+            return None
+        return md5(repr(list(keyset_page(qs, page).values_list('id', 'points')))).hexdigest()
+
+    @conditional
+    def read(self, request, group_id=None, race_id=None):
+        page = get_page_args(request)
+        if page is None:
+            return rc.BAD_REQUEST
+        qs = self.get_queryset(group_id=group_id, race_id=race_id)
+        if qs is None:
+            return rc.NOT_FOUND
 
-        qs = qs.order_by('-points')
+        qs = keyset_page(qs.select_related('user'), page)
 
         return [dict(first_name=p.user.first_name, last_name=p.user.last_name, id=p.id, points=p.points,
                      level=p.level_no, avatar=player_avatar(p), display_name=unicode(p)) for p in qs]
@@ -502,8 +639,16 @@ class GroupHandler(BaseHandler):
                 'evolution': '%sevolution/%s' % (fp, q),
                 }
         elif type == 'activity':
-            qs = Activity.get_group_activiy(group)
-            return [dict(user_from=unicode(a.user_from), user_to=unicode(a.user_to), message=a.message, date=a.timestamp) for a in qs]
+            try:
+                limit = min(int(request.GET.get('limit', ACTIVITY_PAGE_SIZE)), ACTIVITY_MAX_PAGE_SIZE)
+            except ValueError:
+                return rc.BAD_REQUEST
+            if limit <= 0:
+                return rc.BAD_REQUEST
+            # older activity is paged by the before argument, the id of the last activity returned
+            page = ActivityFeed.page(ActivityFeed.GROUP, group.id, before=request.GET.get('before'), limit=limit)
+            return [dict(id=a.id, user_from=unicode(a.user_from), user_to=unicode(a.user_to), message=a.message,
+                         date=a.timestamp) for a in page]
         elif type == 'evolution':
             return gh.week_evolution()
 
@@ -97,4 +97,64 @@ class CastSpell(WousoTest):
         response = self.client.post('/api/player/{id}/cast/'.format(id=u2.id), {'spell': s.id})
 
         data = json.loads(response.content)
-        self.assertEqual(data['success'], True)
\ No newline at end of file
+        self.assertEqual(data['success'], True)
+
+class TopApi(WousoTest):
+    def setUp(self):
+        super(TopApi, self).setUp()
+        self.api_enabled, settings.API_ENABLED = settings.API_ENABLED, True
+        self.players = []
+        for i in range(5):
+            player = self._get_player(i)
+            player.points = 100 - i * 10
+            player.save()
+            self.players.append(player)
+        self.client.login(username=self.players[0].user.username, password='test')
+
+    def tearDown(self):
+        settings.API_ENABLED = self.api_enabled
+        super(TopApi, self).tearDown()
+
+    def test_players_pages(self):
+        response = self.client.get('/api/top/player/', {'limit': 2})
+        data = json.loads(response.content)
+        self.assertEqual([p['id'] for p in data], [p.id for p in self.players[:2]])
+
+        last = data[-1]
+        response = self.client.get('/api/top/player/', {'limit': 2, 'after_points': last['points'], 'after_id': last['id']})
+        data = json.loads(response.content)
+        self.assertEqual([p['id'] for p in data], [p.id for p in self.players[2:4]])
+
+        response = self.client.get('/api/top/player/', {'limit': 'all'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_players_etag(self):
+        response = self.client.get('/api/top/player/')
+        etag = response['ETag']
+        response = self.client.get('/api/top/player/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # the tag is only checked once the request is authenticated
+        self.client.logout()
+        response = self.client.get('/api/top/player/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 401)
+        self.client.login(username=self.players[0].user.username, password='test')
+
+        self.players[4].points = 1000
+        self.players[4].save()
+        response = self.client.get('/api/top/player/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)[0]['id'], self.players[4].id)
+
+    def test_races_from_snapshot(self):
+        from datetime import date
+        from wouso.core.user.models import Race
+        from wouso.interface.top.models import NewHistory
+        race = Race.objects.create(name='race', can_play=True)
+        NewHistory.objects.create(object=race.id, object_type='r', date=date.today(), position=1, points=42)
+
+        response = self.client.get('/api/top/race/')
+        data = json.loads(response.content)
+        self.assertEqual(data, [{'id': race.id, 'name': 'race', 'title': 'race', 'points': 42}])
+        response = self.client.get('/api/top/race/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
@@ -28,6 +28,10 @@ ad = {'authentication': [#simple,
 }
 
 notifications_resource = Resource(handler=NotificationsHandler, **ad)
+# tops answer conditional requests, with 304 Not Modified when the ETag matches
+top_races_resource = ConditionalResource(handler=TopRaces, **ad)
+top_groups_resource = ConditionalResource(handler=TopGroups, **ad)
+top_players_resource = ConditionalResource(handler=TopPlayers, **ad)
 
 urlpatterns += patterns('',
     #url(r'^$', Resource(handler=ApiRoot, **ad)),
@@ -56,12 +60,12 @@ urlpatterns += patterns('',
     url(r'^messages/archive/(?P<id>\d+)/$', Resource(handler=MessagesArchive, **ad)),
     url(r'^messages/unarchive/(?P<id>\d+)/$', Resource(handler=MessagesUnarchive, **ad)),
 
-    url(r'^top/race/$', Resource(handler=TopRaces, **ad)),
-    url(r'^top/group/$', Resource(handler=TopGroups, **ad)),
-    url(r'^top/race/(?P<race_id>\d+)/group/$', Resource(handler=TopGroups, **ad)),
-    url(r'^top/player/$', Resource(handler=TopPlayers, **ad)),
-    url(r'^top/race/(?P<race_id>\d+)/player/$', Resource(handler=TopPlayers, **ad)),
-    url(r'^top/group/(?P<group_id>\d+)/player/$', Resource(handler=TopPlayers, **ad)),
+    url(r'^top/race/$', top_races_resource),
+    url(r'^top/group/$', top_groups_resource),
+    url(r'^top/race/(?P<race_id>\d+)/group/$', top_groups_resource),
+    url(r'^top/player/$', top_players_resource),
+    url(r'^top/race/(?P<race_id>\d+)/player/$', top_players_resource),
+    url(r'^top/group/(?P<group_id>\d+)/player/$', top_players_resource),
 
     url(r'^group/$', Resource(handler=GroupsHandler, **ad)),
     url(r'^group/(?P<group_id>\d+)/$', Resource(handler=GroupHandler, **ad)),
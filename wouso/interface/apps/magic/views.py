@@ -15,6 +15,7 @@ from wouso.core.scoring.sm import InvalidFormula
 from wouso.core.user.models import Player
 from wouso.core.magic.models import Spell, SpellHistory, PlayerSpellDue, Artifact, Bazaar
 from wouso.core import scoring, signals
+from wouso.core.ui import invalidate_blocks
 from wouso.interface.activity.models import Activity
 
 class BazaarView(ListView):
@@ -46,7 +47,10 @@ class BazaarView(ListView):
         unseen_count = cast_spells.filter(seen=False).count()
 
         # TODO: think of smth better
+        targets = set(cast_spells.filter(seen=False).values_list('player', flat=True))
         cast_spells.update(seen=True)
+        for target in targets:
+            invalidate_blocks('spells', target)
 
         context.update({'spells': spells,
                         'rate': rate, 'rate_text': rate_text,
@@ -3,6 +3,7 @@ from django.db import models
 from django.utils.translation import ugettext as _
 from wouso.core import signals
 from wouso.core.common import App
+from wouso.core.ui import invalidate_blocks
 from wouso.core.user.models import Player
 
 CONSECUTIVE_LIMIT = 12 # in seconds
@@ -113,3 +114,10 @@ class MessageApp(App):
     def get_unread_for_user(cls, user):
         msg_user = user.get_profile().get_extension(MessagingUser)
         return msg_user.received.filter(read=False).count()
+
+
+def message_changed(sender, instance, **kwargs):
+    invalidate_blocks('messages', instance.receiver_id)
+
+models.signals.post_save.connect(message_changed, Message)
+models.signals.post_delete.connect(message_changed, Message)
@@ -6,7 +6,7 @@ from django.core.urlresolvers import reverse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.utils.translation import ugettext as _
-from wouso.core.ui import register_header_link
+from wouso.core.ui import register_header_link, BlockCache
 from wouso.core.user.models import Player
 from wouso.interface.apps.messaging.models import Message, MessagingUser, MessageApp
 from wouso.interface.apps.messaging.forms import ComposeForm
@@ -132,4 +132,4 @@ def header_link(context):
     return dict(link=url, count=count, text=_('Messages'))
 
 
-register_header_link('messaging', header_link)
+register_header_link('messaging', header_link, BlockCache(BlockCache.PLAYER, keys=('messages',)))
@@ -2,7 +2,7 @@ import logging
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.conf import settings
 from wouso.core.game import get_games
-from wouso.core.config.models import Setting
+from wouso.core.config.models import SettingsSnapshot
 from wouso.core.magic.models import Bazaar
 from wouso.interface.apps import get_apps
 from wouso.interface.apps.messaging.models import Message
@@ -17,8 +17,8 @@ def context(request):
     """
     settings_dict = {}
     settings_dict['basepath'] = FORCE_SCRIPT_NAME
-    for s in Setting.objects.all():
-        settings_dict['config_' + s.name.replace('-','_').lower()] = s.get_value()
+    for name, value in SettingsSnapshot.values().iteritems():
+        settings_dict['config_' + name.replace('-','_').lower()] = value
 
     for k, v in settings_dict.iteritems():
         if k.startswith('config_disable'):
@@ -6,6 +6,8 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
+from django.test.utils import override_settings
+from django.conf import settings
 from wouso.core.magic.models import Spell, SpellHistory, ArtifactGroup, Artifact
 from wouso.core.qpool.models import Category, Tag, Question, Answer
 from wouso.core.scoring.models import Formula
@@ -544,3 +546,63 @@ class CpanelViewsTest(WousoTest):
 
         self.assertContains(response, group)
         self.assertContains(response, player)
+
+
+class ProfilingTest(WousoTest):
+    VIEW = 'wouso.interface.cpanel.views.FormulasView'
+
+    def setUp(self):
+        super(ProfilingTest, self).setUp()
+        self.admin = self._get_superuser()
+
+    def test_views_profiled_and_budget_checked(self):
+        import logging
+        from django.db import connections, DEFAULT_DB_ALIAS
+        from wouso.middleware.profiling import ViewProfile
+
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        handler = Handler()
+        logging.getLogger('wouso.profiling').addHandler(handler)
+        middleware = list(settings.MIDDLEWARE_CLASSES) + ['wouso.middleware.ProfilingMiddleware']
+        try:
+            with override_settings(MIDDLEWARE_CLASSES=middleware, PROFILING_QUERY_BUDGETS={self.VIEW: 1}):
+                client = Client()
+                client.login(username='admin', password='admin')
+                client.get(reverse('formulas'))
+                client.get(reverse('formulas'))
+                response = client.get(reverse('profiling'))
+                json_response = client.get(reverse('profiling_json'))
+        finally:
+            logging.getLogger('wouso.profiling').removeHandler(handler)
+
+        # the budget cursor of the last request is not left behind
+        self.assertFalse('make_debug_cursor' in connections[DEFAULT_DB_ALIAS].__dict__)
+        stats = dict((s['view'], s) for s in ViewProfile.stats())
+        self.assertEqual(stats[self.VIEW]['count'], 2)
+        self.assertEqual(stats[self.VIEW]['over_budget'], 2)
+        self.assertTrue(stats[self.VIEW]['avg_queries'] > 1)
+        self.assertEqual(sum(stats[self.VIEW]['query_histogram']), 2)
+        self.assertEqual(len(records), 2)
+        self.assertTrue(self.VIEW in records[0])
+        self.assertContains(response, self.VIEW)
+        self.assertContains(json_response, self.VIEW)
+
+    def test_rolling_window(self):
+        from wouso.middleware.profiling import ViewProfile
+
+        now = 1000 * ViewProfile.PERIOD
+        ViewProfile.record('a.view', 0.2, 10, now=now - ViewProfile.PERIODS * ViewProfile.PERIOD)
+        ViewProfile.record('a.view', 0.1, 4, hits=2, misses=1, now=now)
+        ViewProfile.record('a.view', 0.3, 8, now=now)
+
+        stats = ViewProfile.stats(now=now)
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['count'], 2)
+        self.assertEqual(stats[0]['max_queries'], 8)
+        self.assertEqual(stats[0]['avg_queries'], 6)
+        self.assertEqual((stats[0]['hits'], stats[0]['misses']), (2, 1))
@@ -89,6 +89,8 @@ name='roles_create'),
     (r'^forum/', include('wouso.interface.forum.cpanel_urls')),
 
     url(r'^activity_monitor/$', 'wouso.interface.cpanel.views.activity_monitor', name='activity_monitor'),
+    url(r'^profiling/$', 'wouso.interface.cpanel.views.profiling', name='profiling'),
+    url(r'^profiling/json/$', 'wouso.interface.cpanel.views.profiling_json', name='profiling_json'),
 
     url(r'^reports/$', 'wouso.interface.cpanel.views.reports', name='reports'),
     url(r'^reports/edit/(?P<pk>\d+)/$', 'wouso.interface.cpanel.views.edit_report', name='edit_report'),
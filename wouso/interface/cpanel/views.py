@@ -1,4 +1,5 @@
 import datetime
+import json
 from django import forms
 from django.conf import settings
 from django.contrib import messages
@@ -22,6 +23,7 @@ from wouso.core.config.models import Setting, IntegerSetting, IntegerListSetting
 from wouso.core.decorators import staff_required
 from wouso.core.ui import get_sidebar
 from wouso.core.user.models import Player, PlayerGroup, Race
+from wouso.core.user.presence import Presence
 from wouso.core.magic.models import Artifact, ArtifactGroup, Spell
 from wouso.core.qpool.models import Schedule, Question, Tag, Category, Answer
 from wouso.core.qpool import get_questions_with_category
@@ -39,6 +41,7 @@ from wouso.interface.cpanel.models import Customization, Switchboard, \
 from wouso.interface.forms import InstantSearchForm
 from wouso.interface.apps.qproposal import QUEST_GOLD, CHALLENGE_GOLD, QOTD_GOLD
 from wouso.middleware.impersonation import ImpersonateMiddleware
+from wouso.middleware.profiling import ViewProfile
 from wouso.utils.import_questions import import_from_file
 from forms import TagsForm, UserForm, SpellForm, AddTagForm,\
     EditReportForm, RaceForm, PlayerGroupForm, RoleForm, \
@@ -79,9 +82,7 @@ class StatusView(TemplateView):
             last_run = "wousocron was never run"
 
         # online members
-        oldest = datetime.datetime.now() - datetime.timedelta(minutes=10)
-        online_last10 = Player.objects.filter(last_seen__gte=oldest).order_by(
-            '-last_seen')
+        online_last10 = Presence.online_players()
 
         # number of players which can play
         cp_number = Player.objects.filter(race__can_play=True).count()
@@ -1163,6 +1164,24 @@ class ActivityMonitorView(ListView):
 activity_monitor = staff_required(ActivityMonitorView.as_view())
 
 
+@staff_required
+def profiling(request):
+    stats = ViewProfile.stats()
+    for s in stats:
+        s['time_histogram'] = zip(ViewProfile.bucket_labels(ViewProfile.TIME_BUCKETS), s['time_histogram'])
+        s['query_histogram'] = zip(ViewProfile.bucket_labels(ViewProfile.QUERY_BUCKETS), s['query_histogram'])
+    return render_to_response('cpanel/profiling.html',
+                              {'stats': stats, 'minutes': ViewProfile.PERIOD * ViewProfile.PERIODS / 60},
+                              context_instance=RequestContext(request))
+
+
+@staff_required
+def profiling_json(request):
+    data = {'time_buckets': ViewProfile.TIME_BUCKETS, 'query_buckets': ViewProfile.QUERY_BUCKETS,
+            'period': ViewProfile.PERIOD * ViewProfile.PERIODS, 'views': ViewProfile.stats()}
+    return HttpResponse(json.dumps(data), mimetype='application/json')
+
+
 class StaticPagesView(ListView):
     template_name = 'cpanel/static_pages.html'
     model = StaticPage
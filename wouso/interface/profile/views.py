@@ -3,7 +3,6 @@ from datetime import date
 from django import forms
 from django.core.exceptions import ValidationError
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.core import serializers
 from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render_to_response, get_object_or_404, redirect
@@ -17,7 +16,7 @@ from wouso.core.scoring.models import History
 from wouso.core.user.models import Player, PlayerGroup, Race
 from wouso.games.challenge.models import Challenge
 from wouso.games.specialquest.models import SpecialQuestGame
-from wouso.interface.activity.models import Activity
+from wouso.interface.activity.models import ActivityFeed
 from wouso.interface.top.models import TopUser, GroupHistory, NewHistory, ObjectHistory
 
 
@@ -82,21 +81,12 @@ def save_profile(request):
 def user_profile(request, id, page=u'1'):
     profile = get_object_or_404(Player, id=id)
 
-    activity_list = Activity.get_player_activity(profile)
+    # paged by the before argument, page is kept for old links
+    activity = ActivityFeed.page(ActivityFeed.PLAYER, profile.id, before=request.GET.get('before'), limit=10)
 
     top_user = profile.get_extension(TopUser)
     history = History.user_points(profile.user)
-    paginator = Paginator(activity_list, 10)
 
-    try:
-        activity = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        activity = paginator.page(paginator.num_pages)
-
-        # some hackish introspection
-        if hasattr(g, 'user_model'):
-            model = getattr(g, 'user_model')
-            setattr(profile, model.__name__.lower(), profile.get_extension(model))
     #Fix to show succes message from report user form
     if 'report_msg' in request.session:
         message = request.session['report_msg']
@@ -136,12 +126,7 @@ def player_group(request, id, page=u'1'):
     for g in group.sisters:
         g.top = GroupHistory(g)
 
-    activity_list = Activity.get_group_activiy(group)
-    paginator = Paginator(activity_list, 10)
-    try:
-        activity = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        activity = paginator.page(paginator.num_pages)
+    activity = ActivityFeed.page(ActivityFeed.GROUP, group.id, before=request.GET.get('before'), limit=10)
 
     return render_to_response('profile/group.html',
                               {'group': group,
@@ -158,9 +143,7 @@ def player_race(request, race_id):
     race = get_object_or_404(Race, pk=race_id)
 
     top_users = race.player_set.order_by('-points')
-    activity_qs = Activity.get_race_activity(race)
-    paginator = Paginator(activity_qs, 20)
-    activity = paginator.page(1)
+    activity = ActivityFeed.page(ActivityFeed.RACE, race.id, before=request.GET.get('before'), limit=20)
 
     # get top position
     races = list(Race.objects.filter(can_play=True))
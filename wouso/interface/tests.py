@@ -1,6 +1,9 @@
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from wouso.core.tests import WousoTest
+from wouso.core.ui import BlockLibrary, BlockCache, invalidate_blocks, get_library
+from wouso.core.config.models import BoolSetting
+from wouso.interface.apps.messaging.models import Message, MessageApp
 from bs4 import BeautifulSoup
 
 class TestInterface(WousoTest):
@@ -45,4 +48,56 @@ class TestInterface(WousoTest):
         response = self.client.get('/hub')
         soup  = BeautifulSoup(response.content, "html.parser")
         button = soup.find_all(id="head-cpanel")
-        self.assertEqual(len(button), 0)
\ No newline at end of file
+        self.assertEqual(len(button), 0)
+
+
+class TestBlockCache(WousoTest):
+    def setUp(self):
+        super(TestBlockCache, self).setUp()
+        self.calls = []
+        self.library = BlockLibrary('test')
+
+    def block(self, context):
+        self.calls.append(context['user'])
+        return 'block of %s' % context['user']
+
+    def test_player_scope(self):
+        self.library.add('block', self.block, BlockCache(BlockCache.PLAYER, keys=('test',)))
+        user1, user2 = self._get_player(1).user, self._get_player(2).user
+
+        self.assertEqual(self.library.get_block('block', {'user': user1}), 'block of %s' % user1)
+        self.assertEqual(self.library.get_block('block', {'user': user1}), 'block of %s' % user1)
+        self.assertEqual(self.library.get_block('block', {'user': user2}), 'block of %s' % user2)
+        self.assertEqual(len(self.calls), 2)
+
+        invalidate_blocks('test', user1.get_profile().id)
+        self.library.get_block('block', {'user': user1})
+        self.library.get_block('block', {'user': user2})
+        self.assertEqual(len(self.calls), 3)
+
+        invalidate_blocks('test')
+        self.library.get_block('block', {'user': user2})
+        self.assertEqual(len(self.calls), 4)
+
+    def test_global_scope(self):
+        self.library.add('block', self.block, BlockCache(keys=('test',)))
+        user1, user2 = self._get_player(1).user, self._get_player(2).user
+
+        self.library.get_block('block', {'user': user1})
+        self.assertEqual(self.library.get_block('block', {'user': user2}), 'block of %s' % user1)
+        self.assertEqual(len(self.calls), 1)
+
+        # settings changes drop all blocks
+        BoolSetting.get('test-block').set_value(True)
+        self.library.get_block('block', {'user': user2})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_message_header(self):
+        # registers the header link
+        import wouso.interface.apps.messaging.views
+        BoolSetting.get('setting-%s' % MessageApp.name()).set_value(True)
+        player = self._get_player(1)
+        header = get_library('header')
+        self.assertEqual(header.get_block('messaging', {'user': player.user})['count'], 0)
+        Message.send(None, player, 'subject', 'text')
+        self.assertEqual(header.get_block('messaging', {'user': player.user})['count'], 1)
@@ -0,0 +1,164 @@
+"""
+Recorded tops, kept in memory as compact arrays.
+
+The last WEEK recorded days of every top (players, races, groups inside
+races, coins) are loaded at once, after each top calculation, and stored in
+cache as parallel arrays of ids, positions and points ordered by position.
+Each process keeps the arrays it loaded until the snapshot token in cache
+changes, so positions, pages and evolutions are read without queries.
+"""
+from array import array
+from uuid import uuid4
+from django.core.cache import cache
+
+
+class LeaderboardDay(object):
+    """ One recorded top, ordered by position """
+
+    def __init__(self, date, ids, positions, points):
+        self.date = date
+        self.ids = ids
+        self.positions = positions
+        self.points = points
+        self._index = None
+
+    def index(self, id):
+        """ Return the offset of id in the arrays, or None """
+        if self._index is None:
+            self._index = dict((id, i) for i, id in enumerate(self.ids))
+        return self._index.get(id)
+
+    def dump(self):
+        return self.date, self.ids.tostring(), self.positions.tostring(), self.points.tostring()
+
+    @classmethod
+    def load(cls, data):
+        date, ids, positions, points = data
+        return cls(date, array('i', ids), array('i', positions), array('d', points))
+
+
+class Leaderboard(object):
+    """ The recorded days of a top, the most recent first """
+
+    def __init__(self, days=()):
+        self.days = list(days)
+
+    @property
+    def latest(self):
+        return self.days[0] if self.days else None
+
+    def __len__(self):
+        return len(self.days[0].ids) if self.days else 0
+
+    def position(self, id, day=0):
+        """ Return the position of id in the top recorded day days ago, 0 if missing """
+        if day >= len(self.days):
+            return 0
+        i = self.days[day].index(id)
+        return 0 if i is None else self.days[day].positions[i]
+
+    def points(self, id, day=0):
+        if day >= len(self.days):
+            return 0
+        i = self.days[day].index(id)
+        return 0 if i is None else self.days[day].points[i]
+
+    def page(self, start, stop):
+        """ Return (id, position, points) rows of the latest top, from start to stop offsets """
+        day = self.latest
+        if day is None:
+            return []
+        return zip(day.ids[start:stop], day.positions[start:stop], day.points[start:stop])
+
+    def evolution(self, id):
+        """ Return (position, points) pairs of id in the recorded days, the most recent first """
+        ret = []
+        for day in self.days:
+            i = day.index(id)
+            if i is not None:
+                ret.append((day.positions[i], day.points[i]))
+        return ret
+
+
+class LeaderboardSnapshot(object):
+    CACHE_KEY = 'top-leaderboard'
+    TOKEN_KEY = 'top-leaderboard-token'
+    TIMEOUT = 2 * 24 * 60 * 60
+    WEEK = 7
+    # players global top, recorded in History
+    PLAYERS = ('u', None, None)
+
+    _local = None
+
+    def __init__(self, token, boards):
+        self.token = token
+        # (object type, relative to type, relative to id): Leaderboard
+        self.boards = boards
+
+    def board(self, object_type, relative_to_type=None, relative_to=None):
+        return self.boards.get((object_type, relative_to_type, relative_to), Leaderboard())
+
+    @property
+    def players(self):
+        return self.board(*self.PLAYERS)
+
+    @classmethod
+    def build(cls):
+        """ Load the recorded tops from the database and store them in cache """
+        from wouso.interface.top.models import History, NewHistory
+
+        rows = {}
+        players = History.objects.filter(relative_to__isnull=True, user__isnull=False)
+        dates = players.values_list('date', flat=True).distinct().order_by('-date')[:cls.WEEK]
+        history = players.filter(date__in=list(dates))
+        for date, id, position, points in history.values_list('date', 'user', 'position',
+                                                               'points'):
+            rows.setdefault(cls.PLAYERS, {}).setdefault(date, []).append((position, id, points))
+
+        dates = NewHistory.objects.values_list('date', flat=True).distinct().order_by('-date')
+        dates = dates[:cls.WEEK]
+        history = NewHistory.objects.filter(date__in=list(dates))
+        for object_type, relative_to_type, relative_to, date, id, position, points in \
+                history.values_list('object_type', 'relative_to_type', 'relative_to', 'date',
+                                    'object', 'position', 'points'):
+            key = (object_type, relative_to_type, relative_to)
+            rows.setdefault(key, {}).setdefault(date, []).append((position, id, points))
+
+        data = {}
+        for key, days in rows.iteritems():
+            data[key] = []
+            for date in sorted(days, reverse=True)[:cls.WEEK]:
+                ranked = sorted(days[date])
+                day = LeaderboardDay(date, array('i', [r[1] for r in ranked]),
+                                     array('i', [r[0] for r in ranked]),
+                                     array('d', [r[2] or 0 for r in ranked]))
+                data[key].append(day.dump())
+
+        token = uuid4().hex
+        cache.set(cls.CACHE_KEY, (token, data), cls.TIMEOUT)
+        cache.set(cls.TOKEN_KEY, token, cls.TIMEOUT)
+        return cls._set_local(token, data)
+
+    @classmethod
+    def _set_local(cls, token, data):
+        boards = dict((key, Leaderboard(LeaderboardDay.load(d) for d in days))
+                      for key, days in data.iteritems())
+        LeaderboardSnapshot._local = cls(token, boards)
+        return LeaderboardSnapshot._local
+
+    @classmethod
+    def get(cls):
+        """ Return the snapshot, reusing the one loaded by this process if it is current """
+        token = cache.get(cls.TOKEN_KEY)
+        local = LeaderboardSnapshot._local
+        if token is not None and local is not None and local.token == token:
+            return local
+        stored = cache.get(cls.CACHE_KEY)
+        if stored is None or stored[0] != token:
+            return cls.build()
+        return cls._set_local(*stored)
+
+    @classmethod
+    def drop(cls):
+        cache.delete(cls.TOKEN_KEY)
+        cache.delete(cls.CACHE_KEY)
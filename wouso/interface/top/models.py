@@ -1,15 +1,29 @@
 from django.db.models import Sum
-import logging
 import sys
+import time
 from datetime import datetime, timedelta
-from django.db import models
+from django.db import models, transaction
 from django.template.loader import render_to_string
-from wouso.core.common import App
+from wouso.core.common import App, bulk_insert
 from wouso.core.config.models import BoolSetting, Setting
 from wouso.core.scoring import Coin
-from wouso.core.ui import register_sidebar_block
+from wouso.core.scoring.models import CoinBalance
+from wouso.core.ui import register_sidebar_block, invalidate_blocks, BlockCache
 from wouso.core.user.models import Player, PlayerGroup, Race
-from wouso.games.challenge.models import ChallengeUser
+from wouso.interface.top.leaderboard import LeaderboardSnapshot
+from wouso.games.challenge.models import ChallengeStats
+
+
+def competition_ranking(scores):
+    """
+    Given (id, score) pairs sorted by decreasing score, yield (id, score, position)
+    triples. Equal scores share a position, and the next one skips ahead: 1, 2, 2, 4.
+    """
+    position, previous = 0, None
+    for i, (pk, score) in enumerate(scores):
+        if score != previous:
+            position, previous = i + 1, score
+        yield pk, score, position
 
 
 class ObjectHistory:
@@ -41,54 +55,56 @@ class GroupHistory(ObjectHistory):
 
 class TopUser(ObjectHistory, Player):
     _history = None
+    _evolution = None
 
     @property
     def progress(self):
         """ Return position difference between last two recorded positions. """
-        try:
-            yesterday = History.objects.filter(user=self, relative_to=None).order_by('-date')[0]
-            daybefore = History.objects.filter(user=self, relative_to=None).order_by('-date')[1]
-        except Exception as e:
+        hs = self.evolution()
+        if len(hs) < 2:
             return 0
-        return - (yesterday.position - daybefore.position)
+        return - (hs[0][0] - hs[1][0])
+
+    _challenge_stats = None
+
+    @property
+    def challenge_stats(self):
+        """ Challenge results, see ChallengeStats.attach to load them for many players at once """
+        if self._challenge_stats is None:
+            self._challenge_stats = ChallengeStats.get_for(self)
+        return self._challenge_stats
 
     @property
     def played_challenges(self):
-        return self.get_extension(ChallengeUser).get_all_challenges().count()
+        return self.challenge_stats.sent + self.challenge_stats.received
 
     @property
     def won_challenges(self):
-        return self.get_extension(ChallengeUser).get_won_challenges().count()
+        return self.challenge_stats.won
 
     @property
     def lost_challenges(self):
-        return self.get_extension(ChallengeUser).get_lost_challenges().count()
+        return self.challenge_stats.lost
 
     @property
     def draw_challenges(self):
-        return self.get_extension(ChallengeUser).get_draw_challenges().count()
+        return self.challenge_stats.draw
 
     @property
     def win_percentage(self):
-        return self.get_extension(ChallengeUser).get_win_percentage()
+        return self.challenge_stats.win_percentage
 
     @property
     def weeklyprogress(self):
-        hs = self.history()
-        try:
-            yesterday = hs[0]
-            day1weekprior = hs[-1]
-        except Exception as e:
-            logging.exception(e)
+        hs = self.evolution()
+        if not hs:
             return 0
-        return -(yesterday.position - day1weekprior.position)
+        return -(hs[0][0] - hs[-1][0])
 
     @property
     def position(self):
-        try:
-            return self.history()[0].position
-        except IndexError:
-            return 0
+        hs = self.evolution()
+        return hs[0][0] if hs else 0
 
     @property
     def coin_position(self):
@@ -113,20 +129,27 @@ class TopUser(ObjectHistory, Player):
         self._history = list(History.objects.filter(user=self, relative_to=None).order_by('-date')[:7])
         return self._history
 
+    def evolution(self):
+        """ (position, points) pairs of the recorded global tops of the last week, the latest first """
+        if self._evolution is None:
+            self._evolution = LeaderboardSnapshot.get().players.evolution(self.id)
+        return self._evolution
+
     def week_evolution(self, relative_to=None):
         """ :return: list of pairs (index, position) for the last week """
         if relative_to is None:
-            hs = self.history()
+            hs = [position for position, points in self.evolution()]
         else:
-            hs = self.history().filter(relative_to=relative_to).order_by('-date')[:7]
+            hs = History.objects.filter(user=self, relative_to=relative_to).order_by('-date')[:7]
+            hs = [h.position for h in hs]
         tot = len(hs)
-        return [(tot - i, h.position) for (i, h) in enumerate(hs)]
+        return [(tot - i, position) for (i, position) in enumerate(hs)]
 
     def week_points_evolution(self):
         """ :return: list of pairs (index, points) for the last week """
-        hs = self.history()
+        hs = self.evolution()
         tot = len(hs)
-        return [(tot - i, h.points) for (i, h) in enumerate(hs)]
+        return [(tot - i, points) for (i, (position, points)) in enumerate(hs)]
 
 
 Player.register_extension('top', TopUser)
@@ -158,11 +181,9 @@ class NewHistory(models.Model):
         """
          Return the latest position computed for this object (user, race, group)
         """
-        history = cls.objects.filter(object=obj.id, object_type=cls._get_type(obj),
-                                     relative_to=relative_to.id, relative_to_type=cls._get_type(relative_to)).order_by('-date')
-        if not history.count():
-            return 0
-        return history[0].position
+        board = LeaderboardSnapshot.get().board(cls._get_type(obj), cls._get_type(relative_to),
+                                                relative_to.id if relative_to else None)
+        return board.position(obj.id)
 
     @classmethod
     def get_children_top(cls, obj, type):
@@ -185,13 +206,24 @@ class NewHistory(models.Model):
         """
         return cls.get_obj_position(group, relative_to)
 
+    @classmethod
+    def latest_date(cls, object_type):
+        """
+         Return the date of the latest race ('r') or group ('g') top, None if there is none
+        """
+        qs = cls.objects.filter(object_type=object_type, relative_to_type='r' if object_type == 'g' else None)
+        return qs.aggregate(date=models.Max('date'))['date']
+
     @classmethod
     def get_coin_top(cls, coin):
-        try:
-            last_day = NewHistory.objects.filter(relative_to_type='c', relative_to=coin.id).order_by('-date')[0]
-        except IndexError:
+        """
+         Return the latest recorded top for the coin, ordered by position
+        """
+        qs = NewHistory.objects.filter(relative_to_type='c', relative_to=coin.id)
+        last_day = qs.aggregate(date=models.Max('date'))['date']
+        if last_day is None:
             return NewHistory.objects.none()
-        return NewHistory.objects.filter(date=last_day.date, relative_to_type='c', relative_to=coin.id).order_by('position')
+        return qs.filter(date=last_day).order_by('position', 'object')
 
     @classmethod
     def _get_type(cls, object):
@@ -216,6 +248,8 @@ class History(models.Model):  # TODO: deprecate (maybe), check if NewHistory cov
 
     @classmethod
     def get_user_position(kls, user, relative_to=None):
+        if relative_to is None:
+            return LeaderboardSnapshot.get().players.position(user.id)
         try:
             history = History.objects.filter(user=user, relative_to=relative_to).order_by('-date')[0]
             return history.position
@@ -239,6 +273,9 @@ class History(models.Model):  # TODO: deprecate (maybe), check if NewHistory cov
 
 
 class Top(App):
+    SIDEBAR_SIZE = 10
+    # expired spells and challenges change points
+    management_task_depends = ('bazaar', 'challengegame')
 
     @classmethod
     def get_sidebar_widget(kls, context):
@@ -246,7 +283,7 @@ class Top(App):
             return ''
 
         top5 = TopUser.objects.exclude(user__is_superuser=True).exclude(race__can_play=False)
-        top5 = top5.order_by('-points')[:10]
+        top5 = top5.order_by('-points')[:kls.SIDEBAR_SIZE]
         # is_top = request.get_full_path().startswith('/top/')
         is_top = context.get('top', False)
 
@@ -263,39 +300,26 @@ class Top(App):
         now = now if now is not None else datetime.now()
         today = now.date()
 
-        # Global ladder
-        stdout.write(' Updating players...\n')
-        for i, u in enumerate(Player.objects.all().order_by('-points')):
-            topuser = u.get_extension(TopUser)
-            position = i + 1
-            hs, new = History.objects.get_or_create(user=topuser, date=today, relative_to=None)
-            hs.position, hs.points = position, u.points
-            hs.save()
-
-        stdout.write(' Updating group history...\n')
-        for p in PlayerGroup.objects.filter(owner=None):
-            p.points = p.live_points
-            p.save()
-
-        for r in Race.objects.all():
-            for i, g in enumerate(r.children.annotate(lpoints=Sum('players__points')).order_by('-lpoints')):
-                hs = NewHistory.record(g, today, relative_to=r)
-                hs.position, hs.points = i + 1, g.points
-                hs.save()
+        def phase(message, function, *args):
+            stdout.write(' %s...' % message)
+            start = time.time()
+            count = function(*args)
+            stdout.write(' %d rows in %.2fs\n' % (count, time.time() - start))
+            return count
 
-        stdout.write(' Updating race history...\n')
-        race_data = [(race, race.points) for race in Race.objects.all() if race.can_play]
-        # sort by number of points, decreasing order
-        race_data = sorted(race_data, key=lambda r: r[1], reverse=True)
-        for i, rd in enumerate(race_data):
-            hs = NewHistory.record(rd[0], today, relative_to=None)
-            hs.position, hs.points = i + 1, rd[1]
-            hs.save()
+        with transaction.commit_on_success():
+            rows = phase('Updating players', cls.update_players_top, today)
+            rows += phase('Updating group history', cls.update_groups_top, today)
+            rows += phase('Updating race history', cls.update_races_top, today)
 
-        # Check for coin tops
-        coin_tops = cls.coin_top_settings()
-        for c in coin_tops:
-            cls.coin_top(c, today, stdout=stdout)
+            # Check for coin tops
+            coin_tops = cls.coin_top_settings()
+            for c in coin_tops:
+                rows += phase('Calculating coin %s top' % c, cls.coin_top, c, today, stdout)
+
+        LeaderboardSnapshot.build()
+        invalidate_blocks('top')
+        return rows
 
         # I don't think these are necessary, so I'm disabling them for now
         return
@@ -314,25 +338,80 @@ class Top(App):
                 hs.position, hs.points = i + 1, u.points
                 hs.save()
 
+    @classmethod
+    def update_players_top(cls, today):
+        """
+        Record the global ladder for today, replacing any previous run of the same day.
+        Return the number of recorded positions.
+        """
+        # Only new players are missing their extension
+        for p in Player.objects.exclude(id__in=TopUser.objects.values_list('pk', flat=True)):
+            p.get_extension(TopUser)
+
+        ranking = Player.objects.order_by('-points', 'id').values_list('id', 'points')
+        History.objects.filter(date=today, relative_to=None, user__isnull=False).delete()
+        return bulk_insert(History, [History(user_id=pk, date=today, relative_to=None,
+                                             position=i + 1, points=points or 0)
+                                     for i, (pk, points) in enumerate(ranking)])
+
+    @classmethod
+    def update_groups_top(cls, today):
+        """
+        Update core groups points and record groups position inside their race.
+        """
+        groups = list(PlayerGroup.objects.annotate(lpoints=Sum('players__points')))
+        for g in groups:
+            if g.owner_id is None:
+                live_points = int(g.lpoints or 0)
+                if g.points != live_points:
+                    PlayerGroup.objects.filter(pk=g.pk).update(points=live_points)
+                    g.points = live_points
+
+        ranked = sorted([g for g in groups if g.parent_id],
+                        key=lambda g: (g.parent_id, -(g.lpoints or 0), g.id))
+        rows, position, parent = [], 0, None
+        for g in ranked:
+            position = position + 1 if g.parent_id == parent else 1
+            parent = g.parent_id
+            rows.append(NewHistory(object=g.id, object_type='g', relative_to=parent, relative_to_type='r',
+                                   date=today, position=position, points=g.points))
+
+        NewHistory.objects.filter(date=today, object_type='g', relative_to_type='r').delete()
+        return bulk_insert(NewHistory, rows)
+
+    @classmethod
+    def update_races_top(cls, today):
+        """
+        Record the position of playable races, by the sum of their members points.
+        """
+        races = Race.objects.filter(can_play=True).annotate(total=Sum('player__points'))
+        ranked = sorted(races, key=lambda r: (-(r.total or 0), r.id))
+
+        NewHistory.objects.filter(date=today, object_type='r', relative_to__isnull=True).delete()
+        return bulk_insert(NewHistory, [NewHistory(object=r.id, object_type='r', date=today,
+                                                   position=i + 1, points=r.total or 0)
+                                        for i, r in enumerate(ranked)])
+
     @classmethod
     def coin_top(cls, coin, now, stdout=sys.stdout):
         """
-        Calculate and record a new top for a coin
+        Calculate and record a new top for a coin, from the players coin balances.
+        Players having the same amount share the same position.
         """
         coin_obj = Coin.get(coin)
         if not coin_obj:
             stdout.write('No such coin %s' % coin)
-            return
+            return 0
 
-        stdout.write(' Calculating coin %s top...' % coin)
-        players = list(Player.objects.filter(race__can_play=True))
-        players.sort(lambda b, a: a.coins.get(coin) - b.coins.get(coin))
-        for i, p in enumerate(players):
-            hs = NewHistory.record(p, now, relative_to=coin_obj)
-            hs.position, hs.points = i + 1, p.coins.get(coin_obj.name)
-            hs.save()
+        amounts = dict(CoinBalance.objects.filter(coin=coin_obj).values_list('user', 'amount'))
+        players = Player.objects.filter(race__can_play=True).values_list('id', 'user')
+        scores = sorted(((pk, coin_obj.format_value(amounts.get(user, 0))) for pk, user in players),
+                        key=lambda s: (-s[1], s[0]))
 
-        stdout.write('\n')
+        NewHistory.objects.filter(date=now, relative_to=coin_obj.id, relative_to_type='c').delete()
+        return bulk_insert(NewHistory, [NewHistory(object=pk, object_type='u', relative_to=coin_obj.id,
+                                                   relative_to_type='c', date=now, position=position, points=points)
+                                        for pk, points, position in competition_ranking(scores)])
 
     @classmethod
     def coin_top_settings(cls):
@@ -349,7 +428,8 @@ class Top(App):
         return NewHistory.get_obj_position(user, relative_to=coin)
 
 
-register_sidebar_block('top', Top.get_sidebar_widget)
+register_sidebar_block('top', Top.get_sidebar_widget, BlockCache(keys=('top',), vary=('top',)))
+
 # def user_post_save(sender, instance, **kwargs):
 #    profile = instance.get_profile()
 #    profile.get_extension(TopUser)
@@ -1,9 +1,102 @@
+from datetime import datetime, timedelta
+from StringIO import StringIO
+from wouso.core import scoring
+from wouso.core.config.models import Setting
+from wouso.core.scoring.models import Coin
 from wouso.core.tests import WousoTest
-from wouso.interface.top.models import TopUser
+from wouso.core.user.models import Race, PlayerGroup
+from wouso.interface.top.models import TopUser, Top, History, NewHistory
+from wouso.interface.top.leaderboard import LeaderboardSnapshot
 
 class TopTest(WousoTest):
     def test_challenges(self):
         player = self._get_player()
         top_player = player.get_extension(TopUser)
 
-        self.assertEqual(top_player.won_challenges, 0)
\ No newline at end of file
+        self.assertEqual(top_player.won_challenges, 0)
+
+
+class TopManagementTaskTest(WousoTest):
+    def setUp(self):
+        super(TopManagementTaskTest, self).setUp()
+        self.race = Race.objects.create(name='race_test', can_play=True)
+        self.group = PlayerGroup.objects.create(name='group_test', parent=self.race)
+        for i, points in enumerate((10, 30, 20)):
+            player = self._get_player(i)
+            player.points = points
+            player.race = self.race
+            player.save()
+            self.group.players.add(player)
+
+    def test_ladder(self):
+        Top.management_task(stdout=StringIO())
+        today = datetime.now().date()
+
+        positions = dict((h.user_id, h.position) for h in History.objects.filter(date=today, relative_to=None))
+        self.assertEqual(positions[self._get_player(1).id], 1)
+        self.assertEqual(positions[self._get_player(2).id], 2)
+        self.assertEqual(positions[self._get_player(0).id], 3)
+
+        race_top = NewHistory.objects.get(date=today, object_type='r', object=self.race.id)
+        self.assertEqual(race_top.points, 60)
+        group_top = NewHistory.objects.get(date=today, object_type='g', object=self.group.id)
+        self.assertEqual(group_top.position, 1)
+        self.assertEqual(PlayerGroup.objects.get(pk=self.group.pk).points, 60)
+
+    def test_rerun_same_day(self):
+        Top.management_task(stdout=StringIO())
+        Top.management_task(stdout=StringIO())
+        today = datetime.now().date()
+
+        player = self._get_player(1)
+        self.assertEqual(History.objects.filter(date=today, user=player.id, relative_to=None).count(), 1)
+        self.assertEqual(NewHistory.objects.filter(date=today, object_type='r', object=self.race.id).count(), 1)
+        self.assertEqual(player.get_extension(TopUser).position, 1)
+
+    def test_coin_top(self):
+        coin = Coin.add('karma')
+        Setting.get('setting-top-coins').set_value('karma')
+        scoring.score_simple(self._get_player(0), 'karma', 5)
+        scoring.score_simple(self._get_player(1), 'karma', 5)
+        scoring.score_simple(self._get_player(2), 'karma', 7)
+        Top.management_task(stdout=StringIO())
+
+        top = list(NewHistory.get_coin_top(coin))
+        self.assertEqual([(h.object, h.position, h.points) for h in top[:3]],
+                         [(self._get_player(2).id, 1, 7), (self._get_player(0).id, 2, 5),
+                          (self._get_player(1).id, 2, 5)])
+        self.assertEqual(Top.get_coin_position('karma', self._get_player(1)), 2)
+
+
+class LeaderboardSnapshotTest(WousoTest):
+    def setUp(self):
+        super(LeaderboardSnapshotTest, self).setUp()
+        self.players = [self._get_player(i).get_extension(TopUser) for i in range(3)]
+        today = datetime.now().date()
+        # yesterday 0, 1, 2, today 2, 0, 1
+        for days, order in ((1, (0, 1, 2)), (0, (2, 0, 1))):
+            for position, i in enumerate(order):
+                History.objects.create(user=self.players[i], date=today - timedelta(days=days), relative_to=None,
+                                       position=position + 1, points=10 * (3 - position))
+
+    def test_positions(self):
+        LeaderboardSnapshot.build()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.players[2].position, 1)
+            self.assertEqual(self.players[2].progress, 2)
+            self.assertEqual(self.players[0].weeklyprogress, -1)
+            self.assertEqual(self.players[1].week_evolution(), [(2, 3), (1, 2)])
+            self.assertEqual(self.players[2].week_points_evolution(), [(2, 30), (1, 10)])
+            self.assertEqual(History.get_user_position(self.players[1]), 3)
+
+    def test_page(self):
+        board = LeaderboardSnapshot.get().players
+        self.assertEqual(len(board), 3)
+        self.assertEqual(board.page(1, 3), [(self.players[0].id, 2, 20), (self.players[1].id, 3, 10)])
+        self.assertEqual(board.position(self.players[0].id, day=1), 1)
+
+    def test_management_task_rebuilds_snapshot(self):
+        self.assertEqual(LeaderboardSnapshot.get().players.position(self.players[0].id), 2)
+        TopUser.objects.filter(id=self.players[0].id).update(points=1000000)
+        Top.management_task(stdout=StringIO())
+        self.assertEqual(LeaderboardSnapshot.get().players.position(self.players[0].id), 1)
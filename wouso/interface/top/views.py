@@ -6,6 +6,7 @@ from django.template import RequestContext
 from django.http import Http404
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from wouso.core.user.models import PlayerGroup
+from wouso.games.challenge.models import ChallengeStats
 from wouso.interface.top.models import TopUser, Top, NewHistory
 
 PERPAGE = 20
@@ -118,7 +119,8 @@ def challenge_top(request, sortcritno='0', pageno=1):
     # sortcrit = 0 descending order of wins
     # sortcrit = 1 descending order of % wins
     # sortcrit = 2 descending order of losses
-    base_query = TopUser.objects.exclude(user__is_superuser=True).exclude(race__can_play=False)
+    base_query = ChallengeStats.attach(list(TopUser.objects.exclude(user__is_superuser=True).
+                                            exclude(race__can_play=False)))
 
     if sortcritno == '0':
         allUsers = sorted(base_query, key=lambda x: -x.won_challenges)
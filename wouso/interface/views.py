@@ -6,7 +6,6 @@ from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm
 from django.core import serializers
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.core.urlresolvers import reverse
 from django.db.models import Q
 from django.http import Http404, HttpResponseRedirect, HttpResponse
@@ -22,19 +21,14 @@ from wouso.core.game import get_games
 from wouso.interface.forms import *
 from wouso.core.user.models import Race
 from wouso.core.user.models import Player, PlayerGroup
-from wouso.interface.activity.models import Activity
+from wouso.core.user.presence import Presence
+from wouso.interface.activity.models import ActivityFeed
 from wouso.interface.top.models import Top, TopUser, History as TopHistory
 
 
-def get_wall(page=u'1'):
-    """ Returns activity for main wall, paginated."""
-    activity_list = Activity.get_global_activity()
-    paginator = Paginator(activity_list, 10)
-    try:
-        activity = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        activity = paginator.page(paginator.num_pages)
-    return activity
+def get_wall(before=None):
+    """ Returns activity for main wall, the window older than the activity id before """
+    return ActivityFeed.page(ActivityFeed.WALL, before=before, limit=10)
 
 def anonymous_homepage(request):
     return render_to_response('splash.html', context_instance=RequestContext(request))
@@ -94,7 +88,7 @@ def hub(request):
 
     # check first time
     profile = request.user.get_profile()
-    activity = Activity.get_player_activity(profile).count()
+    activity = len(ActivityFeed.page(ActivityFeed.PLAYER, profile.id, limit=2))
     if activity < 2:
         # first timer, show povestea
         from wouso.interface.apps.pages.models import StaticPage
@@ -107,15 +101,14 @@ def hub(request):
 
 
 def homepage(request, page=u'1'):
-    """ First page shown """
+    """ First page shown. The wall is paged by the before argument, page is kept for old links. """
     if request.user.is_anonymous():
         return anonymous_homepage(request)
 
     profile = request.user.get_profile()
     # gather users online in the last ten minutes
-    oldest = datetime.datetime.now() - datetime.timedelta(minutes = 10)
-    online_last10 = Player.objects.filter(last_seen__gte=oldest).order_by('-last_seen')
-    activity = get_wall(page)
+    online_last10 = Presence.online_players()
+    activity = get_wall(request.GET.get('before'))
 
     topuser = profile.get_extension(TopUser)
     topgroups = [profile.group] if profile.group else []
@@ -281,13 +274,7 @@ def all_activity(request):
     """
      Render all public activity, no matter race or game
     """
-    page = 1
-    activity_list = Activity.get_global_activity(wouso_only=False)
-    paginator = Paginator(activity_list, 100)
-    try:
-        activity = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        activity = paginator.page(paginator.num_pages)
+    activity = ActivityFeed.page(ActivityFeed.ALL, limit=100)
 
     return render_to_response('activity/all.html', {'activity': activity}, context_instance=RequestContext(request))
 
@@ -297,8 +284,7 @@ def seen_24h(request):
     """
     Display all players seen in the last 24h
     """
-    oldest = datetime.datetime.now() - datetime.timedelta(minutes = 3600)
-    online_last24h = Player.objects.filter(last_seen__gte=oldest).order_by('-last_seen')
+    online_last24h = Presence.online_players(minutes=3600)
 
     return render_to_response('activity/seen24h.html', {'seen_players': online_last24h}, context_instance=RequestContext(request))
 
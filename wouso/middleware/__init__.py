@@ -1,3 +1,4 @@
 from seen import Seen
 from debug import DebugExceptionMiddleware
-from impersonation import ImpersonateMiddleware
\ No newline at end of file
+from impersonation import ImpersonateMiddleware
+from profiling import ProfilingMiddleware
@@ -0,0 +1,233 @@
+import logging
+import traceback
+from hashlib import md5
+from time import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.db.backends.util import CursorDebugWrapper
+from wouso.core.decorators import cache_stats
+
+logger = logging.getLogger('wouso.profiling')
+
+
+class ViewProfile(object):
+    """ Rolling per view statistics: wall time, SQL count and time, cached_method hits and misses.
+
+    Requests are added to the current PERIOD seconds slot, kept in cache so
+    all processes share it. Every counter of a view has its own key, updated
+    with cache.incr, so concurrent requests don't lose counts; the maximums
+    are a get and set, and may miss a concurrent larger value. Statistics sum
+    up the last PERIODS slots. Times are kept in whole milliseconds.
+    """
+    VIEWS_KEY = 'profiling-views-%d'
+    VIEW_KEY = 'profiling-views-%d-%d'
+    SEEN_KEY = 'profiling-seen-%d-%s'
+    FIELD_KEY = 'profiling-%d-%s-%s'
+    PERIOD = 10 * 60
+    PERIODS = 6
+    # histogram upper bounds, the last bucket counts everything above
+    TIME_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+    QUERY_BUCKETS = (5, 10, 25, 50, 100, 250, 500)
+    SUMS = ('count', 'time', 'queries', 'sql_time', 'hits', 'misses', 'over_budget')
+    MAXIMUMS = ('max_time', 'max_queries')
+    HISTOGRAMS = (('time_histogram', TIME_BUCKETS), ('query_histogram', QUERY_BUCKETS))
+
+    @classmethod
+    def _slot(cls, now=None):
+        return int((now or time()) // cls.PERIOD)
+
+    @classmethod
+    def _timeout(cls):
+        return cls.PERIOD * (cls.PERIODS + 1)
+
+    @classmethod
+    def _bucket(cls, bounds, value):
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                return i
+        return len(bounds)
+
+    @classmethod
+    def _fields(cls):
+        """ Return the names of the counters kept per view """
+        fields = list(cls.SUMS + cls.MAXIMUMS)
+        for name, bounds in cls.HISTOGRAMS:
+            fields.extend('%s-%d' % (name, i) for i in range(len(bounds) + 1))
+        return fields
+
+    @classmethod
+    def _incr(cls, key, delta):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            if not cache.add(key, delta, cls._timeout()):
+                # added by somebody else meanwhile
+                cache.incr(key, delta)
+
+    @classmethod
+    def _register(cls, slot, view, digest):
+        """ Add view to the list of views seen in slot, once """
+        if not cache.add(cls.SEEN_KEY % (slot, digest), True, cls._timeout()):
+            return
+        key = cls.VIEWS_KEY % slot
+        cache.add(key, 0, cls._timeout())
+        try:
+            index = cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, cls._timeout())
+            index = 1
+        cache.set(cls.VIEW_KEY % (slot, index), view, cls._timeout())
+
+    @classmethod
+    def record(cls, view, seconds, queries, sql_seconds=0, hits=0, misses=0, over_budget=False,
+               now=None):
+        slot = cls._slot(now)
+        digest = md5(view).hexdigest()
+        cls._register(slot, view, digest)
+        milliseconds = int(round(seconds * 1000))
+        values = dict(count=1, time=milliseconds, queries=queries,
+                      sql_time=int(round(sql_seconds * 1000)), hits=hits, misses=misses,
+                      over_budget=1 if over_budget else 0)
+        values['time_histogram-%d' % cls._bucket(cls.TIME_BUCKETS, milliseconds)] = 1
+        values['query_histogram-%d' % cls._bucket(cls.QUERY_BUCKETS, queries)] = 1
+        for field, delta in values.iteritems():
+            if delta:
+                cls._incr(cls.FIELD_KEY % (slot, digest, field), delta)
+        for field, value in (('max_time', milliseconds), ('max_queries', queries)):
+            key = cls.FIELD_KEY % (slot, digest, field)
+            if value > (cache.get(key) or 0):
+                cache.set(key, value, cls._timeout())
+
+    @classmethod
+    def stats(cls, now=None):
+        """ Return the statistics of every view seen in the last PERIODS slots, slowest first """
+        current = cls._slot(now)
+        slots = range(current - cls.PERIODS + 1, current + 1)
+        counts = cache.get_many([cls.VIEWS_KEY % s for s in slots])
+        entries = [(s, cls.VIEW_KEY % (s, i))
+                   for s in slots for i in range(1, counts.get(cls.VIEWS_KEY % s, 0) + 1)]
+        names = cache.get_many([key for s, key in entries]) if entries else {}
+        pairs = set((s, names[key]) for s, key in entries if key in names)
+        fields = cls._fields()
+        keys = dict(((s, view, field), cls.FIELD_KEY % (s, md5(view).hexdigest(), field))
+                    for s, view in pairs for field in fields)
+        values = cache.get_many(keys.values()) if keys else {}
+
+        merged = {}
+        for (s, view, field), key in keys.iteritems():
+            total = merged.setdefault(view, dict((f, 0) for f in fields))
+            value = values.get(key, 0)
+            if field in cls.MAXIMUMS:
+                total[field] = max(total[field], value)
+            else:
+                total[field] += value
+
+        ret = []
+        for view, total in merged.iteritems():
+            for name, bounds in cls.HISTOGRAMS:
+                total[name] = [total.pop('%s-%d' % (name, i)) for i in range(len(bounds) + 1)]
+            count = total['count'] or 1
+            total.update(view=view, avg_time=float(total['time']) / count,
+                         avg_queries=float(total['queries']) / count,
+                         avg_sql_time=float(total['sql_time']) / count)
+            ret.append(total)
+        return sorted(ret, key=lambda r: r['time'], reverse=True)
+
+    @classmethod
+    def bucket_labels(cls, bounds):
+        return ['<= %d' % b for b in bounds] + ['> %d' % bounds[-1]]
+
+
+class _BudgetCursor(CursorDebugWrapper):
+    """ Debug cursor keeping the stack of the queries issued over the view budget """
+    def __init__(self, cursor, db, profile):
+        super(_BudgetCursor, self).__init__(cursor, db)
+        self.profile = profile
+
+    def execute(self, sql, params=()):
+        try:
+            return super(_BudgetCursor, self).execute(sql, params)
+        finally:
+            self.profile.check(sql)
+
+    def executemany(self, sql, param_list):
+        try:
+            return super(_BudgetCursor, self).executemany(sql, param_list)
+        finally:
+            self.profile.check(sql)
+
+
+class _RequestProfile(object):
+    # how many offending stacks are logged for a request
+    MAX_STACKS = 5
+
+    def __init__(self):
+        self.start = time()
+        self.offset = len(connection.queries)
+        self.use_debug_cursor = connection.use_debug_cursor
+        self.view = None
+        self.budget = None
+        self.stacks = []
+        cache_stats.reset()
+
+    @property
+    def queries(self):
+        return connection.queries[self.offset:]
+
+    def check(self, sql):
+        over = len(connection.queries) - self.offset > self.budget
+        if over and len(self.stacks) < self.MAX_STACKS:
+            # drop the frames of the cursor wrappers
+            self.stacks.append((sql, ''.join(traceback.format_stack()[:-3])))
+
+
+class ProfilingMiddleware(object):
+    """ Record wall time, SQL count and time and cached_method hits and misses per view,
+    see ViewProfile. Views issuing more queries than their budget are logged, with the
+    stacks of the queries over budget.
+
+    Budgets are set in PROFILING_QUERY_BUDGETS, a dictionary of dotted view name: count,
+    and PROFILING_DEFAULT_QUERY_BUDGET for the other views.
+    """
+    def process_request(self, request):
+        request._profile = _RequestProfile()
+        connection.use_debug_cursor = True
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, '_profile', None)
+        if profile is None:
+            return None
+        name = getattr(view_func, '__name__', view_func.__class__.__name__)
+        profile.view = '%s.%s' % (view_func.__module__, name)
+        budgets = getattr(settings, 'PROFILING_QUERY_BUDGETS', {})
+        default = getattr(settings, 'PROFILING_DEFAULT_QUERY_BUDGET', None)
+        profile.budget = budgets.get(profile.view, default)
+        if profile.budget is not None:
+            # connection is a proxy, the attribute has to be set on the connection itself
+            db = connections[DEFAULT_DB_ALIAS]
+            db.make_debug_cursor = lambda cursor: _BudgetCursor(cursor, db, profile)
+        return None
+
+    def process_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is None:
+            return response
+        connection.use_debug_cursor = profile.use_debug_cursor
+        db = connections[DEFAULT_DB_ALIAS]
+        if 'make_debug_cursor' in db.__dict__:
+            del db.make_debug_cursor
+        if profile.view is None:
+            # no view was resolved, as for 404s
+            return response
+
+        queries = profile.queries
+        over_budget = profile.budget is not None and len(queries) > profile.budget
+        ViewProfile.record(profile.view, time() - profile.start, len(queries),
+                           sum(float(q['time']) for q in queries), cache_stats.hits,
+                           cache_stats.misses, over_budget)
+        if over_budget:
+            logger.warning('%s issued %d queries, over its budget of %d, for %s\n%s', profile.view,
+                           len(queries), profile.budget, request.path,
+                           '\n'.join('%s\n%s' % (sql, stack) for sql, stack in profile.stacks))
+        return response
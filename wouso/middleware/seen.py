@@ -1,5 +1,5 @@
-from datetime import datetime
 from wouso.core import signals
+from wouso.core.user.presence import Presence
 
 class Seen:
     def process_request(self, request):
@@ -11,7 +11,7 @@ class Seen:
                 profile = None
 
             if profile:
-                if not profile.last_seen or profile.last_seen.hour != datetime.now().hour:
+                if Presence.seen(profile):
                     # Signal a new hour seen
                     signals.addActivity.send(sender=None,
                         game=None,
@@ -20,6 +20,4 @@ class Seen:
                         action='seen',
                         public=False,
                     )
-                profile.last_seen = datetime.now()
-                profile.save()
         return None
@@ -0,0 +1,285 @@
+"""
+Benchmarks for the game hot paths, run on generated data.
+
+Dataset.generate fills the database with N players spread over races and
+groups, challenge questions, recorded tops and activity. The same seed
+always gives the same data. Each benchmark case prepares its input once,
+then times a number of rounds. It reports wall time, the number of queries
+and the process peak memory. Results are plain dictionaries, written as
+JSON by the wousobench command and compared between runs.
+"""
+import json
+import random
+import resource
+import subprocess
+import time
+from datetime import datetime, timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.client import RequestFactory
+from wouso.core.common import bulk_insert
+
+PREFIX = 'bench'
+
+
+class Dataset(object):
+    def __init__(self, players=100, races=3, groups=6, questions=50, history_days=7, activities=10,
+                 seed=0):
+        self.players = players
+        self.races = races
+        self.groups = groups
+        self.questions = questions
+        self.history_days = history_days
+        self.activities = activities
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    @property
+    def parameters(self):
+        return dict(players=self.players, races=self.races, groups=self.groups,
+                    questions=self.questions, history_days=self.history_days,
+                    activities=self.activities, seed=self.seed)
+
+    def generate(self):
+        """ Create the dataset objects. Return self. """
+        from wouso.core import scoring
+        from wouso.core.qpool.models import Question, Answer, Category
+        from wouso.core.user.models import Player, PlayerGroup, Race
+        from wouso.games.challenge.models import ChallengeGame
+        from wouso.interface.activity.models import Activity, ActivityFeed
+        from wouso.interface.top.models import History
+
+        rand = self.random
+        scoring.setup_scoring()
+        ChallengeGame.get_instance().save()
+
+        races = [Race.objects.create(name='%s-race-%d' % (PREFIX, i), can_play=True)
+                 for i in range(self.races)]
+        groups = [PlayerGroup.objects.create(name='%s-group-%d' % (PREFIX, i),
+                                             parent=races[i % len(races)])
+                  for i in range(self.groups)]
+
+        # users and players are created in bulk, skipping the User post_save profile creation
+        User.objects.bulk_create([User(username='%s-%d' % (PREFIX, i),
+                                       email='%s-%d@example.com' % (PREFIX, i))
+                                  for i in range(self.players)])
+        users = User.objects.filter(username__startswith='%s-' % PREFIX).order_by('id')
+        Player.objects.bulk_create([Player(user=u, nickname=u.username, full_name=u.username,
+                                           points=rand.randint(0, 5000),
+                                           race=races[i % len(races)])
+                                    for i, u in enumerate(users)])
+        players = Player.objects.filter(user__in=users).order_by('id')
+        self.player_ids = list(players.values_list('id', flat=True))
+        Membership = PlayerGroup.players.through
+        Membership.objects.bulk_create([Membership(playergroup=groups[i % len(groups)],
+                                                   player_id=id)
+                                        for i, id in enumerate(self.player_ids)])
+
+        category = Category.add('challenge')
+        for i in range(self.questions):
+            q = Question.objects.create(text='%s question %d' % (PREFIX, i), active=True,
+                                        category=category)
+            Answer.objects.bulk_create([Answer(question=q, text='answer %d' % j, correct=j < 2)
+                                        for j in range(4)])
+
+        today = datetime.now().date()
+        for day in range(1, self.history_days + 1):
+            ids = list(self.player_ids)
+            rand.shuffle(ids)
+            History.objects.bulk_create([History(user_id=id, date=today - timedelta(days=day),
+                                                 relative_to=None, position=i + 1,
+                                                 points=len(ids) - i)
+                                         for i, id in enumerate(ids)])
+
+        now = datetime.now()
+        actions = ('seen', 'chall-won', 'chall-lost', 'qotd-correct')
+        activities = []
+        for id in self.player_ids:
+            for i in range(self.activities):
+                action = rand.choice(actions)
+                timestamp = now - timedelta(hours=rand.randint(1, 24 * 10))
+                activities.append(Activity(user_from_id=id, user_to_id=id, action=action,
+                                           timestamp=timestamp, message_string='', arguments='{}',
+                                           public=action != 'seen'))
+        bulk_insert(Activity, activities)
+        ActivityFeed.rebuild()
+        cache.clear()
+        return self
+
+    def player(self, i=None):
+        from wouso.core.user.models import Player
+
+        id = self.player_ids[i] if i is not None else self.random.choice(self.player_ids)
+        return Player.objects.get(pk=id)
+
+    def pairs(self, count):
+        """ Return count pairs of distinct players """
+        return [tuple(self.player(i) for i in self.random.sample(range(len(self.player_ids)), 2))
+                for n in range(count)]
+
+
+class Measure(object):
+    """ Time, queries and peak memory of the code run inside a with block """
+
+    def __enter__(self):
+        self._debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self._queries = len(connection.queries)
+        self._maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.time() - self._start
+        self.queries = len(connection.queries) - self._queries
+        self.maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.maxrss_growth = self.maxrss - self._maxrss
+        connection.use_debug_cursor = self._debug_cursor
+
+
+_cases = []
+
+
+def case(name):
+    """ Register a benchmark case. The decorated function gets the dataset and the number
+    of rounds, prepares its input and returns a function running one round, given its index.
+    """
+    def register(function):
+        _cases.append((name, function))
+        return function
+    return register
+
+
+def get_cases():
+    return [name for name, function in _cases]
+
+
+def run(dataset, rounds=10, names=None):
+    """ Run the cases, all of them or the named ones, and return a list of results """
+    results = []
+    for name, function in _cases:
+        if names and name not in names:
+            continue
+        step = function(dataset, rounds)
+        with Measure() as m:
+            for i in range(rounds):
+                step(i)
+        results.append(dict(name=name, rounds=rounds, seconds=m.seconds,
+                            per_round=m.seconds / rounds, queries=m.queries,
+                            queries_per_round=float(m.queries) / rounds,
+                            peak_memory_kb=m.maxrss, memory_growth_kb=m.maxrss_growth))
+    return results
+
+
+def report(dataset, results):
+    """ Return the JSON serializable report of a run """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(date=datetime.now().isoformat(), commit=commit, dataset=dataset.parameters,
+                results=results)
+
+
+def compare(old, new):
+    """ Return (name, old seconds per round, new seconds per round, ratio) for the cases in
+    both reports
+    """
+    previous = dict((r['name'], r) for r in old['results'])
+    ret = []
+    for r in new['results']:
+        if r['name'] in previous:
+            before = previous[r['name']]['per_round']
+            ratio = r['per_round'] / before if before else None
+            ret.append((r['name'], before, r['per_round'], ratio))
+    return ret
+
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+@case('scoring.score')
+def bench_score(dataset, rounds):
+    from wouso.core import scoring
+
+    players = [dataset.player() for i in range(rounds)]
+    return lambda i: scoring.score(players[i], None, 'bonus-points', points=10)
+
+
+@case('challenge.create')
+def bench_challenge_create(dataset, rounds):
+    from wouso.games.challenge.models import Challenge
+
+    pairs = dataset.pairs(rounds)
+    return lambda i: Challenge.create(*pairs[i])
+
+
+@case('challenge.set_played')
+def bench_challenge_played(dataset, rounds):
+    from wouso.games.challenge.models import Challenge
+
+    challenges = []
+    for user_from, user_to in dataset.pairs(rounds):
+        challenge = Challenge.create(user_from, user_to)
+        challenge.accept()
+        responses = {}
+        for q in challenge.questions.all():
+            answers = list(q.answers.values_list('id', flat=True))
+            responses[q.id] = dataset.random.sample(answers, 2)
+        for player in (user_from, user_to):
+            challenge.set_start(player)
+        challenges.append((challenge, user_from, user_to, responses))
+
+    def step(i):
+        challenge, user_from, user_to, responses = challenges[i]
+        challenge.set_played(user_from, responses)
+        challenge.set_played(user_to, responses)
+    return step
+
+
+@case('top.management_task')
+def bench_top(dataset, rounds):
+    from StringIO import StringIO
+    from wouso.interface.top.models import Top
+
+    return lambda i: Top.management_task(stdout=StringIO())
+
+
+@case('achievements.activity_handler')
+def bench_achievements(dataset, rounds):
+    from wouso.interface.activity.achievements import Achievements
+
+    players = [dataset.player() for i in range(rounds)]
+    return lambda i: Achievements.activity_handler(None, action='chall-won', user_from=players[i],
+                                                   user_to=players[i], game=None)
+
+
+@case('activity.player_feed')
+def bench_player_feed(dataset, rounds):
+    from wouso.interface.activity.models import ActivityFeed
+
+    players = [dataset.player() for i in range(rounds)]
+    return lambda i: list(ActivityFeed.page(ActivityFeed.PLAYER, players[i].id, limit=10))
+
+
+@case('middleware.seen')
+def bench_seen(dataset, rounds):
+    from wouso.middleware.seen import Seen
+
+    factory = RequestFactory()
+    requests = []
+    for i in range(rounds):
+        request = factory.get('/')
+        request.user = dataset.player().user
+        requests.append(request)
+    middleware = Seen()
+    return lambda i: middleware.process_request(requests[i])
@@ -21,4 +21,21 @@ class ImportQuestion(TestCase):
         self.assertTrue(question)
 
         self.assertEqual(question.text, "Question text")
-        self.assertEqual(question.answers.count(), 1)
\ No newline at end of file
+        self.assertEqual(question.answers.count(), 1)
+
+class BenchmarkTest(TestCase):
+    def test_run_cases(self):
+        from wouso.utils import benchmark
+
+        dataset = benchmark.Dataset(players=6, races=2, groups=2, questions=10, history_days=2, activities=2)
+        dataset.generate()
+        results = benchmark.run(dataset, rounds=2)
+
+        self.assertEqual([r['name'] for r in results], benchmark.get_cases())
+        for r in results:
+            self.assertEqual(r['rounds'], 2)
+            self.assertTrue(r['queries'] > 0 or r['name'] == 'middleware.seen')
+
+        report = benchmark.report(dataset, results)
+        comparison = benchmark.compare(report, report)
+        self.assertEqual(len(comparison), len(results))